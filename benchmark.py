@@ -0,0 +1,592 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from itertools import islice
+from typing import Callable, List, Tuple
+
+from file_system.client import FileSystemClient
+from file_system.file import Directory, File
+from file_system.file_system import FileSystem
+from file_system.journal import Journal, FSYNC_POLICIES
+from file_system.server import FileSystemServer
+from file_system.sharding import ShardedFileSystem
+from file_system.utils import is_directory, join_path
+
+
+def build_wide_tree(fs: FileSystem, width: int) -> None:
+    for i in range(width):
+        fs.make_new_dir('/wide/dir_{}'.format(i))
+        fs.make_new_file('/wide/dir_{}/file_{}'.format(i, i % 100))
+    fs.make_new_file('/wide/dir_0/needle')
+
+
+def build_deep_tree(fs: FileSystem, depth: int) -> None:
+    path = '/deep'
+    for i in range(depth):
+        path = join_path(path, 'level_{}'.format(i))
+        fs.make_new_file(join_path(path, 'file'))
+    fs.make_new_file(join_path(path, 'needle'))
+
+
+"""
+    the tree walking find used before the name index existed, kept here as the reference point
+"""
+def legacy_find(fs: FileSystem, name: str) -> List[str]:
+    stack = [(None, fs._current_dir)]
+    result = []
+
+    while stack:
+        this_path, this_dir = stack.pop()
+
+        if this_dir.get_name() == name and this_path is not None:
+            result.append(join_path(this_path, this_dir.get_name()))
+
+        if is_directory(this_dir):
+            next_path = '.' if this_path is None else join_path(this_path, this_dir.get_name())
+            for child in this_dir.get_all_children():
+                stack.append((next_path, child))
+
+    return result
+
+
+def time_it(func: Callable[[], object], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name: str, seconds: float) -> None:
+    print('{:<50}{:>16.3f} us'.format(name, seconds * 1e6))
+
+
+def bench_find(args: argparse.Namespace) -> None:
+    for shape, build, size in (('wide', build_wide_tree, args.width), ('deep', build_deep_tree, args.depth)):
+        fs = FileSystem()
+        build(fs, size)
+
+        assert sorted(legacy_find(fs, 'needle')) == fs.find('needle')
+        report('find {} ({}) tree walk'.format(shape, size), time_it(lambda: legacy_find(fs, 'needle'), args.repeat))
+        report('find {} ({}) name index'.format(shape, size), time_it(lambda: fs.find('needle'), args.repeat))
+
+
+def bench_resolve(args: argparse.Namespace) -> None:
+    for cache_size in (0, 4096):
+        fs = FileSystem(path_cache_size=cache_size)
+        build_deep_tree(fs, 50)
+        paths = [file_path for file_path in fs.find('file')]
+
+        def read_all() -> None:
+            for file_path in paths:
+                fs.cat(file_path)
+
+        report('cat 50 deep paths, cache size {}'.format(cache_size), time_it(read_all, args.repeat * 100))
+        print('    ', fs.get_path_cache_stats())
+
+
+def bench_copy(args: argparse.Namespace) -> None:
+    def copy_wide_tree() -> FileSystem:
+        fs = FileSystem()
+        build_wide_tree(fs, args.width)
+        for i in range(args.width):
+            fs.write('/wide/dir_{}/file_{}'.format(i, i % 100), 'x' * 100)
+        return fs
+
+    # the copy's nodes are made when first needed: by a write into the source (one level of the
+    # copy), or by reading the copy
+    fs = copy_wide_tree()
+    start = time.perf_counter()
+    fs.copy('/wide', '/wide_copy')
+    report('copy wide ({}) tree'.format(args.width), time.perf_counter() - start)
+    start = time.perf_counter()
+    fs.write('/wide/dir_1/file_1', 'y', True)
+    report('first write into the source after the copy', time.perf_counter() - start)
+    report('next write into the source', time_it(lambda: fs.write('/wide/dir_1/file_1', 'y', True), args.repeat))
+    report('export of the whole copy', time_it(lambda: fs.export_tree('/wide_copy'), 1))
+
+    # tracemalloc slows everything down, so memory is measured on a second run
+    fs = copy_wide_tree()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fs.copy('/wide', '/wide_copy')
+    copy_memory = tracemalloc.get_traced_memory()[0] - before
+    fs.write('/wide/dir_1/file_1', 'y', True)
+    written_memory = tracemalloc.get_traced_memory()[0] - before
+    fs.export_tree('/wide_copy')
+    read_memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print('{:<50}{:>16.0f} bytes'.format('memory of the copy', copy_memory))
+    print('{:<50}{:>16.0f} bytes'.format('memory of the copy, after the write', written_memory))
+    print('{:<50}{:>16.0f} bytes'.format('memory of the copy, read in full', read_memory))
+
+
+class LegacyStrFile:
+    def __init__(self) -> None:
+        self.content = ''
+
+    def write(self, content: str, append=False) -> None:
+        if append:
+            self.content += content
+        else:
+            self.content = content
+
+
+def bench_append(args: argparse.Namespace) -> None:
+    # str += on an attribute copies the whole content every time, so the old storage gets fewer appends
+    legacy_appends = min(args.appends, args.legacy_appends)
+    legacy_file = LegacyStrFile()
+    report('{} appends, str content (per append)'.format(legacy_appends), time_it(
+        lambda: legacy_file.write('0123456789', True), legacy_appends,
+    ))
+
+    fs = FileSystem()
+    fs.make_new_file('/log')
+    log_file = fs._get_file_object_from_path('/log')
+    report('{} appends, bytearray content (per append)'.format(args.appends), time_it(
+        lambda: log_file.write('0123456789', True), args.appends,
+    ))
+
+
+def bench_collision(args: argparse.Namespace) -> None:
+    fs = FileSystem()
+    fs.make_new_file('/backup')
+    for _ in range(args.collisions):
+        fs.copy('/backup', '/backup')
+
+    report('copy after {} collisions'.format(args.collisions), time_it(lambda: fs.copy('/backup', '/backup'), args.repeat))
+
+
+class GlobalMutexFileSystem:
+    def __init__(self) -> None:
+        self._fs = FileSystem()
+        self._mutex = threading.Lock()
+
+    def __getattr__(self, name: str):
+        method = getattr(self._fs, name)
+
+        def locked(*args, **kwargs):
+            with self._mutex:
+                return method(*args, **kwargs)
+
+        return locked
+
+
+def run_threads(fs, threads: int, ops_per_thread: int) -> float:
+    def worker(thread_id: int) -> None:
+        for i in range(ops_per_thread):
+            # one write for every nine reads, each thread in a subtree of its own
+            if i % 10 == 0:
+                fs.write('/t{}/log'.format(thread_id), 'x', True)
+            elif i % 10 == 1:
+                fs.find('log', None, '/t{}'.format(thread_id))
+            else:
+                fs.cat('/t{}/log'.format(thread_id))
+
+    for thread_id in range(threads):
+        fs.make_new_file('/t{}/log'.format(thread_id))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return threads * ops_per_thread / (time.perf_counter() - start)
+
+
+# reads/s of threads reading their own subtrees while another thread keeps copying a directory of width files
+# (ops/s of the readers, copies/s made meanwhile)
+def run_reads_next_to_copy(fs, threads: int, ops_per_thread: int, width: int) -> Tuple[float, float]:
+    for idx in range(width):
+        fs.make_new_file('/big/source/file_{}'.format(idx))
+    copying = threading.Event()
+    copying.set()
+    copies = [0]
+
+    def copier() -> None:
+        while copying.is_set():
+            fs.copy('/big/source', '/big/copy')
+            fs.remove('/big/copy')
+            copies[0] += 1
+
+    copy_thread = threading.Thread(target=copier)
+    start = time.perf_counter()
+    copy_thread.start()
+    try:
+        ops_per_sec = run_threads(fs, threads, ops_per_thread)
+    finally:
+        copying.clear()
+        copy_thread.join()
+
+    return ops_per_sec, copies[0] / (time.perf_counter() - start)
+
+
+def bench_threads(args: argparse.Namespace) -> None:
+    # under the GIL only one thread runs Python code at a time, what locks change is who waits for whom
+    file_systems = (('global mutex', GlobalMutexFileSystem), ('per subtree locks', lambda: FileSystem(thread_safe=True)))
+    for threads in (1, 4, 16):
+        for name, make_fs in file_systems:
+            ops_per_sec = run_threads(make_fs(), threads, args.ops // threads)
+            print('{:<50}{:>16.0f} ops/s'.format('{} threads, {}'.format(threads, name), ops_per_sec))
+
+    for name, make_fs in file_systems:
+        ops_per_sec, copies_per_sec = run_reads_next_to_copy(make_fs(), 4, args.ops // 40, args.width // 100)
+        print('{:<50}{:>16.0f} ops/s'.format('4 threads next to a copy, {}'.format(name), ops_per_sec))
+        print('{:<50}{:>16.0f} copies/s'.format('  the copy meanwhile, {}'.format(name), copies_per_sec))
+
+
+def bench_snapshot(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for width in (args.width // 100, args.width // 10, args.width):
+            fs = FileSystem()
+            build_wide_tree(fs, width)
+            snapshot_path = os.path.join(temp_dir, 'fs_{}.snapshot'.format(width))
+
+            start = time.perf_counter()
+            fs.save(snapshot_path)
+            report('save wide ({}) tree'.format(width), time.perf_counter() - start)
+            report('load wide ({}) tree'.format(width), time_it(lambda: FileSystem.load(snapshot_path), args.repeat))
+
+            loaded = FileSystem.load(snapshot_path)
+            report('first find on loaded ({}) tree'.format(width), time_it(lambda: loaded.find('needle'), 1))
+
+
+def run_mutations(fs: FileSystem, ops: int) -> float:
+    start = time.perf_counter()
+    for i in range(ops):
+        path = '/dir_{}/file_{}'.format(i % 100, i % 1000)
+        if i < 1000:
+            fs.make_new_file(path)
+        else:
+            fs.write(path, 'line\n', True)
+
+    return ops / (time.perf_counter() - start)
+
+
+def bench_journal(args: argparse.Namespace) -> None:
+    ops = args.ops // 10
+    print('{:<50}{:>16.0f} ops/s'.format('journal off', run_mutations(FileSystem(), ops)))
+
+    for fsync_policy in FSYNC_POLICIES:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            journal = Journal(temp_dir, fsync_policy=fsync_policy)
+            ops_per_sec = run_mutations(journal.recover(), ops)
+            journal.close()
+            print('{:<50}{:>16.0f} ops/s'.format('journal on, fsync ' + fsync_policy, ops_per_sec))
+
+
+def bench_memory(args: argparse.Namespace) -> None:
+    # the name index and path cache are not part of the node layout, keep them out of the measurement
+    tracemalloc.start()
+    fs = FileSystem(path_cache_size=0)
+    parent_dirs = []
+    for i in range(args.width // 100):
+        fs.make_new_dir('/dir_{}'.format(i))
+        parent_dirs.append(fs._get_file_object_from_path('/dir_{}'.format(i)))
+    fs._name_index.clear()
+    tracemalloc.reset_peak()
+
+    before = tracemalloc.get_traced_memory()[0]
+    for parent_dir in parent_dirs:
+        for j in range(100):
+            parent_dir.add_file(File('file_{}'.format(j), parent_dir))
+    files_memory = tracemalloc.get_traced_memory()[0] - before
+
+    before = tracemalloc.get_traced_memory()[0]
+    for parent_dir in parent_dirs:
+        for j in range(100):
+            parent_dir.add_file(Directory('dir_{}'.format(j), parent_dir))
+    dirs_memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    nodes = len(parent_dirs) * 100
+    print('{:<50}{:>16.1f} bytes'.format('per file node ({} nodes)'.format(nodes), files_memory / nodes))
+    print('{:<50}{:>16.1f} bytes'.format('per empty directory node ({} nodes)'.format(nodes), dirs_memory / nodes))
+
+
+def bench_glob(args: argparse.Namespace) -> None:
+    fs = FileSystem()
+    build_wide_tree(fs, args.width)
+
+    def first_match() -> None:
+        next(fs.iglob('/wide/*/file_0'))
+
+    def all_matches() -> None:
+        list(fs.iglob('/wide/*/file_0'))
+
+    report('iglob wide ({}) first match'.format(args.width), time_it(first_match, args.repeat))
+    report('iglob wide ({}) all matches'.format(args.width), time_it(all_matches, args.repeat))
+    report('iglob wide ({}) literal path'.format(args.width), time_it(lambda: list(fs.iglob('/wide/dir_0/needle')), args.repeat))
+    report('walk wide ({}) first directory below top'.format(args.width), time_it(lambda: next(islice(fs.walk('/wide'), 1, None)), args.repeat))
+    report('find wide ({}) limit 1'.format(args.width), time_it(lambda: fs.find('file_0', limit=1), args.repeat))
+    report('find wide ({}) no limit'.format(args.width), time_it(lambda: fs.find('file_0'), args.repeat))
+
+
+def bench_metrics(args: argparse.Namespace) -> None:
+    for metrics in (False, True):
+        fs = FileSystem(metrics=metrics)
+        build_deep_tree(fs, 20)
+        paths = fs.find('file')
+
+        def read_all() -> None:
+            for file_path in paths:
+                fs.cat(file_path)
+
+        report('cat 20 deep paths, metrics {}'.format('on' if metrics else 'off'), time_it(read_all, args.repeat * 100))
+        fs.make_new_file('/log')
+        report('append, metrics {}'.format('on' if metrics else 'off'), time_it(lambda: fs.write('/log', 'x', True), args.ops))
+
+
+def bench_grep(args: argparse.Namespace) -> None:
+    files = args.width // 10
+    for content_index in (False, True):
+        fs = FileSystem(content_index=content_index)
+        label = 'index {}'.format('on' if content_index else 'off')
+        for i in range(files):
+            file_path = '/docs/dir_{}/file_{}'.format(i % 100, i)
+            fs.make_new_file(file_path)
+            fs.write(file_path, 'lorem ipsum dolor sit amet {} consectetur adipiscing elit '.format(i) * 20)
+        fs.write('/docs/dir_0/file_0', 'the needle is here', True)
+        report('first grep {} files, {}'.format(files, label), time_it(lambda: fs.grep('needle'), 1))
+
+        report('grep {} files, 1 match, {}'.format(files, label), time_it(lambda: fs.grep('needle'), args.repeat))
+        report('grep {} files, all match, {}'.format(files, label), time_it(lambda: fs.grep('dolor sit'), args.repeat))
+        report('grep {} files, no literal, {}'.format(files, label), time_it(lambda: fs.grep('needle|xyzzy'), args.repeat))
+        report('append then grep, {}'.format(label), time_it(lambda: (fs.write('/docs/dir_1/file_1', 'x', True), fs.grep('needle')), args.repeat))
+
+
+def bench_ls(args: argparse.Namespace) -> None:
+    fs = FileSystem()
+    for i in range(args.width):
+        fs.make_new_file('/big/file_{}'.format(i))
+
+    report('ls dir ({}) all names'.format(args.width), time_it(lambda: fs.ls('/big'), args.repeat))
+    report('ls dir ({}) first sorted page (builds the index)'.format(args.width), time_it(lambda: fs.ls('/big', limit=100), 1))
+    report('ls dir ({}) sorted page of 100'.format(args.width), time_it(lambda: fs.ls('/big', 'file_5', 100), args.repeat))
+    report('ls dir ({}) prefix page'.format(args.width), time_it(lambda: fs.ls('/big', prefix='file_777', limit=100), args.repeat))
+    report('ls dir ({}) add then page'.format(args.width), time_it(
+        lambda: (fs.make_new_file('/big/new_{}'.format(time.perf_counter_ns())), fs.ls('/big', 'file_5', 100)), args.repeat,
+    ))
+
+
+def bench_spill(args: argparse.Namespace) -> None:
+    file_size = 64 * 1024
+    files = 1024
+    budget = files * file_size // 8
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for memory_budget in (None, budget):
+            fs = FileSystem(memory_budget=memory_budget, spill_dir=temp_dir)
+            label = 'budget {}'.format('off' if memory_budget is None else '{} MiB'.format(budget >> 20))
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            for i in range(files):
+                fs.make_new_file('/data/file_{}'.format(i))
+                fs.write('/data/file_{}'.format(i), os.urandom(file_size))
+            report('write {} x 64 KiB, {}'.format(files, label), time.perf_counter() - start)
+            print('    peak traced memory {:.1f} MiB'.format(tracemalloc.get_traced_memory()[1] / 2 ** 20))
+            tracemalloc.stop()
+
+            report('pread recent file, {}'.format(label), time_it(lambda: fs.pread('/data/file_{}'.format(files - 1), 0, file_size), args.repeat))
+            cold = iter(range(files // 2))
+            report('pread cold file, {}'.format(label), time_it(lambda: fs.pread('/data/file_{}'.format(next(cold)), 0, file_size), args.repeat))
+            print('    ', fs.get_spill_stats())
+
+
+def bench_compress(args: argparse.Namespace) -> None:
+    files = 200
+    for algorithm in ('zlib', 'lzma'):
+        fs = FileSystem(compression=algorithm, compress_after=0)
+        for i in range(files):
+            fs.make_new_file('/logs/log_{}'.format(i))
+            fs.write('/logs/log_{}'.format(i), ''.join(
+                '2024-01-01 12:00:{:02} host_{} GET /api/items/{} 200 {}ms\n'.format(j % 60, i, j, j % 97) for j in range(500)
+            ))
+
+        start = time.perf_counter()
+        fs.compress_cold()
+        report('compress {} files, {}'.format(files, algorithm), time.perf_counter() - start)
+
+        compressed = iter(range(files))
+        report('cat compressed file, {}'.format(algorithm), time_it(lambda: fs.cat('/logs/log_{}'.format(next(compressed))), args.repeat))
+        report('cat raw file, {}'.format(algorithm), time_it(lambda: fs.cat('/logs/log_0'), args.repeat))
+        stats = fs.get_compression_stats()
+        print('    ratio {:.1f}, {} -> {} bytes, decompress avg {:.0f} us'.format(
+            stats['ratio'], stats['raw_bytes'], stats['compressed_bytes'], stats['decompress_avg_us'],
+        ))
+
+
+def bench_inode(args: argparse.Namespace) -> None:
+    fs = FileSystem()
+    build_deep_tree(fs, 50)
+    path = fs.find('needle')[0]
+    inode = fs.lookup(path)
+
+    # counter file updated over and over, by path and by inode number
+    report('write deep path', time_it(lambda: fs.write(path, 'count'), args.repeat * 1000))
+    report('write_inode', time_it(lambda: fs.write_inode(inode, 'count'), args.repeat * 1000))
+    report('pread deep path', time_it(lambda: fs.pread(path, 0, 5), args.repeat * 1000))
+    report('read_inode', time_it(lambda: fs.read_inode(inode, 0, 5), args.repeat * 1000))
+
+    fs.change_dir(path.rpartition('/')[0])
+    report('get_current_path 50 levels deep', time_it(fs.get_current_path, args.repeat * 1000))
+
+
+def bench_watch(args: argparse.Namespace) -> None:
+    fs = FileSystem()
+    build_wide_tree(fs, args.width // 10)
+    paths = ['/wide/dir_{}/file_{}'.format(i, i % 100) for i in range(0, args.width // 10, 10)]
+
+    def write_all() -> None:
+        for path in paths:
+            fs.write(path, 'changed', append=True)
+
+    report('{} writes, no watcher'.format(len(paths)), time_it(write_all, args.repeat))
+    watcher = fs.watch('/wide')
+    report('{} writes, recursive watcher'.format(len(paths)), time_it(write_all, args.repeat))
+    print('    {} events queued for {} writes'.format(len(watcher.poll()), len(paths) * args.repeat))
+
+    # noticing one new file: listing the whole tree again against taking the watcher's events
+    fs.make_new_file('/wide/dir_7/needle')
+    report('poll by walking the tree ({} dirs)'.format(args.width // 10), time_it(lambda: list(fs.walk('/wide')), args.repeat))
+    report('poll with watcher', time_it(watcher.poll, args.repeat))
+    watcher.close()
+
+
+def bench_shards(args: argparse.Namespace) -> None:
+    threads = 8
+    ops_per_thread = args.ops // 10 // threads
+    # shards only run in parallel on separate cores, with a single one their throughput stays flat
+    print('    {} CPUs available'.format(len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()))
+
+    for shards in (1, 2, 4):
+        with ShardedFileSystem(shards=shards) as fs:
+            def worker(thread_id: int) -> None:
+                # a copy of a small subtree per call, enough work for the shard to outweigh the pipe
+                for i in range(ops_per_thread):
+                    fs.copy('/t{}/template'.format(thread_id), '/t{}/copy_{}'.format(thread_id, i))
+
+            for thread_id in range(threads):
+                for j in range(20):
+                    fs.make_new_file('/t{}/template/dir_{}/file'.format(thread_id, j))
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+            ops_per_sec = threads * ops_per_thread / (time.perf_counter() - start)
+            print('{:<50}{:>16.0f} ops/s'.format('{} threads, {} shards, copy'.format(threads, shards), ops_per_sec))
+
+
+async def run_clients(socket_path: str, clients: int, ops_per_client: int) -> List[float]:
+    latencies = []
+
+    async def client_loop(client_id: int) -> None:
+        async with FileSystemClient(path=socket_path, pool_size=1) as client:
+            path = '/clients/c{}/log'.format(client_id)
+            await client.make_new_file(path)
+            for i in range(ops_per_client):
+                start = time.perf_counter()
+                # one write for every three reads
+                if i % 4 == 0:
+                    await client.write(path, 'line\n', True)
+                else:
+                    await client.pread(path, 0, 64)
+                latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[client_loop(i) for i in range(clients)])
+    return latencies
+
+
+async def run_pipelined_client(socket_path: str, ops: int, batch_size: int) -> float:
+    async with FileSystemClient(path=socket_path, pool_size=1) as client:
+        await client.make_new_file('/pipelined')
+        start = time.perf_counter()
+        for _ in range(ops // batch_size):
+            await client.call_many([('pread', '/pipelined', 0, 64)] * batch_size)
+        return ops // batch_size * batch_size / (time.perf_counter() - start)
+
+
+def run_server(socket_path: str) -> None:
+    async def serve_on_socket() -> None:
+        server = FileSystemServer(path=socket_path)
+        await server.start()
+        await server.serve_forever()
+
+    asyncio.run(serve_on_socket())
+
+
+def bench_server(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path = os.path.join(temp_dir, 'fs.sock')
+        server_process = multiprocessing.Process(target=run_server, args=(socket_path,), daemon=True)
+        server_process.start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+
+        try:
+            ops = args.ops // 10
+            for clients in (1, 4, 16, 64):
+                start = time.perf_counter()
+                latencies = sorted(asyncio.run(run_clients(socket_path, clients, max(1, ops // clients))))
+                ops_per_sec = len(latencies) / (time.perf_counter() - start)
+                print('{:<50}{:>16.0f} ops/s   p50 {:>8.1f} us   p99 {:>8.1f} us'.format(
+                    '{} clients'.format(clients), ops_per_sec,
+                    latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6,
+                ))
+
+            print('{:<50}{:>16.0f} ops/s'.format(
+                '1 client, pipelined batches of 100', asyncio.run(run_pipelined_client(socket_path, ops, 100)),
+            ))
+        finally:
+            server_process.terminate()
+            server_process.join()
+
+
+BENCHMARKS = {
+    'find': bench_find,
+    'resolve': bench_resolve,
+    'copy': bench_copy,
+    'append': bench_append,
+    'collision': bench_collision,
+    'threads': bench_threads,
+    'snapshot': bench_snapshot,
+    'journal': bench_journal,
+    'memory': bench_memory,
+    'glob': bench_glob,
+    'metrics': bench_metrics,
+    'shards': bench_shards,
+    'server': bench_server,
+    'grep': bench_grep,
+    'ls': bench_ls,
+    'spill': bench_spill,
+    'compress': bench_compress,
+    'inode': bench_inode,
+    'watch': bench_watch,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro benchmarks for the in memory file system')
+    parser.add_argument('benchmarks', nargs='*', help='any of: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--width', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=500)
+    parser.add_argument('--appends', type=int, default=1000000)
+    parser.add_argument('--legacy-appends', type=int, default=50000)
+    parser.add_argument('--collisions', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for benchmark in args.benchmarks or list(BENCHMARKS):
+        BENCHMARKS[benchmark](args)
@@ -0,0 +1,272 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmark import build_deep_tree, build_wide_tree
+from file_system.file_system import FileSystem
+
+
+"""
+    Benchmark suite over the FileSystem hot paths.
+
+    Every case builds its own tree, then times each operation separately, reporting ops/sec and
+    latency percentiles. A second run of the case under tracemalloc gives the peak memory (setup
+    included), kept apart so tracing does not slow down the timed run.
+
+      python3 benchmark_suite.py --json results.json
+      python3 benchmark_suite.py --baseline results.json        # compare against an earlier run
+"""
+
+# an operation is called with its index, 0 to ops - 1
+Operation = Callable[[int], object]
+Setup = Callable[[argparse.Namespace], Tuple[FileSystem, Operation]]
+
+MIXED_NAMES = ['README', 'index', 'main', 'config', 'data', 'log', 'test', 'util']
+
+
+"""
+    A tree shaped more like a real one: random depth and fan out, names repeating across
+    directories and file sizes spread over a few orders of magnitude
+"""
+def build_mixed_tree(fs: FileSystem, files: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    dirs = ['/mixed']
+    file_paths = []
+    fs.make_new_dir('/mixed')
+
+    for i in range(files):
+        if rng.random() < 0.2 or len(dirs) < 4:
+            parent = rng.choice(dirs)
+            if parent.count('/') < 10:
+                new_dir = '{}/{}_dir_{}'.format(parent, rng.choice(MIXED_NAMES), i)
+                fs.make_new_dir(new_dir)
+                dirs.append(new_dir)
+
+        file_path = '{}/{}_{}'.format(rng.choice(dirs), rng.choice(MIXED_NAMES), i)
+        fs.make_new_file(file_path)
+        fs.write(file_path, 'x' * int(10 ** rng.uniform(0, 4)))
+        file_paths.append(file_path)
+
+    return file_paths
+
+
+def setup_resolve_deep(args: argparse.Namespace, cache_size: int) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem(path_cache_size=cache_size)
+    build_deep_tree(fs, args.depth)
+    paths = fs.find('file')
+    return fs, lambda i: fs.cat(paths[i % len(paths)])
+
+
+def setup_resolve_mixed(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    paths = build_mixed_tree(fs, args.files)
+    return fs, lambda i: fs.pread(paths[i % len(paths)], 0, 16)
+
+
+def setup_make_new_dir(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    return fs, lambda i: fs.make_new_dir('/auto/{}/a/b/c/d'.format(i))
+
+
+def setup_copy(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    build_mixed_tree(fs, args.files)
+    return fs, lambda i: fs.copy('/mixed', '/copy_{}'.format(i))
+
+
+def setup_find(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    build_wide_tree(fs, args.width)
+    return fs, lambda i: fs.find('needle')
+
+
+def setup_find_common(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    build_wide_tree(fs, args.width)
+    return fs, lambda i: fs.find('file_{}'.format(i % 100))
+
+
+def setup_ls(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    build_wide_tree(fs, args.width)
+    fs.change_dir('/wide')
+    return fs, lambda i: fs.ls()
+
+
+def setup_append(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    for i in range(10):
+        fs.make_new_file('/logs/log_{}'.format(i))
+    return fs, lambda i: fs.write('/logs/log_{}'.format(i % 10), '0123456789abcdef', True)
+
+
+def setup_move(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    for i in range(args.ops):
+        fs.make_new_file('/from/file_{}'.format(i))
+    fs.make_new_dir('/to')
+    return fs, lambda i: fs.move('/from/file_{}'.format(i), '/to')
+
+
+def setup_remove(args: argparse.Namespace) -> Tuple[FileSystem, Operation]:
+    fs = FileSystem()
+    for i in range(args.ops):
+        fs.make_new_file('/remove/dir_{}/file'.format(i))
+    return fs, lambda i: fs.remove('/remove/dir_{}'.format(i))
+
+
+# name -> (setup, how many operations out of args.ops to run, copies are much bigger than the rest)
+CASES: Dict[str, Tuple[Setup, Callable[[int], int]]] = {
+    'resolve_deep_cached': (lambda args: setup_resolve_deep(args, 4096), lambda ops: ops),
+    'resolve_deep_uncached': (lambda args: setup_resolve_deep(args, 0), lambda ops: ops),
+    'resolve_mixed': (setup_resolve_mixed, lambda ops: ops),
+    'make_new_dir_auto_create': (setup_make_new_dir, lambda ops: ops),
+    'copy_mixed_subtree': (setup_copy, lambda ops: max(1, ops // 1000)),
+    'find_unique_name': (setup_find, lambda ops: ops),
+    'find_common_name': (setup_find_common, lambda ops: max(1, ops // 100)),
+    'ls_huge_dir': (setup_ls, lambda ops: max(1, ops // 1000)),
+    'append_write': (setup_append, lambda ops: ops),
+    'move': (setup_move, lambda ops: ops),
+    'remove': (setup_remove, lambda ops: ops),
+}
+
+
+# nearest rank percentile of sorted values
+def percentile(sorted_values: List[int], fraction: float) -> int:
+    rank = max(1, int(round(fraction * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_case(setup: Setup, ops: int, args: argparse.Namespace) -> Dict[str, object]:
+    _, operation = setup(args)
+    perf_counter_ns = time.perf_counter_ns
+    # garbage left over from the setup should not be collected in the middle of the timed run
+    gc.collect()
+
+    latencies = []
+    start = perf_counter_ns()
+    for i in range(ops):
+        op_start = perf_counter_ns()
+        operation(i)
+        latencies.append(perf_counter_ns() - op_start)
+    total_ns = perf_counter_ns() - start
+
+    latencies.sort()
+    result = {
+        'ops': ops,
+        'ops_per_sec': ops / (total_ns / 1e9),
+        'latency_us': {
+            'p50': percentile(latencies, 0.5) / 1e3,
+            'p90': percentile(latencies, 0.9) / 1e3,
+            'p99': percentile(latencies, 0.99) / 1e3,
+            'max': latencies[-1] / 1e3,
+        },
+        'peak_memory_bytes': None,
+    }
+
+    if args.memory:
+        tracemalloc.start()
+        _, operation = setup(args)
+        for i in range(ops):
+            operation(i)
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+"""
+    Prints every case next to its baseline and returns the names of the cases that got slower
+    than threshold allows, either in ops/sec or in p99 latency
+"""
+def compare_with_baseline(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    regressions = []
+    print('{:<30}{:>14}{:>14}{:>10}{:>14}{:>14}{:>10}'.format(
+        'case', 'ops/s', 'baseline', 'change', 'p99 us', 'baseline', 'change',
+    ))
+
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print('{:<30}{:>14.0f}{:>14}'.format(name, result['ops_per_sec'], 'n/a'))
+            continue
+
+        throughput_change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        p99_change = result['latency_us']['p99'] / max(base['latency_us']['p99'], 1e-3) - 1
+        regressed = throughput_change < -threshold or p99_change > threshold
+        if regressed:
+            regressions.append(name)
+
+        print('{:<30}{:>14.0f}{:>14.0f}{:>+9.1f}%{:>14.1f}{:>14.1f}{:>+9.1f}%{}'.format(
+            name, result['ops_per_sec'], base['ops_per_sec'], throughput_change * 100,
+            result['latency_us']['p99'], base['latency_us']['p99'], p99_change * 100,
+            '  REGRESSION' if regressed else '',
+        ))
+
+    return regressions
+
+
+def print_results(results: Dict[str, dict]) -> None:
+    print('{:<30}{:>14}{:>12}{:>12}{:>12}{:>12}{:>14}'.format('case', 'ops/s', 'p50 us', 'p90 us', 'p99 us', 'max us', 'peak KiB'))
+    for name, result in results.items():
+        latency = result['latency_us']
+        peak = result['peak_memory_bytes']
+        print('{:<30}{:>14.0f}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}{:>14}'.format(
+            name, result['ops_per_sec'], latency['p50'], latency['p90'], latency['p99'], latency['max'],
+            'n/a' if peak is None else '{:.0f}'.format(peak / 1024),
+        ))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark suite for the in memory file system')
+    parser.add_argument('cases', nargs='*', help='any of: ' + ', '.join(CASES))
+    parser.add_argument('--ops', type=int, default=20000, help='operations per case (fewer for the expensive ones)')
+    parser.add_argument('--width', type=int, default=20000)
+    parser.add_argument('--depth', type=int, default=200)
+    parser.add_argument('--files', type=int, default=2000, help='files in the mixed tree')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the peak memory runs')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    for name in args.cases:
+        if name not in CASES:
+            parser.error('unknown case ' + name)
+
+    results = {}
+    for name in args.cases or list(CASES):
+        setup, get_ops = CASES[name]
+        results[name] = run_case(setup, get_ops(args.ops), args)
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parameters': {'ops': args.ops, 'width': args.width, 'depth': args.depth, 'files': args.files},
+                'results': results,
+            }, json_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        print()
+        if compare_with_baseline(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import file_system.constant as constant
+from file_system.batch import BatchResult
+from file_system.file_handle import FileHandle
+from file_system.file_system import FileSystem
+from file_system.watch import Event, Watcher
+
+
+# how many find and iglob results are taken from the generator per trip to the executor
+RESULTS_PER_HOP = 256
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+"""
+    asyncio front end for FileSystem.
+    Every call runs in an executor, so a big copy or find never blocks the event loop; the wrapped
+    file system is thread safe, so calls from several coroutines can overlap.
+    find, walk and iglob are async generators that take results from FileSystem's generators a few
+    at a time in the executor, and file content can be streamed in chunks.
+    open and watch return the plain FileHandle and Watcher: handle reads hand out views and writes
+    are one buffer update, and watcher events are awaited with get_events.
+    Not wrapped: load (wrap the loaded FileSystem instead), attach_journal, add_hook and remove_hook,
+    which set up the file system before it is shared; call them on the FileSystem
+"""
+class AsyncFileSystem:
+
+    def __init__(self, fs: Optional[FileSystem] = None, executor: Optional[Executor] = None) -> None:
+        self._fs: FileSystem = fs if fs is not None else FileSystem(thread_safe=True)
+        self._executor: Optional[Executor] = executor
+
+    async def change_dir(self, path: str) -> None:
+        await self._run(self._fs.change_dir, path)
+
+    async def remove(self, path: str) -> None:
+        await self._run(self._fs.remove, path)
+
+    async def move(self, from_path: str, to_path: str) -> None:
+        await self._run(self._fs.move, from_path, to_path)
+
+    async def copy(self, from_path: str, to_path: str) -> None:
+        await self._run(self._fs.copy, from_path, to_path)
+
+    async def make_new_dir(self, path: str) -> None:
+        await self._run(self._fs.make_new_dir, path)
+
+    async def make_new_file(self, path: str) -> None:
+        await self._run(self._fs.make_new_file, path)
+
+    async def ls(
+        self,
+        path: str = '.',
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        return await self._run(self._fs.ls, path, start_after, limit, prefix)
+
+    async def get_current_path(self) -> str:
+        return await self._run(self._fs.get_current_path)
+
+    async def du(self, path: str = '.') -> int:
+        return await self._run(self._fs.du, path)
+
+    async def stat(self, path: str = '.') -> Dict[str, Union[str, int]]:
+        return await self._run(self._fs.stat, path)
+
+    """
+        Without a limit the paths arrive as ifind finds them, in no particular order, while the rest
+        are still being looked for. With a limit they are find's first limit paths, in sorted order
+    """
+    async def find(self, name: str, limit: Optional[int] = None, path: str = '.') -> AsyncIterator[str]:
+        if limit is not None:
+            for file_path in await self._run(self._fs.find, name, limit, path):
+                yield file_path
+            return
+
+        async for file_path in self._iterate(self._fs.ifind(name, path), RESULTS_PER_HOP):
+            yield file_path
+
+    # one directory per trip to the executor, so removing names from dirnames still prunes them
+    async def walk(self, path: str = '.', topdown: bool = True) -> AsyncIterator[Tuple[str, List[str], List[str]]]:
+        async for entry in self._iterate(self._fs.walk(path, topdown), 1):
+            yield entry
+
+    async def iglob(self, pattern: str) -> AsyncIterator[str]:
+        async for path in self._iterate(self._fs.iglob(pattern), RESULTS_PER_HOP):
+            yield path
+
+    async def grep(self, pattern: str, path: str = '.', ignore_case=False) -> List[str]:
+        return await self._run(self._fs.grep, pattern, path, ignore_case)
+
+    async def write(self, path: str, content: Union[str, bytes], append=False) -> None:
+        await self._run(self._fs.write, path, content, append)
+
+    async def cat(self, path: str) -> str:
+        return await self._run(self._fs.cat, path)
+
+    async def pread(self, path: str, offset: int, length: int) -> bytes:
+        return await self._run(self._fs.pread, path, offset, length)
+
+    async def pwrite(self, path: str, offset: int, data: Union[str, bytes]) -> None:
+        await self._run(self._fs.pwrite, path, offset, data)
+
+    async def truncate(self, path: str, size: int) -> None:
+        await self._run(self._fs.truncate, path, size)
+
+    async def lookup(self, path: str) -> int:
+        return await self._run(self._fs.lookup, path)
+
+    async def read_inode(self, inode: int, offset: int = 0, length: Optional[int] = None) -> bytes:
+        return await self._run(self._fs.read_inode, inode, offset, length)
+
+    async def write_inode(self, inode: int, content: Union[str, bytes], append=False) -> None:
+        await self._run(self._fs.write_inode, inode, content, append)
+
+    async def stat_inode(self, inode: int) -> Dict[str, Union[str, int]]:
+        return await self._run(self._fs.stat_inode, inode)
+
+    async def ls_inode(
+        self,
+        inode: int,
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        return await self._run(self._fs.ls_inode, inode, start_after, limit, prefix)
+
+    async def open(self, path: str, mode: str = 'r') -> FileHandle:
+        return await self._run(self._fs.open, path, mode)
+
+    async def watch(self, path: str = '.', recursive=True, max_events: int = constant.WATCH_QUEUE_SIZE) -> Watcher:
+        return await self._run(self._fs.watch, path, recursive, max_events)
+
+    # the wait happens on an executor thread, which it keeps busy until events arrive or the timeout
+    async def get_events(self, watcher: Watcher, timeout: Optional[float] = None) -> List[Event]:
+        return await self._run(watcher.get_events, timeout)
+
+    async def batch(self, operations: List[tuple], atomic=False) -> List[BatchResult]:
+        return await self._run(self._fs.batch, operations, atomic)
+
+    async def export_tree(self, path: str) -> list:
+        return await self._run(self._fs.export_tree, path)
+
+    async def import_tree(self, to_path: str, tree: list, rename=True) -> None:
+        await self._run(self._fs.import_tree, to_path, tree, rename)
+
+    async def save(self, snapshot_path: str, fsync=False) -> None:
+        await self._run(self._fs.save, snapshot_path, fsync)
+
+    async def checkpoint(self) -> None:
+        await self._run(self._fs.checkpoint)
+
+    async def compress_cold(self) -> int:
+        return await self._run(self._fs.compress_cold)
+
+    """
+        Streams the file content chunk by chunk with pread, so a large file is never held as one string
+        and other coroutines run between chunks
+    """
+    async def read_chunks(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        offset = 0
+        while True:
+            chunk = await self._run(self._fs.pread, path, offset, chunk_size)
+            if not chunk:
+                return
+
+            yield chunk
+            offset += len(chunk)
+
+    # counters are read without going through the executor
+    def get_path_cache_stats(self) -> Dict[str, int]:
+        return self._fs.get_path_cache_stats()
+
+    def get_metrics(self) -> Optional[Dict[str, Any]]:
+        return self._fs.get_metrics()
+
+    def reset_metrics(self) -> None:
+        self._fs.reset_metrics()
+
+    def get_content_index_stats(self) -> Dict[str, int]:
+        return self._fs.get_content_index_stats()
+
+    def get_spill_stats(self) -> Dict[str, int]:
+        return self._fs.get_spill_stats()
+
+    def get_compression_stats(self) -> Dict[str, Union[str, int, float]]:
+        return self._fs.get_compression_stats()
+
+    def get_blob_store_stats(self) -> Dict[str, Union[int, float]]:
+        return self._fs.get_blob_store_stats()
+
+    # steps a FileSystem generator in the executor, per_hop items at a time
+    async def _iterate(self, iterator: Iterator[Any], per_hop: int) -> AsyncIterator[Any]:
+        while True:
+            items = await self._run(take, iterator, per_hop)
+            if not items:
+                return
+
+            for item in items:
+                yield item
+
+    async def _run(self, method: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args))
+
+
+def take(iterator: Iterator[Any], count: int) -> List[Any]:
+    return list(islice(iterator, count))
@@ -0,0 +1,42 @@
+from typing import Any, Optional
+
+
+# FileSystem methods that can be used as batch operations
+BATCH_OPERATIONS = frozenset([
+    'change_dir',
+    'remove',
+    'move',
+    'copy',
+    'make_new_dir',
+    'make_new_file',
+    'ls',
+    'get_current_path',
+    'find',
+    'write',
+    'cat',
+    'pread',
+    'pwrite',
+    'truncate',
+])
+
+
+"""
+    Outcome of one operation of a batch: the value the operation returned, or the exception it raised.
+    In an atomic batch that was rolled back, operations after the failing one are not run
+    and have neither value nor error
+"""
+class BatchResult:
+    def __init__(self, value: Any = None, error: Optional[Exception] = None, executed: bool = True) -> None:
+        self.value: Any = value
+        self.error: Optional[Exception] = error
+        self.executed: bool = executed
+
+    def is_ok(self) -> bool:
+        return self.executed and self.error is None
+
+    def __repr__(self) -> str:
+        if not self.executed:
+            return 'BatchResult(not executed)'
+        if self.error is not None:
+            return 'BatchResult(error={!r})'.format(self.error)
+        return 'BatchResult(value={!r})'.format(self.value)
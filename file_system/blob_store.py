@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from contextlib import nullcontext
+from typing import Dict, Tuple, Union
+
+
+"""
+    Immutable content shared by every file holding it. refcount is the number of files referring to it
+"""
+class Blob:
+    __slots__ = ('data', 'key', 'refcount', '_store')
+
+    def __init__(self, data: bytes, key: Tuple[int, bytes], store: 'BlobStore') -> None:
+        self.data: bytes = data
+        self.key: Tuple[int, bytes] = key
+        self.refcount: int = 0
+        self._store: 'BlobStore' = store
+
+    def acquire(self) -> None:
+        self._store.acquire(self)
+
+    def release(self) -> None:
+        self._store.release(self)
+
+
+"""
+    Content addressed, reference counted store of file contents.
+    Contents are keyed by (size, blake2b digest), so identical contents written to any number of
+    files are kept once; a blob is dropped when its last reference goes away.
+    Writers of separate subtrees share it, so a thread safe store guards itself
+"""
+class BlobStore:
+    def __init__(self, thread_safe=False) -> None:
+        self._blobs: Dict[Tuple[int, bytes], Blob] = {}
+        self._lock = threading.Lock() if thread_safe else nullcontext()
+
+        self.interned: int = 0
+        self.deduplicated: int = 0
+
+    # returns the blob for data with one reference taken for the caller
+    def intern(self, data: Union[bytes, bytearray]) -> Blob:
+        # hashed outside the lock, hashlib lets other threads run meanwhile
+        key = (len(data), hashlib.blake2b(data, digest_size=16).digest())
+
+        with self._lock:
+            self.interned += 1
+
+            blob = self._blobs.get(key)
+            if blob is None:
+                blob = self._blobs[key] = Blob(bytes(data), key, self)
+            else:
+                self.deduplicated += 1
+
+            blob.refcount += 1
+            return blob
+
+    def acquire(self, blob: Blob) -> None:
+        with self._lock:
+            # a freed blob can be taken again when a rolled back batch puts its file back
+            if blob.refcount == 0:
+                self._blobs.setdefault(blob.key, blob)
+
+            blob.refcount += 1
+
+    def release(self, blob: Blob) -> None:
+        with self._lock:
+            blob.refcount -= 1
+            if blob.refcount == 0 and self._blobs.get(blob.key) is blob:
+                del self._blobs[blob.key]
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        stored_bytes = 0
+        referenced_bytes = 0
+        references = 0
+        with self._lock:
+            blobs = list(self._blobs.values())
+        for blob in blobs:
+            stored_bytes += len(blob.data)
+            referenced_bytes += len(blob.data) * blob.refcount
+            references += blob.refcount
+
+        return {
+            'blobs': len(blobs),
+            'references': references,
+            'stored_bytes': stored_bytes,
+            'referenced_bytes': referenced_bytes,
+            'dedup_ratio': referenced_bytes / stored_bytes if stored_bytes else 1.0,
+            'interned': self.interned,
+            'deduplicated': self.deduplicated,
+        }
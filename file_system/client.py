@@ -0,0 +1,251 @@
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Union
+
+from file_system.batch import BatchResult
+from file_system.protocol import decode_batch_results, decode_error, encode_frame, pop_frames
+
+
+READ_SIZE = 256 * 1024
+
+
+"""
+    One connection to a FileSystemServer. Requests are pipelined: any number can be outstanding,
+    a reader task hands each reply to the future of its request
+"""
+class ClientConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader: asyncio.StreamReader = reader
+        self._writer: asyncio.StreamWriter = writer
+        self._request_ids = itertools.count()
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._reader_task: asyncio.Task = asyncio.get_running_loop().create_task(self._read_replies())
+
+    def get_pending_count(self) -> int:
+        return len(self._pending)
+
+    # writes all requests at once and returns one future per request
+    def send(self, requests: List[tuple]) -> List[asyncio.Future]:
+        if self._reader_task.done():
+            raise ConnectionError('Connection to the file system server is closed')
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        frames = []
+        for current_path, method_name, args, kwargs in requests:
+            request_id = next(self._request_ids)
+            future = self._pending[request_id] = loop.create_future()
+            futures.append(future)
+            frames.append(encode_frame([request_id, current_path, method_name, list(args), kwargs]))
+
+        self._writer.write(b''.join(frames))
+        return futures
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+
+    async def _read_replies(self) -> None:
+        buffer = bytearray()
+        try:
+            while True:
+                data = await self._reader.read(READ_SIZE)
+                if not data:
+                    break
+
+                buffer += data
+                for request_id, is_ok, value in pop_frames(buffer):
+                    future = self._pending.pop(request_id, None)
+                    if future is not None and not future.done():
+                        future.set_result((is_ok, value))
+        except ConnectionError:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection to the file system server was lost'))
+            self._pending.clear()
+
+
+"""
+    asyncio client of a FileSystemServer with the FileSystem API.
+
+    Calls go over a pool of connections, each call to the one with the fewest requests outstanding.
+    The current directory is kept here and sent with every request, so it does not matter which
+    connection serves a call. call_many sends a list of calls in one write and waits for all of them.
+
+      async with FileSystemClient(port=7777, pool_size=4) as client:
+          await client.make_new_file('/a/b')
+          results = await client.call_many([('cat', '/a/b'), ('ls',)])
+"""
+class FileSystemClient:
+    def __init__(
+        self,
+        host: Optional[str] = '127.0.0.1',
+        port: int = 7777,
+        path: Optional[str] = None,
+        pool_size: int = 4,
+    ) -> None:
+        self._host: Optional[str] = host
+        self._port: int = port
+        self._path: Optional[str] = path
+        self._pool_size: int = pool_size
+        self._connections: List[ClientConnection] = []
+        self._current_path: str = '/'
+
+    async def connect(self) -> None:
+        for _ in range(self._pool_size):
+            if self._path is not None:
+                reader, writer = await asyncio.open_unix_connection(self._path)
+            else:
+                reader, writer = await asyncio.open_connection(self._host, self._port)
+            self._connections.append(ClientConnection(reader, writer))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(connection.close() for connection in self._connections))
+        self._connections = []
+
+    async def __aenter__(self) -> 'FileSystemClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def call(self, method_name: str, *args: Any) -> Any:
+        connection = self._get_connection()
+        future = connection.send([(self._current_path, method_name, args, {})])[0]
+        await connection.drain()
+
+        return unpack_reply(await future)
+
+    """
+        Sends the calls, tuples of method name and arguments, together and returns a BatchResult per call.
+        Unlike batch they are separate calls, each one succeeding or failing on its own
+    """
+    async def call_many(self, calls: List[tuple]) -> List[BatchResult]:
+        connection = self._get_connection()
+        futures = connection.send([(self._current_path, call[0], call[1:], {}) for call in calls])
+        await connection.drain()
+
+        results = []
+        for future in futures:
+            is_ok, value = await future
+            results.append(BatchResult(value) if is_ok else BatchResult(error=decode_error(value)))
+
+        return results
+
+    async def change_dir(self, path: str) -> None:
+        # the server works out the new directory, '..' and all, and batch picks it up
+        results = await self.batch([('change_dir', path)])
+        if results[0].error is not None:
+            raise results[0].error
+
+    async def remove(self, path: str) -> None:
+        await self.call('remove', path)
+
+    async def move(self, from_path: str, to_path: str) -> None:
+        await self.call('move', from_path, to_path)
+
+    async def copy(self, from_path: str, to_path: str) -> None:
+        await self.call('copy', from_path, to_path)
+
+    async def make_new_dir(self, path: str) -> None:
+        await self.call('make_new_dir', path)
+
+    async def make_new_file(self, path: str) -> None:
+        await self.call('make_new_file', path)
+
+    async def ls(
+        self,
+        path: str = '.',
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        return await self.call('ls', path, start_after, limit, prefix)
+
+    def get_current_path(self) -> str:
+        return self._current_path
+
+    async def find(self, name: str, limit: Optional[int] = None, path: str = '.') -> List[str]:
+        return await self.call('find', name, limit, path)
+
+    async def grep(self, pattern: str, path: str = '.', ignore_case=False) -> List[str]:
+        return await self.call('grep', pattern, path, ignore_case)
+
+    async def du(self, path: str = '.') -> int:
+        return await self.call('du', path)
+
+    async def stat(self, path: str = '.') -> Dict[str, Union[str, int]]:
+        return await self.call('stat', path)
+
+    async def write(self, path: str, content: Union[str, bytes], append=False) -> None:
+        await self.call('write', path, content, append)
+
+    async def cat(self, path: str) -> str:
+        return await self.call('cat', path)
+
+    async def pread(self, path: str, offset: int, length: int) -> bytes:
+        return await self.call('pread', path, offset, length)
+
+    async def pwrite(self, path: str, offset: int, data: Union[str, bytes]) -> None:
+        await self.call('pwrite', path, offset, data)
+
+    async def truncate(self, path: str, size: int) -> None:
+        await self.call('truncate', path, size)
+
+    # inode numbers are the server's, valid for every client of the same tree
+    async def lookup(self, path: str) -> int:
+        return await self.call('lookup', path)
+
+    async def read_inode(self, inode: int, offset: int = 0, length: Optional[int] = None) -> bytes:
+        return await self.call('read_inode', inode, offset, length)
+
+    async def write_inode(self, inode: int, content: Union[str, bytes], append=False) -> None:
+        await self.call('write_inode', inode, content, append)
+
+    async def stat_inode(self, inode: int) -> Dict[str, Union[str, int]]:
+        return await self.call('stat_inode', inode)
+
+    async def ls_inode(
+        self,
+        inode: int,
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        return await self.call('ls_inode', inode, start_after, limit, prefix)
+
+    # a batch runs on the server as one call, see FileSystem.batch
+    async def batch(self, operations: List[tuple], atomic=False) -> List[BatchResult]:
+        # the batch may change directory, asking for the directory at its end keeps track of that
+        encoded = await self.call('batch', list(operations) + [('get_current_path',)], atomic)
+        results = decode_batch_results(encoded)
+
+        current_path = results.pop()
+        if current_path.is_ok():
+            self._current_path = current_path.value
+
+        return results
+
+    def _get_connection(self) -> ClientConnection:
+        if not self._connections:
+            raise ConnectionError('Client is not connected')
+
+        return min(self._connections, key=ClientConnection.get_pending_count)
+
+
+def unpack_reply(reply: tuple) -> Any:
+    is_ok, value = reply
+    if not is_ok:
+        raise decode_error(value)
+
+    return value
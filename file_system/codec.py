@@ -0,0 +1,124 @@
+import struct
+from typing import Any, Tuple
+
+from file_system.error import InvalidOperationException
+
+
+"""
+    Compact tagged binary encoding for the values passed to and returned by FileSystem calls:
+    None, bool, int, float, str, bytes, list/tuple (decoded as list) and dict.
+    Used wherever calls are written out, e.g. the journal
+"""
+
+TAG_NONE = b'N'
+TAG_TRUE = b'T'
+TAG_FALSE = b'F'
+TAG_INT = b'I'
+TAG_FLOAT = b'D'
+TAG_STR = b'S'
+TAG_BYTES = b'B'
+TAG_LIST = b'L'
+TAG_DICT = b'M'
+
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+LENGTH = struct.Struct('<I')
+
+
+def encode(value: Any) -> bytes:
+    buffer = bytearray()
+    _encode_into(buffer, value)
+    return bytes(buffer)
+
+
+def decode(data: bytes) -> Any:
+    value, offset = decode_from(data, 0)
+    if offset != len(data):
+        raise InvalidOperationException('Trailing bytes after encoded value')
+
+    return value
+
+
+def decode_from(data: bytes, offset: int) -> Tuple[Any, int]:
+    try:
+        return _decode_from(data, offset)
+    except (IndexError, TypeError, struct.error, UnicodeDecodeError):
+        raise InvalidOperationException('Malformed encoded value')
+
+
+def _encode_into(buffer: bytearray, value: Any) -> None:
+    if value is None:
+        buffer += TAG_NONE
+    elif value is True:
+        buffer += TAG_TRUE
+    elif value is False:
+        buffer += TAG_FALSE
+    elif isinstance(value, int):
+        buffer += TAG_INT
+        buffer += INT.pack(value)
+    elif isinstance(value, float):
+        buffer += TAG_FLOAT
+        buffer += FLOAT.pack(value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        buffer += TAG_STR
+        buffer += LENGTH.pack(len(encoded))
+        buffer += encoded
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        buffer += TAG_BYTES
+        buffer += LENGTH.pack(len(value))
+        buffer += value
+    elif isinstance(value, (list, tuple)):
+        buffer += TAG_LIST
+        buffer += LENGTH.pack(len(value))
+        for item in value:
+            _encode_into(buffer, item)
+    elif isinstance(value, dict):
+        buffer += TAG_DICT
+        buffer += LENGTH.pack(len(value))
+        for key, item in value.items():
+            _encode_into(buffer, key)
+            _encode_into(buffer, item)
+    else:
+        raise InvalidOperationException('Can not encode value of type ' + type(value).__name__)
+
+
+def _decode_from(data: bytes, offset: int) -> Tuple[Any, int]:
+    tag = data[offset:offset + 1]
+    offset += 1
+
+    if tag == TAG_NONE:
+        return None, offset
+    if tag == TAG_TRUE:
+        return True, offset
+    if tag == TAG_FALSE:
+        return False, offset
+    if tag == TAG_INT:
+        return INT.unpack_from(data, offset)[0], offset + INT.size
+    if tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+
+    if tag in (TAG_STR, TAG_BYTES, TAG_LIST, TAG_DICT):
+        length = LENGTH.unpack_from(data, offset)[0]
+        offset += LENGTH.size
+
+        if tag == TAG_STR or tag == TAG_BYTES:
+            if offset + length > len(data):
+                raise IndexError()
+            raw = bytes(data[offset:offset + length])
+            return (raw.decode('utf-8') if tag == TAG_STR else raw), offset + length
+
+        if tag == TAG_LIST:
+            items = []
+            for _ in range(length):
+                item, offset = _decode_from(data, offset)
+                items.append(item)
+            return items, offset
+
+        mapping = {}
+        for _ in range(length):
+            key, offset = _decode_from(data, offset)
+            mapping[key], offset = _decode_from(data, offset)
+        return mapping, offset
+
+    raise InvalidOperationException('Unknown tag ' + repr(tag))
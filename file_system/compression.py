@@ -0,0 +1,188 @@
+import lzma
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from file_system.error import InvalidOperationException
+from file_system.file import File, LazyContent
+
+
+# algorithm name -> (compress, decompress)
+ALGORITHMS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# compressed content has to be at most this fraction of the raw size to be kept
+MAX_COMPRESSED_RATIO = 0.9
+
+
+"""
+    Compressed content of a file, decompressed the first time it is needed.
+    Files sharing a content when it was compressed share one CompressedContent
+"""
+class CompressedContent(LazyContent):
+    def __init__(self, compressor: 'ContentCompressor', data: bytes, length: int) -> None:
+        self.data: bytes = data
+        self._length: int = length
+        self._compressor: 'ContentCompressor' = compressor
+
+    def load(self) -> bytes:
+        return self._compressor.decompress(self)
+
+    def get_size(self) -> int:
+        return self._length
+
+
+"""
+    Compresses file contents that went unused for cold_after seconds. Files are tracked in least
+    recently used order as they are linked into the tree and whenever a call reads or writes
+    their content, so the cold ones are found at the front without looking at the others.
+    A compressed file is decompressed transparently by the next access (and is then hot again);
+    calls that only look at the content (grep, save) decompress it without keeping it.
+    Contents below min_size, not in memory (spilled, in a snapshot) or not compressing well
+    stay as they are
+"""
+class ContentCompressor:
+    def __init__(self, algorithm: str, cold_after: float, min_size: int) -> None:
+        if algorithm not in ALGORITHMS:
+            raise InvalidOperationException('Unknown compression ' + str(algorithm))
+
+        self._algorithm: str = algorithm
+        self._compress, self._decompress = ALGORITHMS[algorithm]
+        self._cold_after: float = cold_after
+        self._min_size: int = min_size
+        self._lock = threading.Lock()
+
+        # file -> time of its last access, least recently used first
+        self._last_access: 'OrderedDict[File, float]' = OrderedDict()
+        self._compressed: 'weakref.WeakSet[CompressedContent]' = weakref.WeakSet()
+
+        self._compressions: int = 0
+        self._decompressions: int = 0
+        self._decompress_seconds: float = 0.0
+        self._max_decompress_seconds: float = 0.0
+
+    def touch(self, file: File) -> None:
+        with self._lock:
+            self._last_access[file] = time.monotonic()
+            self._last_access.move_to_end(file)
+
+    def forget(self, file: File) -> None:
+        with self._lock:
+            self._last_access.pop(file, None)
+
+    # takes the files that were not accessed for cold_after seconds out of the tracking
+    def pop_cold_files(self) -> List[File]:
+        cold_before = time.monotonic() - self._cold_after
+        cold_files = []
+        with self._lock:
+            while self._last_access:
+                file, last_access = next(iter(self._last_access.items()))
+                if last_access > cold_before:
+                    break
+
+                del self._last_access[file]
+                cold_files.append(file)
+
+        return cold_files
+
+    # accessed again since pop_cold_files returned it
+    def is_hot(self, file: File) -> bool:
+        with self._lock:
+            return file in self._last_access
+
+    """
+        Compresses the content of file, reusing the result for contents already compressed in the
+        same pass (shared_contents maps the id of a raw content to its CompressedContent, or None
+        if it did not compress well). Returns whether file is compressed now
+    """
+    def compress_file(self, file: File, shared_contents: Dict[int, Tuple[bytes, Optional[CompressedContent]]]) -> bool:
+        if not file.is_content_loaded() or file.get_size() < self._min_size:
+            return False
+
+        data = file.get_content_buffer()
+        shared = shared_contents.get(id(data)) if isinstance(data, bytes) else None
+        if shared is not None:
+            content = shared[1]
+        else:
+            compressed_data = self._compress(bytes(data))
+            content = None
+            if len(compressed_data) <= len(data) * MAX_COMPRESSED_RATIO:
+                content = CompressedContent(self, compressed_data, len(data))
+                with self._lock:
+                    self._compressed.add(content)
+                    self._compressions += 1
+
+            if isinstance(data, bytes):
+                # the raw content is held in the dict so its id is not reused during the pass
+                shared_contents[id(data)] = (data, content)
+
+        if content is None:
+            return False
+
+        file.set_lazy_content(content)
+        return True
+
+    def decompress(self, content: CompressedContent) -> bytes:
+        start = time.perf_counter()
+        data = self._decompress(content.data)
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._decompressions += 1
+            self._decompress_seconds += seconds
+            self._max_decompress_seconds = max(self._max_decompress_seconds, seconds)
+
+        return data
+
+    def get_stats(self) -> Dict[str, Union[str, int, float]]:
+        with self._lock:
+            contents = list(self._compressed)
+            decompressions = self._decompressions
+
+            raw_bytes = sum(content.get_size() for content in contents)
+            compressed_bytes = sum(len(content.data) for content in contents)
+            return {
+                'algorithm': self._algorithm,
+                'tracked_files': len(self._last_access),
+                'compressed_contents': len(contents),
+                'raw_bytes': raw_bytes,
+                'compressed_bytes': compressed_bytes,
+                'ratio': raw_bytes / compressed_bytes if compressed_bytes else 1.0,
+                'compressions': self._compressions,
+                'decompressions': decompressions,
+                'decompress_avg_us': self._decompress_seconds / decompressions * 1e6 if decompressions else 0.0,
+                'decompress_max_us': self._max_decompress_seconds * 1e6,
+            }
+
+
+"""
+    Runs compress_cold on a file system every interval seconds from a daemon thread,
+    until the file system is garbage collected or stop is called
+"""
+class BackgroundCompressor:
+    def __init__(self, fs, interval: float) -> None:
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=run_compressor, args=(weakref.ref(fs), interval, self._stopped), daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+
+# holds the file system only while compressing, so the thread does not keep it alive
+def run_compressor(fs_ref: Callable[[], Optional[object]], interval: float, stopped: threading.Event) -> None:
+    while not stopped.wait(interval):
+        fs = fs_ref()
+        if fs is None:
+            return
+
+        fs.compress_cold()
+        del fs
@@ -1,3 +1,19 @@
 
 FILE_NAME_AUTO_INC_MAX = 1000000
-RESERVED_FILE_NAMES = ['.', '..']
\ No newline at end of file
+RESERVED_FILE_NAMES = ['.', '..']
+# number of resolved paths kept by the path cache, 0 disables it
+PATH_CACHE_SIZE = 4096
+# contents smaller than this are not counted against the memory budget and never spilled
+SPILL_MIN_FILE_SIZE = 1024
+# contents smaller than this are never compressed
+COMPRESS_MIN_FILE_SIZE = 4096
+# seconds without a read or write after which a content counts as cold and may be compressed
+COMPRESS_AFTER_SECONDS = 60.0
+# files compressed per write lock hold by compress_cold, so readers get in between
+COMPRESS_BATCH_SIZE = 64
+# name index entries ifind checks per read lock hold
+FIND_BATCH_SIZE = 256
+# files larger than this are not split into trigrams by the content index, grep always searches them
+CONTENT_INDEX_MAX_FILE_SIZE = 16 * 1024 * 1024
+# events a watcher queues before dropping them for a single overflow event
+WATCH_QUEUE_SIZE = 4096
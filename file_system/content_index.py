@@ -0,0 +1,258 @@
+import re
+import threading
+from contextlib import nullcontext
+from typing import Dict, FrozenSet, List, Set, Tuple, Union
+
+from file_system.file import File
+
+
+# three consecutive bytes of content
+Trigram = Tuple[int, int, int]
+
+# characters with a meaning of their own in a regular expression
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]|()\\')
+
+# hex digits following \x, \u and \U
+ESCAPE_CODE_LENGTHS = {'x': 2, 'u': 4, 'U': 8}
+
+
+"""
+    Trigram index over file contents, used by grep. Every sequence of 3 bytes of a file's content,
+    ASCII lower cased, maps to the files containing it, so a pattern that needs some literal text
+    is answered by intersecting the file sets of that text's trigrams: only files that may match
+    are searched, whatever the total size of the tree.
+
+    Changes only mark a file dirty, the next refresh (done by grep) indexes it again, so any number
+    of writes between two greps cost one indexing. Files larger than max_file_size are not indexed
+    and are searched by every query. Writers of separate subtrees change it side by side with greps,
+    so a thread safe index guards itself
+"""
+class ContentIndex:
+    def __init__(self, max_file_size: int, thread_safe=False) -> None:
+        self._max_file_size: int = max_file_size
+        self._lock = threading.RLock() if thread_safe else nullcontext()
+
+        # trigram -> files containing it
+        self._postings: Dict[Trigram, Set[File]] = {}
+        # file -> its trigrams, to take it out of the postings again
+        self._file_trigrams: Dict[File, FrozenSet[Trigram]] = {}
+        # files added or changed since the last refresh
+        self._dirty: Set[File] = set()
+        # indexed files too large to be split into trigrams
+        self._unindexed: Set[File] = set()
+
+    def add(self, file: File) -> None:
+        with self._lock:
+            self._dirty.add(file)
+
+    def discard(self, file: File) -> None:
+        with self._lock:
+            self._drop_postings(file)
+            self._dirty.discard(file)
+
+    # the content of file changed. Files that are not in the index are left out
+    def mark_dirty(self, file: File) -> None:
+        with self._lock:
+            if file in self._file_trigrams or file in self._unindexed:
+                self._dirty.add(file)
+
+    def needs_refresh(self) -> bool:
+        return bool(self._dirty)
+
+    # indexes every dirty file and returns their number. Copies sharing content are split once
+    def refresh(self) -> int:
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        split_contents: Dict[int, Tuple[bytes, FrozenSet[Trigram]]] = {}
+        indexed = len(self._dirty)
+
+        for file in self._dirty:
+            self._drop_postings(file)
+
+            content = file.peek_content()
+            if len(content) > self._max_file_size:
+                self._unindexed.add(file)
+                continue
+
+            if isinstance(content, bytes):
+                # keyed by identity, the content is held in the dict so the id stays unique
+                split = split_contents.get(id(content))
+                if split is None:
+                    split = split_contents[id(content)] = (content, get_trigrams(content))
+                trigrams = split[1]
+            else:
+                trigrams = get_trigrams(content)
+
+            self._file_trigrams[file] = trigrams
+            for trigram in trigrams:
+                files = self._postings.get(trigram)
+                if files is None:
+                    files = self._postings[trigram] = set()
+                files.add(file)
+
+        self._dirty.clear()
+        return indexed
+
+    """
+        Files that may contain text with all the given trigrams (which must be lower cased).
+        Must be refreshed first
+    """
+    def lookup(self, trigrams: List[Trigram]) -> Set[File]:
+        with self._lock:
+            posting_sets = []
+            for trigram in trigrams:
+                files = self._postings.get(trigram)
+                if files is None:
+                    return set(self._unindexed)
+                posting_sets.append(files)
+
+            posting_sets.sort(key=len)
+            return posting_sets[0].intersection(*posting_sets[1:]) | self._unindexed
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'files': len(self._file_trigrams),
+                'trigrams': len(self._postings),
+                'dirty': len(self._dirty),
+                'unindexed': len(self._unindexed),
+            }
+
+    def _drop_postings(self, file: File) -> None:
+        self._unindexed.discard(file)
+        trigrams = self._file_trigrams.pop(file, None)
+        if trigrams is None:
+            return
+
+        for trigram in trigrams:
+            files = self._postings[trigram]
+            files.discard(file)
+            if not files:
+                del self._postings[trigram]
+
+
+# tuples of byte values rather than slices, zip builds them without a Python level loop
+def get_trigrams(content: Union[bytes, bytearray]) -> FrozenSet[Trigram]:
+    content = content.lower()
+    return frozenset(zip(content, content[1:], content[2:]))
+
+
+"""
+    Lower cased trigrams that every match of the regular expression contains, [] when nothing is
+    known about its matches (then every file has to be searched)
+"""
+def get_query_trigrams(regex: re.Pattern) -> List[Trigram]:
+    if regex.flags & re.VERBOSE:
+        # white space and comments in the pattern are not part of the text
+        return []
+
+    trigrams = set()
+    for literal in get_required_literals(regex.pattern.decode('utf-8', errors='replace')):
+        trigrams.update(get_trigrams(literal.encode('utf-8')))
+
+    return sorted(trigrams)
+
+
+"""
+    Runs of literal text that every match of the pattern contains, found by a conservative scan:
+    only characters outside of groups and sets that no quantifier makes optional count, and
+    alternation at the top level means no text is required at all
+"""
+def get_required_literals(pattern: str) -> List[str]:
+    literals = []
+    run = []
+    depth = 0
+    # whether the previous item was a literal character added to run
+    after_literal = False
+
+    def end_run():
+        if run:
+            literals.append(''.join(run))
+            run.clear()
+
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        literal = None
+
+        if char == '\\':
+            escaped = pattern[idx + 1:idx + 2]
+            # \d, \w, \b, \1, \x41... are classes, anchors, references or codes, not text
+            if escaped and not escaped.isalnum():
+                literal = escaped
+            idx = skip_escape(pattern, idx)
+        elif char == '[':
+            idx = skip_set(pattern, idx)
+        elif char == '(':
+            depth += 1
+            idx += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+            idx += 1
+        elif char == '|':
+            if depth == 0:
+                return []
+            idx += 1
+        elif char in '*?{':
+            # the previous character may not be there at all
+            if after_literal and run:
+                run.pop()
+            if char == '{':
+                closing = pattern.find('}', idx)
+                idx = len(pattern) if closing < 0 else closing + 1
+            else:
+                idx += 1
+        elif char == '+':
+            # the previous character is there, but may be repeated
+            idx += 1
+        elif char in REGEX_SPECIAL_CHARACTERS:
+            idx += 1
+        else:
+            literal = char
+            idx += 1
+
+        if literal is not None and depth == 0:
+            run.append(literal)
+            after_literal = True
+        else:
+            end_run()
+            after_literal = False
+
+    end_run()
+    return literals
+
+
+# index just past the escape starting at pattern[idx] == '\\'
+def skip_escape(pattern: str, idx: int) -> int:
+    escaped = pattern[idx + 1:idx + 2]
+    idx += 2
+
+    if escaped in ESCAPE_CODE_LENGTHS:
+        return idx + ESCAPE_CODE_LENGTHS[escaped]
+    if escaped == 'N':
+        closing = pattern.find('}', idx)
+        return len(pattern) if closing < 0 else closing + 1
+    if escaped.isdigit():
+        # group reference or octal code, up to three digits
+        end = min(idx + 2, len(pattern))
+        while idx < end and pattern[idx].isdigit():
+            idx += 1
+
+    return idx
+
+
+# index just past the set starting at pattern[idx] == '['
+def skip_set(pattern: str, idx: int) -> int:
+    idx += 1
+    if pattern[idx:idx + 1] == '^':
+        idx += 1
+    # a ']' right at the start is part of the set
+    if pattern[idx:idx + 1] == ']':
+        idx += 1
+
+    while idx < len(pattern) and pattern[idx] != ']':
+        idx += 2 if pattern[idx] == '\\' else 1
+
+    return idx + 1
@@ -6,4 +6,10 @@ class InvalidPathComponentException(Exception):
     pass
 
 class InvalidOperationException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class InvalidSnapshotException(Exception):
+    pass
+
+class RemoteException(Exception):
+    pass
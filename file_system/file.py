@@ -1,9 +1,23 @@
-from typing import Optional, List, Dict
+import sys
+import threading
+from typing import Optional, List, Dict, Tuple, Union, Iterator
 
+from file_system.blob_store import Blob
+from file_system.error import InvalidOperationException
+from file_system.sorted_names import SortedNameList
+
+"""
+    Nodes use __slots__ (no per instance __dict__) and interned names: the name stored here and the
+    key in the parent's children dict are the same string object, shared by every node with that name
+"""
 class AbstractFile:
+    __slots__ = ('_name', '_parent', '_inode')
+
     def __init__(self, name: str, parent: Optional['AbstractFile']) -> None:
-      self._name: str = name
+      self._name: str = sys.intern(name)
       self._parent: 'AbstractFile' = parent
+      # 0 until the file system's inode table hands out a number, see inode.py
+      self._inode: int = 0
       
       # parent of root is itself
       if parent is None:
@@ -14,52 +28,374 @@ class AbstractFile:
     
     def get_parent(self) -> 'AbstractFile':
         return self._parent
+
+    def set_parent(self, parent: 'AbstractFile') -> None:
+        self._parent = parent
+
+    def get_inode(self) -> int:
+        return self._inode
+
+    def set_inode(self, inode: int) -> None:
+        self._inode = inode
     
     # note that this is not equivalent to renaming a file
     # to rename a file, the node in parent children tree also needs to be renamed
     def set_name_in_file_metadata_only(self, name: str) -> None:
-        self._name = name
+        self._name = sys.intern(name)
+
 
+"""
+    Content that is not held in memory yet (e.g. still in a snapshot file).
+    A file holding one loads it the first time the content is needed
+"""
+class LazyContent:
+    def load(self) -> bytes:
+        raise NotImplementedError()
 
+    def get_size(self) -> int:
+        raise NotImplementedError()
+
+    # what the file keeps of the loaded data, the bytes themselves unless the content was a blob
+    def keep(self, data: bytes) -> Union[bytes, Blob]:
+        return data
+
+
+"""
+    Content is stored as utf-8 bytes.
+    A private bytearray is grown in place, so appends are amortized O(1) and offset writes only touch
+    the bytes they cover. Content shared with a copy is frozen to immutable bytes and only turned back
+    into a private bytearray by whichever side writes first (copy on write).
+    Views handed out by get_content_view are not copies either; a write that finds one of them still
+    alive moves the content to a new bytearray first, so the bytes seen through a view never change.
+    Shared content can also be a Blob of the file system's blob store, which the file holds one
+    reference to until the content is replaced or changed
+"""
 class File(AbstractFile):
+    __slots__ = ('_data',)
+
     def __init__(self, name, parent):
         super().__init__(name, parent)
 
-        self.content: str = ''
+        self._data: Union[bytes, bytearray, Blob, LazyContent] = b''
     
-    def write(self, content: str, append=False) -> None:
+    def write(self, content: Union[str, bytes], append=False) -> None:
+        content = to_bytes(content)
+
         if append:
-            self.content += content
+            self._get_mutable_data().extend(content)
+            self._add_to_directory_sizes(len(content))
         
         else:
-            self.content = content
+            self._set_data(bytes(content))
     
     def read(self) -> str:
-        return self.content
+        return self._get_data().decode('utf-8', errors='replace')
+
+    def read_bytes(self) -> bytes:
+        return bytes(self._get_data())
+
+    # the stored bytes, without copying. Callers must not modify or hold on to it across writes
+    def get_content_buffer(self) -> Union[bytes, bytearray]:
+        return self._get_data()
+
+    # a view of the stored bytes, without copying. It keeps showing them whatever is written afterwards
+    def get_content_view(self) -> memoryview:
+        return memoryview(self._get_data())
+
+    # like get_content_buffer, but content that is not in memory is read without being kept there
+    def peek_content(self) -> Union[bytes, bytearray]:
+        data = self._data
+        if isinstance(data, LazyContent):
+            return data.load()
+
+        return data.data if isinstance(data, Blob) else data
+
+    # false while the content still has to be loaded, e.g. from a snapshot or a spill file
+    def is_content_loaded(self) -> bool:
+        return not isinstance(self._data, LazyContent)
+
+    @property
+    def content(self) -> str:
+        return self.read()
+
+    def get_size(self) -> int:
+        data = self._data
+        if isinstance(data, LazyContent):
+            return data.get_size()
+        if isinstance(data, Blob):
+            return len(data.data)
+
+        return len(data)
+
+    def pread(self, offset: int, length: int) -> bytes:
+        if offset < 0 or length < 0:
+            raise InvalidOperationException('Offset and length can not be negative')
+
+        return bytes(self._get_data()[offset:offset + length])
+
+    # writing past the end fills the gap with zero bytes
+    def pwrite(self, offset: int, data: Union[str, bytes]) -> None:
+        if offset < 0:
+            raise InvalidOperationException('Offset can not be negative')
+
+        data = to_bytes(data)
+        buffer = self._get_mutable_data()
+        old_size = len(buffer)
+        if offset > len(buffer):
+            buffer.extend(bytes(offset - len(buffer)))
+
+        buffer[offset:offset + len(data)] = data
+        self._add_to_directory_sizes(len(buffer) - old_size)
+
+    def truncate(self, size: int) -> None:
+        if size < 0:
+            raise InvalidOperationException('Size can not be negative')
+
+        buffer = self._get_mutable_data()
+        self._add_to_directory_sizes(size - len(buffer))
+        if size < len(buffer):
+            del buffer[size:]
+        else:
+            buffer.extend(bytes(size - len(buffer)))
+
+    def share_content_with(self, file: 'File') -> None:
+        self._set_data(file.snapshot_content())
+
+    # freezes the content, so the returned bytes stay valid whatever is written to the file afterwards
+    def snapshot_content(self) -> bytes:
+        data = self._get_data()
+        if isinstance(data, bytearray):
+            data = bytes(data)
+            self._set_data(data)
+
+        return data
+
+    def restore_content(self, snapshot: bytes) -> None:
+        self._set_data(snapshot)
+
+    def set_lazy_content(self, content: LazyContent) -> None:
+        self._set_data(content)
+
+    def get_content_blob(self) -> Optional[Blob]:
+        return self._data if isinstance(self._data, Blob) else None
+
+    # takes over the reference the caller holds on blob
+    def set_content_blob(self, blob: Blob) -> None:
+        self._set_data(blob)
+
+    # keeps the content but gives the blob reference back, for files leaving the tree
+    def release_content_blob(self) -> None:
+        if isinstance(self._data, Blob):
+            self._set_data(self._data.data)
+
+    def _set_data(self, data: Union[bytes, bytearray, Blob, LazyContent]) -> None:
+        old_size = self.get_size()
+        if isinstance(self._data, Blob):
+            self._data.release()
+
+        self._data = data
+        self._add_to_directory_sizes(self.get_size() - old_size)
+
+    def _add_to_directory_sizes(self, delta: int) -> None:
+        if delta and self._parent is not self and self._parent.children.get(self._name) is self:
+            add_to_aggregates(self._parent, delta, 0, 0)
+
+    def _get_data(self) -> Union[bytes, bytearray]:
+        data = self._data
+        if isinstance(data, LazyContent):
+            data = self._data = data.keep(data.load())
+        if isinstance(data, Blob):
+            return data.data
+
+        return data
 
+    def _get_mutable_data(self) -> bytearray:
+        data = self._get_data()
+        if not isinstance(data, bytearray) or has_live_views(data):
+            data = bytearray(data)
+            self._set_data(data)
 
+        return data
+
+
+"""
+    Besides its children a directory keeps aggregates of everything below it: total content size,
+    file count and directory count. Linking, unlinking and resizing push a delta up the parent chain,
+    so they are O(depth) and reading them is O(1).
+    Sorted listing goes through an ordered index of the child names, built on first use
+"""
 class Directory(AbstractFile):
+    __slots__ = ('children', '_name_suffix_hints', '_child_loader', '_total_size', '_file_count', '_dir_count', '_sorted_names')
+
     def __init__(self, name, parent):
         super().__init__(name, parent)
         
         self.children: Dict[str, AbstractFile] = {}
+
+        # base name -> lowest suffix that may still be free for 'base_<suffix>' collision names,
+        # only created once a collision happens in this directory
+        self._name_suffix_hints: Optional[Dict[str, int]] = None
+
+        # set when the children still live in a snapshot, they are created on first access
+        self._child_loader: Optional['ChildLoader'] = None
+
+        self._total_size: int = 0
+        self._file_count: int = 0
+        self._dir_count: int = 0
+
+        # child names in sorted order, None until the directory is first listed sorted
+        self._sorted_names: Optional[SortedNameList] = None
     
     def add_file(self, file: AbstractFile) -> None:
+        self._load_children()
+        replaced_file = self.children.get(file.get_name())
         self.children[file.get_name()] = file
+
+        if replaced_file is not file:
+            if replaced_file is not None:
+                add_to_aggregates(self, *get_aggregates_including_self(replaced_file), sign=-1)
+            add_to_aggregates(self, *get_aggregates_including_self(file))
+
+        if replaced_file is None and self._sorted_names is not None:
+            self._sorted_names.add(file.get_name())
     
     def remove_file(self, file: AbstractFile) -> None:
+        self._load_children()
+
+        # removing 'base_3' frees suffix 3 for base, so the hint must not stay above it.
+        # Done first, nothing is changed yet if it fails. isdigit would also take '²', which int rejects
+        if self._name_suffix_hints:
+            base, _, suffix = file.get_name().rpartition('_')
+            if suffix.isascii() and suffix.isdecimal() and base in self._name_suffix_hints:
+                self._name_suffix_hints[base] = min(self._name_suffix_hints[base], int(suffix))
+
         self.children.pop(file.get_name())
+        add_to_aggregates(self, *get_aggregates_including_self(file), sign=-1)
+
+        if self._sorted_names is not None:
+            self._sorted_names.remove(file.get_name())
+
+    def get_name_suffix_hint(self, base_name: str) -> int:
+        if not self._name_suffix_hints:
+            return 1
+
+        return self._name_suffix_hints.get(base_name, 1)
+
+    def set_name_suffix_hint(self, base_name: str, suffix: int) -> None:
+        if self._name_suffix_hints is None:
+            self._name_suffix_hints = {}
+
+        self._name_suffix_hints[base_name] = suffix
     
     def has_child(self, name: str) -> bool:
+        self._load_children()
         return name in self.children.keys()
     
     def get_child(self, name: str) -> AbstractFile:
+        self._load_children()
         return self.children[name]
     
     def get_all_children(self) -> List[AbstractFile]:
+        self._load_children()
         return list(self.children.values())
+
+    """
+        Child names in sorted order that start with prefix, beginning after start_after
+        (or at the first one if it is None). Costs O(log n) to start, nothing is copied
+    """
+    def iterate_sorted_names(self, start_after: Optional[str] = None, prefix: str = '') -> Iterator[str]:
+        if self._sorted_names is None:
+            self._load_children()
+            self._sorted_names = SortedNameList(self.children)
+
+        # names with the prefix are one run of the sorted names, starting at the prefix itself
+        if start_after is None or start_after < prefix:
+            names = self._sorted_names.iterate_from(prefix)
+        else:
+            names = self._sorted_names.iterate_from(start_after, inclusive=False)
+
+        for name in names:
+            if not name.startswith(prefix):
+                return
+            yield name
+
+    def set_child_loader(self, child_loader: Optional['ChildLoader']) -> None:
+        self._child_loader = child_loader
+
+    # (total size, file count, directory count) of everything below this directory
+    def get_aggregates(self) -> Tuple[int, int, int]:
+        return self._total_size, self._file_count, self._dir_count
+
+    # for directories loaded lazily, whose children are not there to count yet
+    def set_aggregates(self, total_size: int, file_count: int, dir_count: int) -> None:
+        self._total_size = total_size
+        self._file_count = file_count
+        self._dir_count = dir_count
+
+    def is_loaded(self) -> bool:
+        return self._child_loader is None
+
+    def _load_children(self) -> None:
+        if self._child_loader is not None:
+            self._child_loader.load_children(self)
     
     def is_root(self) -> bool:
         return self._parent == self
-    
 
+
+"""
+    Creates the children of a directory that was loaded lazily,
+    then clears itself from the directory with set_child_loader(None)
+"""
+class ChildLoader:
+    def load_children(self, directory: Directory) -> None:
+        raise NotImplementedError()
+
+
+# writers of separate subtrees of a thread safe file system push deltas into the same ancestors
+_aggregates_lock = threading.Lock()
+
+
+"""
+    Adds the deltas to directory and every ancestor it is linked under. Nodes being built
+    outside the tree (e.g. a copy before it is attached) already point at their future parent,
+    so the walk stops at the first node its parent does not actually hold
+"""
+def add_to_aggregates(directory: Directory, total_size: int, file_count: int, dir_count: int, sign: int = 1) -> None:
+    total_size *= sign
+    file_count *= sign
+    dir_count *= sign
+
+    with _aggregates_lock:
+        while True:
+            directory._total_size += total_size
+            directory._file_count += file_count
+            directory._dir_count += dir_count
+
+            parent = directory._parent
+            if parent is directory or parent.children.get(directory._name) is not directory:
+                return
+            directory = parent
+
+
+# what linking file adds to the aggregates of its parent
+def get_aggregates_including_self(file: AbstractFile) -> Tuple[int, int, int]:
+    if isinstance(file, Directory):
+        return file._total_size, file._file_count, file._dir_count + 1
+
+    return file.get_size(), 1, 0
+
+
+def to_bytes(content: Union[str, bytes]) -> bytes:
+    return content.encode('utf-8') if isinstance(content, str) else content
+
+
+# whether views of buffer (or slices of them) are still alive: a bytearray refuses to grow while it has any
+def has_live_views(buffer: bytearray) -> bool:
+    try:
+        buffer.append(0)
+    except BufferError:
+        return True
+
+    buffer.pop()
+    return False
@@ -0,0 +1,118 @@
+from typing import Iterator, Union
+
+from file_system.error import InvalidOperationException
+from file_system.file import to_bytes
+
+SEEK_SET = 0
+SEEK_CUR = 1
+SEEK_END = 2
+
+READ_MODES = frozenset(['r', 'r+', 'w+', 'a+'])
+WRITE_MODES = frozenset(['r+', 'w', 'w+', 'a', 'a+'])
+APPEND_MODES = frozenset(['a', 'a+'])
+OPEN_MODES = READ_MODES | WRITE_MODES
+
+
+"""
+    File like handle returned by FileSystem.open.
+    It keeps the file node itself, so reads and writes skip path resolution and keep working on the same
+    file after it is moved. Reads return memoryview slices of the stored bytes instead of copies;
+    a view stays valid (and unchanged) when the file is written afterwards, writes go to a new buffer
+"""
+class FileHandle:
+    def __init__(self, fs, file, mode: str) -> None:
+        self._fs = fs
+        self._file = file
+        self._mode: str = mode
+        self._position: int = 0
+        self.closed: bool = False
+
+    def read(self, size: int = -1) -> memoryview:
+        self._check_readable()
+
+        view = self._fs._read_file_view(self._file)
+        end = len(view) if size is None or size < 0 else min(len(view), self._position + size)
+        chunk = view[self._position:end]
+        self._position = max(self._position, end)
+        self._fs._count('bytes_read', len(chunk))
+
+        return chunk
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+
+        return len(chunk)
+
+    def readline(self, size: int = -1) -> memoryview:
+        self._check_readable()
+
+        view = self._fs._read_file_view(self._file)
+        start = min(self._position, len(view))
+        end = view.obj.find(b'\n', start) + 1 or len(view)
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+
+        self._position = end
+        self._fs._count('bytes_read', end - start)
+        return view[start:end]
+
+    def write(self, data: Union[str, bytes]) -> int:
+        self._check_writable()
+
+        data = to_bytes(data)
+        self._position = self._fs._write_file_at(self._file, self._position, data, self._mode in APPEND_MODES) + len(data)
+
+        return len(data)
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        self._check_open()
+
+        if whence == SEEK_SET:
+            position = offset
+        elif whence == SEEK_CUR:
+            position = self._position + offset
+        elif whence == SEEK_END:
+            position = self._file.get_size() + offset
+        else:
+            raise InvalidOperationException('Invalid whence ' + str(whence))
+
+        if position < 0:
+            raise InvalidOperationException('Can not seek before the start of the file')
+
+        self._position = position
+        return position
+
+    def tell(self) -> int:
+        self._check_open()
+        return self._position
+
+    def close(self) -> None:
+        self.closed = True
+
+    def __iter__(self) -> Iterator[memoryview]:
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def __enter__(self) -> 'FileHandle':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _check_open(self) -> None:
+        if self.closed:
+            raise InvalidOperationException('I/O operation on closed file handle')
+
+    def _check_readable(self) -> None:
+        self._check_open()
+        if self._mode not in READ_MODES:
+            raise InvalidOperationException('File handle is not open for reading')
+
+    def _check_writable(self) -> None:
+        self._check_open()
+        if self._mode not in WRITE_MODES:
+            raise InvalidOperationException('File handle is not open for writing')
@@ -1,132 +1,1347 @@
-from typing import Tuple, List
+import fnmatch
+import functools
+import heapq
+import inspect
+import re
+import threading
+from contextlib import nullcontext
+from itertools import islice
+from typing import Any, Tuple, List, Dict, Set, Optional, Union, Callable, Iterator, ContextManager
 
-from file_system.file import Directory, File, AbstractFile
-from file_system.utils import is_directory, is_file, join_path, parse_path, get_valid_name_before_adding_to_dir
+import file_system.constant as constant
+from file_system.batch import BatchResult, BATCH_OPERATIONS
+from file_system.blob_store import BlobStore
+from file_system.compression import BackgroundCompressor, ContentCompressor
+from file_system.content_index import ContentIndex, get_query_trigrams
+from file_system.file import Directory, File, AbstractFile, to_bytes
+from file_system.file_handle import FileHandle, OPEN_MODES
+from file_system.inode import InodeTable
+from file_system.lazy_copy import CopyLoader
+from file_system.lock import EXCLUSIVE, SHARED, LockPath, TreeLock, add_lock_target
+from file_system.metrics import Hook, Metrics
+from file_system.path_cache import PathCache
+from file_system.snapshot import SnapshotReader, save_snapshot
+from file_system.spill import ContentSpill
+from file_system.watch import CREATE, MOVE, REMOVE, WRITE, Event, Watcher
+from file_system.utils import is_directory, is_file, parse_path, get_valid_name_before_adding_to_dir, iterate_subtree, \
+    glob_join, has_glob_magic, is_below, is_not_loaded
 from file_system.error import PathComponentNotFoundException, InvalidOperationException, InvalidPathComponentException
 
+"""
+    Public methods are marked with the part of the tree they read or change. When the file system is
+    created thread safe that part is locked for the call, see TreeLock in lock.py: readers of separate
+    nodes and writers of separate subtrees do not wait for each other. The keywords of _locking name
+    the arguments holding what the call works on:
+      read / write: the node at a path (and everything below it)
+      write_parent: the directory a path is created in, removed from or moved out of (the nearest
+        existing ancestor if the call has to create directories on the way)
+      read_node / write_node, read_inode / write_inode: a node given directly or by inode number
+    _reading and _writing lock the whole tree. State shared by the whole tree (name index, watches,
+    path cache, inode table, blob store, ...) guards itself with a lock of its own, held briefly
+"""
+def _locking(**targets: Union[str, Tuple[str, ...]]):
+    def decorator(method):
+        getters = [
+            (kind, _get_argument_getter(method, name))
+            for kind, names in targets.items()
+            for name in ((names,) if isinstance(names, str) else names)
+        ]
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._lock is None:
+                return method(self, *args, **kwargs)
+
+            acquired = self._acquire_locks([(kind, getter(args, kwargs)) for kind, getter in getters])
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if acquired:
+                    self._lock.release()
+
+        return wrapper
+
+    return decorator
+
+
+def _whole_tree_locking(mode: int):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._lock is None:
+                return method(self, *args, **kwargs)
+
+            with self._lock.locked({(): mode}):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+_reading = _whole_tree_locking(SHARED)
+_writing = _whole_tree_locking(EXCLUSIVE)
+
+
+# (args, kwargs) of a call -> the value of the named parameter (self not counted)
+def _get_argument_getter(method, name: str) -> Callable[[tuple, dict], Any]:
+    parameters = inspect.signature(method).parameters
+    default = parameters[name].default
+    index = list(parameters).index(name) - 1
+
+    def getter(args: tuple, kwargs: dict) -> Any:
+        if index < len(args):
+            return args[index]
+        return kwargs.get(name, default)
+
+    return getter
+
+
+"""
+    Public methods are measured when metrics are enabled, see metrics.py. This is the outermost
+    decorator, so time spent waiting for the lock counts. Disabled it costs one attribute check
+"""
+def _measured(method):
+    method_name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self._metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+
+        record = metrics.begin(method_name, args, kwargs)
+        try:
+            result = method(self, *args, **kwargs)
+        except BaseException as e:
+            metrics.end(record, e)
+            raise
+
+        metrics.end(record, None)
+        return result
+
+    return wrapper
+
+
+"""
+    Mutating public methods are recorded in the attached journal before they run.
+    Only the outermost call is recorded, calls made from inside another method (e.g. by batch)
+    are replayed by replaying that method
+"""
+def _journaled(method):
+    method_name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._journal is None or self._is_in_journaled_call():
+            return method(self, *args, **kwargs)
+
+        self._journal.append(method_name, args, kwargs)
+        self._journal_local.depth = 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._journal_local.depth = 0
+
+    return wrapper
+
+
 class FileSystem:
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        path_cache_size: int = constant.PATH_CACHE_SIZE,
+        thread_safe=False,
+        dedup_content=True,
+        metrics=False,
+        content_index=False,
+        memory_budget: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+        compression: Optional[str] = None,
+        compress_after: float = constant.COMPRESS_AFTER_SECONDS,
+        compress_interval: Optional[float] = None,
+    ) -> None:
         self._root: Directory = Directory('', None) # root dir has empty string as name
         self._current_dir: Directory = self._root
+
+        # see _locking. None unless thread safe
+        self._lock: Optional[TreeLock] = TreeLock() if thread_safe else None
+        # guards the name index and the watches, which writers of separate subtrees share
+        self._state_lock = threading.Lock() if thread_safe else nullcontext()
+
+        # resolved path -> node, see _get_file_object_from_path
+        self._path_cache: PathCache = PathCache(path_cache_size, thread_safe)
+        # (current directory, path cache generation, its path), see get_current_path
+        self._current_path: Optional[Tuple[Directory, int, str]] = None
+
+        # inode number -> node, for the *_inode calls
+        self._inodes: InodeTable = InodeTable(thread_safe)
+
+        # children of copied directories are made when first needed, see lazy_copy.py
+        self._copy_loader: CopyLoader = CopyLoader(self._on_copy_made, thread_safe)
+
+        # identical contents written with write or shared by copy are stored once
+        self._blob_store: Optional[BlobStore] = BlobStore(thread_safe) if dedup_content else None
+
+        # name -> every node in the tree carrying that name, so find does not need to walk the tree
+        self._name_index: Dict[str, Set[AbstractFile]] = {}
+        # false after loading a snapshot lazily, until the first find indexes the whole tree
+        self._name_index_complete: bool = True
+
+        # trigrams of file contents -> files, so grep only searches files that may match. None when disabled
+        self._content_index: Optional[ContentIndex] = \
+            ContentIndex(constant.CONTENT_INDEX_MAX_FILE_SIZE, thread_safe) if content_index else None
+        # false after loading a snapshot lazily, until the first grep indexes the whole tree
+        self._content_index_complete: bool = True
+
+        # least recently used contents beyond memory_budget bytes go to a spill file in spill_dir
+        # (the system's temporary directory by default), see spill.py. None without a budget
+        self._content_spill: Optional[ContentSpill] = \
+            ContentSpill(memory_budget, spill_dir, constant.SPILL_MIN_FILE_SIZE, self._blob_store) if memory_budget is not None else None
+
+        # contents not accessed for compress_after seconds are compressed ('zlib' or 'lzma') by
+        # compress_cold, see compression.py. None without compression
+        self._content_compressor: Optional[ContentCompressor] = \
+            ContentCompressor(compression, compress_after, constant.COMPRESS_MIN_FILE_SIZE) if compression is not None else None
+
+        # inverse of every change made so far, only kept while an atomic batch runs
+        self._undo_log: Optional[List[Callable[[], None]]] = None
+
+        # watched node -> its watchers, see watch
+        self._watches: Dict[AbstractFile, List[Watcher]] = {}
+        # events of an atomic batch, delivered when it succeeds and dropped when it is rolled back
+        self._held_events: Optional[List[Tuple[List[Watcher], Event]]] = None
+
+        # write ahead journal, see journal.py. The call depth is per thread, writers run side by side
+        self._journal = None
+        self._journal_local = threading.local()
+
+        # call counts, latencies and hooks, see metrics.py. None when disabled
+        self._metrics: Optional[Metrics] = Metrics() if metrics else None
+
+        # runs compress_cold every compress_interval seconds
+        self._background_compressor: Optional[BackgroundCompressor] = None
+        if compress_interval is not None:
+            if self._content_compressor is None or self._lock is None:
+                raise InvalidOperationException('Background compression needs compression and a thread safe file system')
+            self._background_compressor = BackgroundCompressor(self, compress_interval)
     
+    @_measured
+    @_writing
+    @_journaled
     def change_dir(self, path: str) -> None:
         maybe_dir = self._get_file_object_from_path(path)
         
         if not is_directory(maybe_dir):
             raise InvalidPathComponentException('Path does not point to a directory')
 
+        if self._undo_log is not None:
+            self._record_undo(lambda previous_dir=self._current_dir: setattr(self, '_current_dir', previous_dir))
+
         self._current_dir = maybe_dir
     
+    @_measured
+    @_locking(write_parent='path')
+    @_journaled
     def remove(self, path: str) -> None:
         file = self._get_file_object_from_path(path)
-        self._remove_file(file)
+        self._detach_file(file)
 
+    @_measured
+    @_locking(write_parent=('from_path', 'to_path'))
+    @_journaled
     def move(self, from_path: str, to_path: str) -> None:
         from_file = self._get_file_object_from_path(from_path)
-        to_pure_path, to_file_name = self._get_target_path_and_file_name_for_move(from_file, to_path)
+        to_pure_path, to_file_name = self._get_target_path_and_file_name_for_move(from_file.get_name(), to_path)
         
         to_parent_dir = self._get_file_object_from_path_and_auto_create_dir(to_pure_path)
         
         if not is_directory(to_parent_dir):
             raise InvalidPathComponentException('Move target is not directory')
+
+        # linking a directory below itself would make its parent chain a cycle
+        if to_parent_dir is from_file or is_below(to_parent_dir, from_file):
+            raise InvalidOperationException('Can not move a directory into itself')
         
-        self.remove(from_path)
-        from_file.set_name_in_file_metadata_only(to_file_name)
-        to_parent_dir.add_file(from_file)
+        # watchers of where the node was see the move too
+        from_path = self._get_absolute_path(from_file) if self._watches else None
+        from_watchers = self._get_watchers(from_file) if self._watches else []
+
+        self._remove_file(from_file)
+        self._unindex_file(from_file)
+        self._set_file_name_and_parent(from_file, to_file_name, to_parent_dir)
+
+        # descendants keep their names, so only the moved node needs to be re-indexed
+        self._attach_file(to_parent_dir, from_file, index_subtree=False)
+        self._notify(MOVE, from_file, from_path, from_watchers)
     
     """
         Support both single file and directory.
         Will auto rename if duplicate name is encountered
+
+        Copy on write covers nodes as well as contents: a copied directory is a single node whose
+        children are made from the source when they are first needed, a level at a time, and
+        changing, renaming or removing something in the source first makes the nodes of the copy on
+        the way to it (see lazy_copy.py). So copy is O(1) and the copy's memory follows what is read
+        or written in it afterwards. Copied files share the source's content until one side writes
     """
+    @_measured
+    @_locking(read='from_path', write_parent='to_path')
+    @_journaled
     def copy(self, from_path: str, to_path: str) -> None:
         source_file = self._get_file_object_from_path(from_path)
-        to_pure_path, to_file_name = self._get_target_path_and_file_name_for_move(source_file, to_path)
+        to_pure_path, to_file_name = self._get_target_path_and_file_name_for_move(source_file.get_name(), to_path)
            
         to_parent_dir = self._get_file_object_from_path_and_auto_create_dir(to_pure_path)
         
-        queue = [(source_file, to_parent_dir)]
-        is_top_level = True
-        while queue:
-            to_be_copied, target_parent_dir = queue.pop(0)
-
-            file_copy = self._copy_single_file(
-                to_be_copied, 
-                target_parent_dir, 
-                
-                # always use the source_file name unless this is the root file of the copy
-                to_file_name if is_top_level else to_be_copied.get_name(),
-            )
-            is_top_level = False
-                
-            if is_directory(to_be_copied):
-                children = to_be_copied.get_all_children()
-                for child in children:
-                    queue.append((child, file_copy))
+        if not is_directory(to_parent_dir):
+            raise InvalidPathComponentException('Copy target is not directory')
+
+        to_file_name = get_valid_name_before_adding_to_dir(to_file_name, to_parent_dir)
+        if is_file(source_file):
+            file_copy = self._copy_single_file(source_file, to_parent_dir, to_file_name)
+        else:
+            # pending before it is linked in, so copying a directory into itself makes the copy's
+            # nodes on the way to the target from the tree as it was before the copy
+            file_copy = self._copy_loader.make_copy(source_file, to_file_name, to_parent_dir)
+            if self._undo_log is not None:
+                self._record_undo(lambda: self._forget_subtree(file_copy))
+
+        self._count('nodes_visited', 1)
+        self._attach_file(to_parent_dir, file_copy)
+
+        if is_file(source_file):
+            self._touch_content(source_file)
+            self._touch_content(file_copy)
        
+    """
+        The subtree at path as nested lists, [name, content bytes] for a file and
+        [name, [child, ...]] for a directory. With import_tree it carries a subtree to another
+        file system, e.g. across shards
+    """
+    @_measured
+    @_locking(read='path')
+    def export_tree(self, path: str) -> list:
+        source_file = self._get_file_object_from_path(path)
+        tree = [source_file.get_name(), None]
+
+        stack = [(source_file, tree)]
+        visited = 0
+        while stack:
+            file, node = stack.pop()
+            visited += 1
+
+            if is_directory(file):
+                node[1] = []
+                for child in file.get_all_children():
+                    child_node = [child.get_name(), None]
+                    node[1].append(child_node)
+                    stack.append((child, child_node))
+            else:
+                # content that is not in memory (spilled or in a snapshot) is not kept there
+                node[1] = file.snapshot_content() if file.is_content_loaded() else file.peek_content()
+
+        self._count('nodes_visited', visited)
+        return tree
+
+    """
+        Creates an exported subtree at to_path, which is interpreted like the target of copy.
+        A name collision is resolved like copy does, or with rename=False the existing node
+        is replaced like move does
+    """
+    @_measured
+    @_locking(write_parent='to_path')
+    @_journaled
+    def import_tree(self, to_path: str, tree: list, rename=True) -> None:
+        to_pure_path, to_file_name = self._get_target_path_and_file_name_for_move(tree[0], to_path)
+
+        to_parent_dir = self._get_file_object_from_path_and_auto_create_dir(to_pure_path)
+
+        if not is_directory(to_parent_dir):
+            raise InvalidPathComponentException('Import target is not directory')
+
+        if rename:
+            to_file_name = get_valid_name_before_adding_to_dir(to_file_name, to_parent_dir)
+
+        # built detached and linked in at the end, like copy
+        top_level_file = self._make_node_from_tree(tree, to_file_name, to_parent_dir)
+        stack = [(tree, top_level_file)]
+        while stack:
+            node, file = stack.pop()
+            if is_directory(file):
+                for child_node in node[1]:
+                    child = self._make_node_from_tree(child_node, child_node[0], file)
+                    file.add_file(child)
+                    stack.append((child_node, child))
+
+        self._attach_file(to_parent_dir, top_level_file)
+
+        if self._content_spill is not None or self._content_compressor is not None:
+            for node in iterate_subtree(top_level_file):
+                if is_file(node):
+                    self._touch_content(node)
+
+    def _make_node_from_tree(self, node: list, name: str, parent_dir: Directory) -> AbstractFile:
+        if isinstance(node[1], list):
+            return Directory(name, parent_dir)
+
+        file = File(name, parent_dir)
+        if self._blob_store is None:
+            file.write(node[1])
+        else:
+            file.set_content_blob(self._blob_store.intern(to_bytes(node[1])))
+        return file
+
+    @_measured
+    @_locking(write_parent='path')
+    @_journaled
     def make_new_dir(self, path: str) -> None:
         self._get_file_object_from_path_and_auto_create_dir(path)
     
+    @_measured
+    @_locking(write_parent='path')
+    @_journaled
     def make_new_file(self, path: str) -> None:
         pure_path, file_name = parse_path(path)
+        # 'a/', '.' and '..' name a directory, not a new file
+        if file_name is None:
+            raise InvalidPathComponentException('Path does not name a file: ' + path)
         
         parent_dir = self._get_file_object_from_path_and_auto_create_dir(
             pure_path,
         )
 
-        new_dir = File(file_name, parent_dir)
-        parent_dir.add_file(new_dir)
+        new_file = File(file_name, parent_dir)
+        self._attach_file(parent_dir, new_file)
     
-    def ls(self) -> List[str]:
-        return [file.get_name() + ('/' if is_directory(file) else '') for file in self._current_dir.get_all_children()]
+    """
+        Names in the directory at path, with a trailing '/' for directories, in the order they were
+        created. Given start_after, limit or prefix the names come sorted instead, from the directory's
+        ordered name index: at most limit names starting with prefix, after start_after (the last name
+        of the previous page, '/' or not). A page costs O(log n + limit) whatever the directory size
+    """
+    @_measured
+    @_locking(read='path')
+    def ls(
+        self,
+        path: str = '.',
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        directory = self._current_dir if path == '.' else self._get_file_object_from_path(path)
+        return self._list_names(directory, start_after, limit, prefix)
+
+    def _list_names(
+        self,
+        directory: AbstractFile,
+        start_after: Optional[str],
+        limit: Optional[int],
+        prefix: Optional[str],
+    ) -> List[str]:
+        if not is_directory(directory):
+            raise InvalidPathComponentException(directory.get_name(), 'is not a directory')
+
+        if start_after is None and limit is None and prefix is None:
+            return [file.get_name() + ('/' if is_directory(file) else '') for file in directory.get_all_children()]
+
+        if limit is not None and limit <= 0:
+            return []
+
+        if start_after is not None:
+            start_after = start_after.rstrip('/')
+
+        result = []
+        for name in islice(directory.iterate_sorted_names(start_after, prefix or ''), limit):
+            result.append(name + ('/' if is_directory(directory.get_child(name)) else ''))
+
+        self._count('nodes_visited', len(result))
+        return result
     
+    """
+        Total content size in bytes of a file, or of everything below a directory.
+        Directories keep this as they change, so it is O(1) whatever the size of the tree
+    """
+    @_measured
+    @_locking(read='path')
+    def du(self, path: str = '.') -> int:
+        file = self._get_file_object_from_path(path)
+        return file.get_aggregates()[0] if is_directory(file) else file.get_size()
+
+    """
+        Like du, plus the number of files and directories below path (zero for a file)
+    """
+    @_measured
+    @_locking(read='path')
+    def stat(self, path: str = '.') -> Dict[str, Union[str, int]]:
+        return self._stat_file(self._get_file_object_from_path(path))
+
+    def _stat_file(self, file: AbstractFile) -> Dict[str, Union[str, int]]:
+        if is_directory(file):
+            total_size, file_count, dir_count = file.get_aggregates()
+            return {'type': 'directory', 'size': total_size, 'files': file_count, 'directories': dir_count}
+
+        return {'type': 'file', 'size': file.get_size(), 'files': 0, 'directories': 0}
+
+    """
+        Built by walking up from the current directory, then kept until the current directory
+        changes or a node is unlinked (which is what a move or remove of one of its ancestors does)
+    """
+    @_measured
     def get_current_path(self) -> str:
+        return self._get_path_of_current_dir(self._current_dir)
+
+    @_locking(read_node='current_dir')
+    def _get_path_of_current_dir(self, current_dir: Directory) -> str:
+        generation = self._path_cache.get_generation()
+        cached = self._current_path
+        if cached is not None and cached[0] is current_dir and cached[1] == generation:
+            return cached[2]
+
         path_list = []
-        cur_file = self._current_dir
+        cur_file = current_dir
         while cur_file._parent != cur_file:
             path_list.append(cur_file.get_name())
             cur_file = cur_file._parent
         
         path_list.reverse()
         
-        return '/' + '/'.join(path_list)
+        path = '/' + '/'.join(path_list)
+        self._current_path = (current_dir, generation, path)
+        return path
+
+    """
+        Inode number of the file or directory at path, see inode.py. The number names the node
+        in read_inode, write_inode, stat_inode and ls_inode, which find it with one dict lookup and
+        no path resolution; it stays valid across moves and renames until the node is removed
+    """
+    @_measured
+    @_locking(read='path')
+    def lookup(self, path: str) -> int:
+        return self._inodes.get_inode(self._get_file_object_from_path(path))
+
+    # like pread (the whole content by default), for the file with the given inode number
+    @_measured
+    @_locking(read_inode='inode')
+    def read_inode(self, inode: int, offset: int = 0, length: Optional[int] = None) -> bytes:
+        file = self._get_regular_file_from_inode(inode)
+        data = file.pread(offset, file.get_size() - offset if length is None else length)
+        self._touch_content(file)
+        self._count('bytes_read', len(data))
+        return data
+
+    """
+        Like write, for the file with the given inode number.
+        Recorded in the journal as a write to wherever the file currently is
+    """
+    @_measured
+    @_locking(write_inode='inode')
+    def write_inode(self, inode: int, content: Union[str, bytes], append=False) -> None:
+        file = self._get_regular_file_from_inode(inode)
+        content = to_bytes(content)
+
+        if self._journal is not None and not self._is_in_journaled_call():
+            path = self._get_absolute_path(file)
+            if path is not None:
+                self._journal.append('write', (path, content, append), {})
+
+        self._write_file(self._prepare_write(file), content, append)
 
-    def find(self, name: str) -> List[str]:
-        stack = [(None, self._current_dir)]
+    @_measured
+    @_locking(read_inode='inode')
+    def stat_inode(self, inode: int) -> Dict[str, Union[str, int]]:
+        return self._stat_file(self._inodes.get_node(inode))
+
+    @_measured
+    @_locking(read_inode='inode')
+    def ls_inode(
+        self,
+        inode: int,
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        return self._list_names(self._inodes.get_node(inode), start_after, limit, prefix)
+
+    """
+        Answered from the name index: every node with the given name is walked up to see
+        whether it lives under the directory at path (the current directory by default), so the
+        cost is O(matches x depth). Paths are written like grep does ('./a/b' below '.', '/x/a/b' below '/x').
+        With a limit the first limit paths in sorted order are returned, so a capped result is the
+        same whatever order the index holds the nodes in (the cost stays O(matches x depth))
+    """
+    @_measured
+    def find(self, name: str, limit: Optional[int] = None, path: str = '.') -> List[str]:
+        if not self._name_index_complete:
+            self._complete_name_index()
+
+        return self._find_in_name_index(name, limit, path)
+
+    @_locking(read='path')
+    def _find_in_name_index(self, name: str, limit: Optional[int], path: str) -> List[str]:
         result = []
-        
-        while stack:
-            this_path, this_dir = stack.pop()
-            
-            if this_dir.get_name() == name:
-                result.append(join_path(this_path, this_dir.get_name()))
-            
-            if is_directory(this_dir):
-                children = this_dir.get_all_children()
-                next_path = '.' if this_path is None else join_path(this_path, this_dir.get_name())
-                
-                for child in children:
-                    stack.append((next_path, child))
-        
+        if limit is not None and limit <= 0:
+            return result
+
+        directory = self._get_find_directory(path)
+        with self._state_lock:
+            candidates = list(self._name_index.get(name, ()))
+
+        with self._copy_loader.keeping_pending():
+            for file in candidates:
+                result.extend(self._get_paths_relative_to_dir(file, directory, path))
+
+        self._count('nodes_visited', len(candidates))
+        if limit is not None and limit < len(result):
+            return heapq.nsmallest(limit, result)
+
+        result.sort()
         return result
+
+    """
+        Generator of the same paths as find, in no particular order. The nodes with the name are taken
+        from the name index up front and checked a batch at a time, each batch under its own read lock,
+        so a long stream of results does not hold off writers. Nodes removed or renamed before their
+        batch is checked are skipped
+    """
+    def ifind(self, name: str, path: str = '.') -> Iterator[str]:
+        if not self._name_index_complete:
+            self._complete_name_index()
+
+        directory, candidates = self._get_find_candidates(name, path)
+        for idx in range(0, len(candidates), constant.FIND_BATCH_SIZE):
+            yield from self._check_find_candidates(name, candidates[idx:idx + constant.FIND_BATCH_SIZE], directory, path)
+
+    @_locking(read='path')
+    def _get_find_candidates(self, name: str, path: str) -> Tuple[Directory, List[AbstractFile]]:
+        directory = self._get_find_directory(path)
+        with self._state_lock:
+            return directory, list(self._name_index.get(name, ()))
+
+    @_locking(read_node='directory')
+    def _check_find_candidates(self, name: str, candidates: List[AbstractFile], directory: Directory, path: str) -> List[str]:
+        with self._state_lock:
+            indexed = self._name_index.get(name, ())
+            still_indexed = [file for file in candidates if file in indexed]
+
+        result = []
+        with self._copy_loader.keeping_pending():
+            for file in still_indexed:
+                result.extend(self._get_paths_relative_to_dir(file, directory, path))
+
+        self._count('nodes_visited', len(candidates))
+        return result
+
+    def _get_find_directory(self, path: str) -> Directory:
+        return self._current_dir if path == '.' else self._get_directory_from_path(path)
+
+    """
+        Sorted paths of the files at or below path whose content matches the regular expression,
+        written like find does ('./a/b' below '.'). With the content index enabled only the files
+        holding every trigram of the pattern's literal text are searched, so the cost follows the
+        number of candidates rather than the bytes stored. Patterns without such text (e.g. '\\d+'
+        or 'a|b') search every file below path
+    """
+    @_measured
+    def grep(self, pattern: str, path: str = '.', ignore_case=False) -> List[str]:
+        regex = re.compile(to_bytes(pattern), re.IGNORECASE if ignore_case else 0)
+
+        if self._content_index is not None:
+            if not self._content_index_complete:
+                self._complete_content_index()
+            if self._content_index.needs_refresh():
+                self._refresh_content_index()
+
+        return self._grep(regex, path)
+
+    @_locking(read='path')
+    def _grep(self, regex: re.Pattern, path: str) -> List[str]:
+        top_file = self._get_file_object_from_path(path)
+        if is_file(top_file):
+            self._count('nodes_visited', 1)
+            return [path] if regex.search(top_file.peek_content()) else []
+
+        result = []
+        visited = 0
+        # files of pending copies are searched in their sources
+        with self._copy_loader.keeping_pending():
+            trigrams = get_query_trigrams(regex) if self._content_index is not None else []
+            if trigrams:
+                candidates = self._content_index.lookup(trigrams)
+            else:
+                candidates = self._get_files_below(top_file)
+
+            for file in candidates:
+                visited += 1
+                file_paths = self._get_paths_relative_to_dir(file, top_file, path)
+                if file_paths and regex.search(file.peek_content()):
+                    result.extend(file_paths)
+
+        self._count('nodes_visited', visited)
+        result.sort()
+        return result
+
+    """
+        Generator like os.walk, yielding (dirpath, dirnames, filenames) for path and every directory
+        below it. Directories are listed one at a time when they are reached, so nothing is built for
+        the part of the tree that is not walked. With topdown, removing names from dirnames prunes them
+    """
+    def walk(self, path: str = '.', topdown: bool = True) -> Iterator[Tuple[str, List[str], List[str]]]:
+        top_dir = self._get_directory_from_path(path)
+
+        # entries are (directory, its path, listing or None if it is not listed yet)
+        stack = [(top_dir, path, None)]
+        while stack:
+            this_dir, this_path, listing = stack.pop()
+
+            if listing is None:
+                children = self._list_children(this_dir)
+                sub_dirs = {child.get_name(): child for child in children if is_directory(child)}
+                dir_names = list(sub_dirs)
+                file_names = [child.get_name() for child in children if not is_directory(child)]
+
+                if topdown:
+                    yield this_path, dir_names, file_names
+                else:
+                    stack.append((this_dir, this_path, (dir_names, file_names)))
+
+                for dir_name in reversed(dir_names):
+                    if dir_name in sub_dirs:
+                        stack.append((sub_dirs[dir_name], glob_join(this_path, dir_name), None))
+            else:
+                yield (this_path,) + listing
+
+    """
+        Generator of the paths matching a glob pattern, like glob.iglob with recursive=True.
+        '*' and '?' (and [...] sets) match within a name, '**' matches any number of directories.
+        Components without wildcards are looked up directly and only directories that can still
+        match are listed, so e.g. 'a/*/b' never looks below a/x/b. Relative patterns give paths
+        relative to the current directory
+    """
+    def iglob(self, pattern: str) -> Iterator[str]:
+        components = [comp for comp in pattern.split('/') if comp]
+        # '**/**' matches the same as '**'
+        components = [comp for idx, comp in enumerate(components) if comp != '**' or idx == 0 or components[idx - 1] != '**']
+
+        if pattern.startswith('/'):
+            start_dir, prefix = self._root, '/'
+        else:
+            start_dir, prefix = self._current_dir, ''
+
+        if not components:
+            if prefix:
+                yield prefix
+            return
+
+        matches = self._iglob_from(start_dir, prefix, components, 0)
+        if components.count('**') < 2:
+            yield from matches
+            return
+
+        # with several '**' one path can match in more than one way
+        seen = set()
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                yield match
+
+    def _iglob_from(self, this_dir: Directory, prefix: str, components: List[str], idx: int) -> Iterator[str]:
+        component = components[idx]
+        is_last = idx == len(components) - 1
+
+        if component == '**':
+            for sub_dir, sub_path in self._iterate_dirs(this_dir, prefix):
+                if is_last:
+                    if sub_dir is not this_dir:
+                        yield sub_path
+                    for child in self._list_children(sub_dir):
+                        if not is_directory(child):
+                            yield glob_join(sub_path, child.get_name())
+                else:
+                    yield from self._iglob_from(sub_dir, sub_path, components, idx + 1)
+            return
+
+        if has_glob_magic(component):
+            match = re.compile(fnmatch.translate(component)).match
+            children = (child for child in self._list_children(this_dir) if match(child.get_name()))
+        else:
+            child = self._lookup_child(this_dir, component)
+            children = [] if child is None else [child]
+
+        for child in children:
+            child_path = glob_join(prefix, component if component in ('.', '..') else child.get_name())
+            if is_last:
+                yield child_path
+            elif is_directory(child):
+                yield from self._iglob_from(child, child_path, components, idx + 1)
+
+    # this_dir and every directory below it with their paths, depth first
+    def _iterate_dirs(self, this_dir: Directory, prefix: str) -> Iterator[Tuple[Directory, str]]:
+        stack = [(this_dir, prefix)]
+        while stack:
+            sub_dir, sub_path = stack.pop()
+            yield sub_dir, sub_path
+
+            sub_dirs = [child for child in self._list_children(sub_dir) if is_directory(child)]
+            for child in reversed(sub_dirs):
+                stack.append((child, glob_join(sub_path, child.get_name())))
+
+    @_locking(read_node='directory')
+    def _list_children(self, directory: Directory) -> List[AbstractFile]:
+        children = directory.get_all_children()
+        self._count('nodes_visited', len(children))
+        return children
+
+    @_locking(read_node='directory')
+    def _lookup_child(self, directory: Directory, name: str) -> Optional[AbstractFile]:
+        if name == '.':
+            return directory
+        if name == '..':
+            return directory.get_parent()
+
+        return directory.get_child(name) if directory.has_child(name) else None
         
-    def write(self, path: str, content: str, append=False) -> None:
+    @_measured
+    @_locking(write='path')
+    @_journaled
+    def write(self, path: str, content: Union[str, bytes], append=False) -> None:
+        self._write_file(self._get_writable_file_from_path(path), to_bytes(content), append)
+
+    def _write_file(self, file: File, content: bytes, append: bool) -> None:
+        self._count('bytes_written', len(content))
+
+        with self._changing_content(file):
+            if append or self._blob_store is None:
+                file.write(content, append)
+            else:
+                file.set_content_blob(self._blob_store.intern(content))
+            self._touch_content(file)
+        self._notify(WRITE, file)
+
+    @_measured
+    @_locking(read='path')
+    def cat(self, path: str) -> str:
+        file = self._get_regular_file_from_path(path)
+        self._count('bytes_read', file.get_size())
+        content = file.read()
+        self._touch_content(file)
+        return content
+
+    @_measured
+    @_locking(read='path')
+    def pread(self, path: str, offset: int, length: int) -> bytes:
+        file = self._get_regular_file_from_path(path)
+        data = file.pread(offset, length)
+        self._touch_content(file)
+        self._count('bytes_read', len(data))
+        return data
+
+    @_measured
+    @_locking(write='path')
+    @_journaled
+    def pwrite(self, path: str, offset: int, data: Union[str, bytes]) -> None:
+        data = to_bytes(data)
+        file = self._get_writable_file_from_path(path)
+        with self._changing_content(file):
+            file.pwrite(offset, data)
+            self._touch_content(file)
+        self._notify(WRITE, file)
+        self._count('bytes_written', len(data))
+
+    @_measured
+    @_locking(write='path')
+    @_journaled
+    def truncate(self, path: str, size: int) -> None:
+        file = self._get_writable_file_from_path(path)
+        with self._changing_content(file):
+            file.truncate(size)
+            self._touch_content(file)
+        self._notify(WRITE, file)
+
+    """
+        Opens a file handle, see file_handle.py. Modes are 'r', 'r+', 'w', 'w+', 'a' and 'a+';
+        'w' and 'a' create the file if needed and 'w' truncates it. Only those take the write lock
+    """
+    @_measured
+    def open(self, path: str, mode: str = 'r') -> FileHandle:
+        if mode not in OPEN_MODES:
+            raise InvalidOperationException('Invalid mode ' + str(mode))
+
+        if mode[0] in ('w', 'a'):
+            return self._create_and_open(path, mode)
+
+        return self._open_existing(path, mode)
+
+    @_locking(read='path')
+    def _open_existing(self, path: str, mode: str) -> FileHandle:
+        return FileHandle(self, self._get_regular_file_from_path(path), mode)
+
+    @_locking(write_parent='path')
+    def _create_and_open(self, path: str, mode: str) -> FileHandle:
+        try:
+            self._get_regular_file_from_path(path)
+        except PathComponentNotFoundException:
+            self.make_new_file(path)
+
+        if mode[0] == 'w':
+            self.truncate(path, 0)
+
+        return FileHandle(self, self._get_regular_file_from_path(path), mode)
+
+    """
+        Watches the file or directory at path for creates, writes, moves and removes of it and of
+        everything below it (only its direct children unless recursive), see watch.py. The watch
+        follows the node when it is moved. A copied or imported directory is one create event.
+        Events of an atomic batch are delivered when it succeeds, none when it is rolled back.
+        Mutations cost nothing extra while nothing is watched
+    """
+    @_measured
+    @_locking(read='path')
+    def watch(self, path: str = '.', recursive=True, max_events: int = constant.WATCH_QUEUE_SIZE) -> Watcher:
+        if max_events <= 0:
+            raise InvalidOperationException('max_events has to be positive')
+
+        node = self._get_file_object_from_path(path)
+        watcher = Watcher(self, node, recursive, max_events)
+        with self._state_lock:
+            self._watches.setdefault(node, []).append(watcher)
+        return watcher
+
+    """
+        Runs a list of operations, each a tuple of a FileSystem method name followed by its arguments,
+        e.g. ('write', '/a/b', 'content'). Returns one BatchResult per operation.
+        A failing operation does not stop the batch unless atomic is set, in which case every change
+        made by the batch is rolled back and the remaining operations are skipped.
+        Operations sharing a parent directory resolve it once, through the path cache
+    """
+    @_measured
+    @_writing
+    @_journaled
+    def batch(self, operations: List[tuple], atomic=False) -> List[BatchResult]:
+        if self._undo_log is not None:
+            raise InvalidOperationException('Batches can not be nested')
+
+        results = []
+        if atomic:
+            self._undo_log = []
+            self._held_events = []
+
+        try:
+            for operation in operations:
+                try:
+                    if not operation or operation[0] not in BATCH_OPERATIONS:
+                        raise InvalidOperationException('Unsupported batch operation: ' + str(operation))
+
+                    results.append(BatchResult(getattr(self, operation[0])(*operation[1:])))
+                except Exception as e:
+                    results.append(BatchResult(error=e))
+
+                    if atomic:
+                        self._rollback()
+                        results.extend(BatchResult(executed=False) for _ in range(len(results), len(operations)))
+                        break
+        finally:
+            self._undo_log = None
+            held_events, self._held_events = self._held_events, None
+            for watchers, event in held_events or ():
+                self._deliver(watchers, event)
+
+        return results
+
+    """
+        Writes the whole tree to a binary snapshot file on the host file system, see snapshot.py
+    """
+    @_measured
+    @_reading
+    def save(self, snapshot_path: str, fsync=False) -> None:
+        save_snapshot(self._root, snapshot_path, fsync)
+
+    """
+        Returns a file system backed by a snapshot written by save. The snapshot is memory mapped and
+        nodes are only created when first accessed, so loading costs the same whatever its size
+    """
+    @classmethod
+    def load(cls, snapshot_path: str, **kwargs) -> 'FileSystem':
+        fs = cls(**kwargs)
+        fs._root = SnapshotReader(snapshot_path).make_root()
+        fs._current_dir = fs._root
+        fs._name_index_complete = False
+        fs._content_index_complete = False
+
+        return fs
+
+    def attach_journal(self, journal) -> None:
+        self._journal = journal
+
+    def _is_in_journaled_call(self) -> bool:
+        return getattr(self._journal_local, 'depth', 0) > 0
+
+    """
+        Snapshots the tree into the attached journal so older journal segments can be dropped
+    """
+    @_measured
+    @_writing
+    def checkpoint(self) -> None:
+        if self._journal is None:
+            raise InvalidOperationException('No journal attached')
+
+        self._journal.checkpoint(self)
+
+    def is_thread_safe(self) -> bool:
+        return self._lock is not None
+
+    def get_path_cache_stats(self) -> Dict[str, int]:
+        return self._path_cache.get_stats()
+
+    # None when metrics are disabled, see Metrics.get_stats
+    def get_metrics(self) -> Optional[Dict[str, Any]]:
+        return None if self._metrics is None else self._metrics.get_stats()
+
+    def reset_metrics(self) -> None:
+        if self._metrics is not None:
+            self._metrics.reset()
+
+    # enables metrics if they are not yet
+    def add_hook(self, hook: Hook) -> None:
+        if self._metrics is None:
+            self._metrics = Metrics()
+
+        self._metrics.add_hook(hook)
+
+    def remove_hook(self, hook: Hook) -> None:
+        if self._metrics is not None:
+            self._metrics.remove_hook(hook)
+
+    @_reading
+    def get_content_index_stats(self) -> Dict[str, int]:
+        if self._content_index is None:
+            return {}
+
+        return self._content_index.get_stats()
+
+    # memory budget and spill statistics, see spill.py
+    def get_spill_stats(self) -> Dict[str, int]:
+        if self._content_spill is None:
+            return {}
+
+        return self._content_spill.get_stats()
+
+    """
+        Compresses the contents nobody read or wrote for compress_after seconds and returns how
+        many files were compressed. Runs by itself when the file system was created with
+        compress_interval, otherwise it is up to the caller
+    """
+    @_measured
+    def compress_cold(self) -> int:
+        if self._content_compressor is None:
+            raise InvalidOperationException('Compression is not enabled')
+
+        cold_files = self._content_compressor.pop_cold_files()
+        shared_contents = {}
+        compressed = 0
+        for idx in range(0, len(cold_files), constant.COMPRESS_BATCH_SIZE):
+            compressed += self._compress_files(cold_files[idx:idx + constant.COMPRESS_BATCH_SIZE], shared_contents)
+
+        return compressed
+
+    # compression ratio of the compressed contents and the latency decompressing them adds
+    def get_compression_stats(self) -> Dict[str, Union[str, int, float]]:
+        if self._content_compressor is None:
+            return {}
+
+        return self._content_compressor.get_stats()
+
+    def get_blob_store_stats(self) -> Dict[str, Union[int, float]]:
+        if self._blob_store is None:
+            return {}
+
+        return self._blob_store.get_stats()
+ 
+    # reads through a file handle. The view is not a copy, a later write copies instead if it is still alive
+    @_locking(read_node='file')
+    def _read_file_view(self, file: File) -> memoryview:
+        view = file.get_content_view()
+        self._touch_content(file)
+        return view
+
+    """
+        Writes through a file handle, at offset or with append at the end of the file as it is under the
+        write lock, so concurrent appends never land on the same offset. Returns the offset written at.
+        There is no path involved, so for the journal the write is recorded as a pwrite to wherever
+        the file currently is (nothing if it is no longer in the tree)
+    """
+    @_locking(write_node='file')
+    def _write_file_at(self, file: File, offset: int, data: Union[str, bytes], append=False) -> int:
+        data = to_bytes(data)
+        if append:
+            offset = file.get_size()
+
+        if self._journal is not None and not self._is_in_journaled_call():
+            path = self._get_absolute_path(file)
+            if path is not None:
+                self._journal.append('pwrite', (path, offset, data), {})
+
+        with self._changing_content(file):
+            file.pwrite(offset, data)
+            self._touch_content(file)
+        self._mark_content_changed(file)
+        self._notify(WRITE, file)
+        self._count('bytes_written', len(data))
+        return offset
+
+    def _unwatch(self, watcher: Watcher) -> None:
+        with self._state_lock:
+            watchers = self._watches.get(watcher.node, [])
+            if watcher in watchers:
+                watchers.remove(watcher)
+            if not watchers:
+                self._watches.pop(watcher.node, None)
+
+    # watchers of file itself, of its parent and, recursive ones, of every other ancestor
+    def _get_watchers(self, file: AbstractFile) -> List[Watcher]:
+        watchers = list(self._watches.get(file, ()))
+
+        depth = 1
+        cur_file = file
+        while cur_file.get_parent() is not cur_file:
+            cur_file = cur_file.get_parent()
+            for watcher in self._watches.get(cur_file, ()):
+                if depth == 1 or watcher.recursive:
+                    watchers.append(watcher)
+            depth += 1
+
+        return watchers
+
+    # extra_watchers see the event as well, e.g. the ones of where a moved node came from
+    def _notify(
+        self,
+        kind: str,
+        file: AbstractFile,
+        old_path: Optional[str] = None,
+        extra_watchers: Optional[List[Watcher]] = None,
+    ) -> None:
+        if not self._watches:
+            return
+
+        watchers = self._get_watchers(file)
+        if extra_watchers:
+            watchers = list(dict.fromkeys(extra_watchers + watchers))
+        if watchers:
+            self._deliver(watchers, Event(kind, self._get_absolute_path(file), old_path, is_directory(file)))
+
+    # the removed node and its subtree are still linked. Watchers of nodes in the subtree see the remove too
+    def _notify_removed(self, file: AbstractFile) -> None:
+        watchers = self._get_watchers(file)
+        if is_directory(file):
+            with self._state_lock:
+                watched = list(self._watches.items())
+            for node, node_watchers in watched:
+                if is_below(node, file):
+                    watchers.extend(node_watchers)
+
+        if watchers:
+            self._deliver(list(dict.fromkeys(watchers)), Event(REMOVE, self._get_absolute_path(file), None, is_directory(file)))
+
+    def _deliver(self, watchers: List[Watcher], event: Event) -> None:
+        if self._held_events is not None:
+            self._held_events.append((watchers, event))
+            return
+
+        for watcher in watchers:
+            watcher.add(event)
+
+    # around a change of file's content: copies still reading it get their nodes first (see lazy_copy.py),
+    # and it is pinned, see ContentSpill.pinned. Only other threads could spill it meanwhile
+    def _changing_content(self, file: File) -> ContextManager[None]:
+        self._copy_loader.materialize(file)
+        if self._content_spill is None or self._lock is None:
+            return nullcontext()
+
+        return self._content_spill.pinned(file)
+
+    # file's content was read or written, for the memory budget and compression
+    def _touch_content(self, file: File) -> None:
+        if self._content_spill is not None:
+            self._content_spill.touch(file)
+        if self._content_compressor is not None:
+            self._content_compressor.touch(file)
+
+    @_writing
+    def _compress_files(self, files: List[File], shared_contents: Dict[int, tuple]) -> int:
+        compressed = 0
+        for file in files:
+            # skipped if it was accessed since it was found cold
+            if not self._content_compressor.is_hot(file) and self._content_compressor.compress_file(file, shared_contents):
+                compressed += 1
+
+        return compressed
+
+    def _count(self, counter: str, value: int) -> None:
+        if self._metrics is not None:
+            self._metrics.add(counter, value)
+
+    # None if file is not linked into the tree (any more)
+    def _get_absolute_path(self, file: AbstractFile) -> Optional[str]:
+        path = self._get_path_components(file)
+        return None if path is None else '/' + '/'.join(path)
+
+    """
+        Like _get_absolute_path, as components. Also used before the node is locked: a node that is
+        being moved is seen either where it was, where it goes or nowhere, never at a mix of both
+    """
+    def _get_path_components(self, file: AbstractFile) -> Optional[LockPath]:
+        path_list = []
+        cur_file = file
+        while cur_file is not self._root:
+            parent_dir = cur_file.get_parent()
+            # a node in a directory was created by loading it, so children is complete
+            if parent_dir is cur_file or parent_dir.children.get(cur_file.get_name()) is not cur_file:
+                return None
+
+            path_list.append(cur_file.get_name())
+            cur_file = parent_dir
+
+        path_list.reverse()
+        return tuple(path_list)
+
+    """
+        Takes the locks for the targets of a call, see _locking. Returns False if the locks the thread
+        holds already cover them. Paths are locked as they read (relative ones against the current
+        directory), nodes at the path they have. Both can change until the locks are held (a node
+        moved, the current directory changed), so the targets are worked out again if a node was
+        unlinked or the current directory changed meanwhile, and locked again if they differ
+    """
+    def _acquire_locks(self, targets: List[Tuple[str, Any]]) -> bool:
+        while True:
+            generation = self._path_cache.get_generation()
+            current_dir = self._current_dir
+            plan = self._get_lock_plan(targets)
+            if not self._lock.acquire(plan):
+                return False
+
+            if generation == self._path_cache.get_generation() and current_dir is self._current_dir:
+                return True
+
+            try:
+                if self._get_lock_plan(targets) == plan:
+                    return True
+            except BaseException:
+                self._lock.release()
+                raise
+
+            self._lock.release()
+
+    # lock path -> mode for the (kind, argument value) targets of a call
+    def _get_lock_plan(self, targets: List[Tuple[str, Any]]) -> Dict[LockPath, int]:
+        plan = {}
+        for kind, value in targets:
+            if kind in ('read_inode', 'write_inode'):
+                value = self._inodes.get_node(value)
+
+            if kind in ('read', 'write', 'write_parent'):
+                path, shared_depth = self._get_lock_path(value)
+                if kind == 'write_parent':
+                    path = path[:self._get_existing_depth(path, min(shared_depth, len(path) - 1))]
+                else:
+                    path = path[:shared_depth]
+            else:
+                # a node outside the tree is only covered by locking the whole tree
+                path = self._get_path_components(value) or ()
+
+            add_lock_target(plan, path, SHARED if kind.startswith('read') else EXCLUSIVE)
+
+        return plan
+
+    """
+        path as the components of the absolute path, '.' and '..' resolved lexically, and how many of
+        them every directory passed while resolving it has in common: all unless '..' goes up first.
+        Relative to a current directory that is no longer in the tree, only the root is known
+    """
+    def _get_lock_path(self, path: Any) -> Tuple[LockPath, int]:
+        if not isinstance(path, str):
+            return (), 0
+
+        if path.startswith('/'):
+            components = []
+        else:
+            current_path = self._get_path_components(self._current_dir)
+            if current_path is None:
+                return (), 0
+            components = list(current_path)
+
+        shared_depth = None
+        for comp in path.split('/'):
+            if comp == '..':
+                if components:
+                    components.pop()
+                shared_depth = len(components) if shared_depth is None else min(shared_depth, len(components))
+            elif comp and comp != '.':
+                components.append(comp)
+
+        return tuple(components), len(components) if shared_depth is None else shared_depth
+
+    # how many of the first depth components of path are existing directories, missing ones are created below them
+    def _get_existing_depth(self, path: LockPath, depth: int) -> int:
+        directory = self._root
+        for idx in range(max(depth, 0)):
+            child = directory.children.get(path[idx]) if directory.has_child(path[idx]) else None
+            if child is None:
+                return idx
+            if not is_directory(child):
+                return idx + 1
+            directory = child
+
+        return max(depth, 0)
+
+    def _get_regular_file_from_path(self, path: str) -> File:
         file = self._get_file_object_from_path(path)
-        
+
         if not is_file(file):
             raise InvalidPathComponentException('Invalid File')
-        
-        file.write(content, append)
 
+        return file
+
+    @_locking(read='path')
+    def _get_directory_from_path(self, path: str) -> Directory:
+        directory = self._get_file_object_from_path(path)
+
+        if not is_directory(directory):
+            raise InvalidPathComponentException(directory.get_name(), 'is not a directory')
+
+        return directory
+
+    def _get_regular_file_from_inode(self, inode: int) -> File:
+        file = self._inodes.get_node(inode)
 
-    def cat(self, path: str) -> str:
-        file = self._get_file_object_from_path(path)
-        
         if not is_file(file):
             raise InvalidPathComponentException('Invalid File')
-        
-        return file.read()
- 
+
+        return file
+
+    def _get_writable_file_from_path(self, path: str) -> File:
+        return self._prepare_write(self._get_regular_file_from_path(path))
+
+    # file is about to be changed: its content can be restored by a rollback and has to be indexed again
+    def _prepare_write(self, file: File) -> File:
+        if self._undo_log is not None:
+            blob = file.get_content_blob()
+            if blob is not None:
+                self._record_undo(lambda: self._reacquire_content_blob(file, blob))
+            else:
+                self._record_undo(lambda content=file.snapshot_content(): file.restore_content(content))
+
+        self._mark_content_changed(file)
+        return file
+
+    # the content index picks the change up at the next grep, also when a rollback undoes it
+    def _mark_content_changed(self, file: File) -> None:
+        if self._content_index is None:
+            return
+
+        self._content_index.mark_dirty(file)
+        if self._undo_log is not None:
+            self._record_undo(lambda: self._content_index.mark_dirty(file))
+
     def _get_file_object_from_path_and_auto_create_dir(self, path: str) -> AbstractFile:
         return self._get_file_object_from_path(
             path, 
@@ -136,11 +1351,37 @@ class FileSystem:
     """
         Given a path, returns the file that path represents. Works for both directories and actual files
         auto_create_dir: automatically create directories if not exist
+
+        Successful lookups are remembered in the path cache. Absolute paths are keyed by the path
+        itself and relative ones by (starting directory, path), since a relative path resolves the same
+        way from a given directory wherever that directory currently sits in the tree
     """
-    def _get_file_object_from_path(self, path: str, auto_create_dir=False) -> AbstractFile:
+    def _get_file_object_from_path(self, path: str, auto_create_dir=False, resolve_parent_through_cache=True) -> AbstractFile:
         if not path:
             raise InvalidPathComponentException('Invalid path')
 
+        if self._metrics is not None and resolve_parent_through_cache:
+            self._count('path_components', sum(1 for comp in path.split('/') if comp))
+
+        cache_key = path if path[0] == '/' else (self._current_dir, path)
+        cached_file = self._path_cache.get(cache_key)
+        if cached_file is not None:
+            return cached_file
+
+        # 'prefix/name': the parent is looked up in the cache too (one level only, so there is no
+        # recursion on deep paths), which lets siblings share the resolution of their directory
+        parent_path, separator, name = path.rpartition('/')
+        if resolve_parent_through_cache and separator and parent_path and name and name not in constant.RESERVED_FILE_NAMES:
+            parent_dir = self._get_file_object_from_path(parent_path, auto_create_dir, False)
+            file = self._resolve_child(parent_dir, name, auto_create_dir)
+        else:
+            file = self._resolve_path(path, auto_create_dir)
+
+        self._path_cache.put(cache_key, file)
+
+        return file
+
+    def _resolve_path(self, path: str, auto_create_dir: bool) -> AbstractFile:
         path_components = path.split('/')
         current_dir = self._current_dir
 
@@ -165,13 +1406,7 @@ class FileSystem:
             elif not comp: # skip empty entries. we allow /a////b/
                 continue
             
-            if not current_dir.has_child(comp):
-                if auto_create_dir:
-                    current_dir.add_file(Directory(comp, current_dir))
-                else:
-                    raise PathComponentNotFoundException(comp + 'not found in ' + current_dir.get_name())
-
-            child = current_dir.get_child(comp)
+            child = self._resolve_child(current_dir, comp, auto_create_dir)
 
             # only last component in the chain is allowed to be a file
             if idx != len(path_components) - 1 and is_file(child):
@@ -179,42 +1414,344 @@ class FileSystem:
             
             current_dir = child
         return current_dir
+
+    def _resolve_child(self, current_dir: AbstractFile, name: str, auto_create_dir: bool) -> AbstractFile:
+        if self._metrics is not None:
+            self._metrics.add('component_lookups', 1)
+
+        if not is_directory(current_dir):
+            raise InvalidPathComponentException(current_dir.get_name(), 'is not a directory')
+
+        if not current_dir.has_child(name):
+            if auto_create_dir:
+                self._attach_file(current_dir, Directory(name, current_dir))
+            else:
+                raise PathComponentNotFoundException(name + 'not found in ' + current_dir.get_name())
+
+        return current_dir.get_child(name)
      
-    def _copy_single_file(self, source_file: File, target_dir: Directory, to_file_name: str) -> Directory:
-        maybe_new_file_name = get_valid_name_before_adding_to_dir(to_file_name, target_dir)
-        
+    """
+        Returns an unlinked copy of source_file (without children) whose parent is target_dir
+    """
+    def _copy_single_file(self, source_file: AbstractFile, target_dir: Directory, to_file_name: str) -> AbstractFile:
         if is_file(source_file):
-            copied_file = File(maybe_new_file_name, target_dir)
-            copied_file.write(source_file.read())
+            copied_file = File(to_file_name, target_dir)
+            self._share_content(source_file, copied_file)
         else:
-            copied_file = Directory(maybe_new_file_name, target_dir)
+            copied_file = Directory(to_file_name, target_dir)
 
-        target_dir.add_file(copied_file)
-        
         return copied_file
     
+    """
+        Hook of the copy loader for a node it made from source_file, before it is linked in. Making
+        nodes of a copy is not a change to the tree, a rolled back batch keeps them
+    """
+    def _on_copy_made(self, source_file: AbstractFile, file: AbstractFile) -> None:
+        undo_log = self._undo_log
+        self._undo_log = None
+        try:
+            if is_file(file):
+                self._share_content(source_file, file)
+                self._index_subtree(file)
+            else:
+                # a pending copy, nothing below it is indexed yet
+                self._index_file(file)
+        finally:
+            self._undo_log = undo_log
+
+        # sharing loads the source's content (e.g. back from the spill file) and the copy holds it too
+        if is_file(file):
+            self._touch_content(source_file)
+            self._touch_content(file)
+
+    def _share_content(self, source_file: File, target_file: File) -> None:
+        if self._blob_store is None:
+            target_file.share_content_with(source_file)
+            return
+
+        blob = source_file.get_content_blob()
+        if blob is None:
+            blob = self._blob_store.intern(source_file.snapshot_content())
+            source_file.set_content_blob(blob)
+            if self._undo_log is not None:
+                self._record_undo(source_file.release_content_blob)
+
+        blob.acquire()
+        target_file.set_content_blob(blob)
+        if self._undo_log is not None:
+            self._record_undo(target_file.release_content_blob)
+
     def _remove_file(self, file: File) -> None:
         if is_directory(file) and file.is_root():
             raise InvalidOperationException('You can not remove root directory')
 
-        file.get_parent().remove_file(file)
+        parent_dir = file.get_parent()
+        self._copy_loader.materialize(parent_dir)
+        parent_dir.remove_file(file)
+
+        # paths through the unlinked node may now resolve differently
+        self._path_cache.invalidate()
+
+        if self._undo_log is not None:
+            self._record_undo(lambda: self._relink_file(parent_dir, file))
+
+    """
+        Single entry point for linking a node under a directory so the name index stays in sync.
+        A node already in the directory under the same name is replaced and dropped from the index
+    """
+    def _attach_file(self, parent_dir: Directory, file: AbstractFile, index_subtree=True) -> None:
+        self._copy_loader.materialize(parent_dir)
+        replaced_file = None
+        if parent_dir.has_child(file.get_name()):
+            replaced_file = parent_dir.get_child(file.get_name())
+            if replaced_file is not file:
+                self._forget_subtree(replaced_file)
+                self._path_cache.invalidate()
+
+        parent_dir.add_file(file)
+
+        if self._undo_log is not None:
+            self._record_undo(lambda: self._unlink_attached_file(parent_dir, file, replaced_file))
+
+        # a node moved here is reported by move
+        if index_subtree:
+            self._index_subtree(file)
+            self._notify(CREATE, file)
+        else:
+            self._index_file(file)
+
+    def _detach_file(self, file: AbstractFile) -> None:
+        if self._watches:
+            self._notify_removed(file)
+
+        self._remove_file(file)
+        self._forget_subtree(file)
+
+    """
+        For nodes leaving the tree: drop them from the indexes and give back their blob references.
+        Copies still reading a directory that leaves get their nodes first; copies that leave stop
+        reading, the nodes they never made were not indexed
+    """
+    def _forget_subtree(self, file: AbstractFile) -> None:
+        for node in iterate_subtree(file, is_not_loaded):
+            self._unindex_file(node)
+
+            if is_directory(node):
+                self._copy_loader.materialize_copies_of(node)
+                source = self._copy_loader.remove_copy(node)
+                if source is not None and self._undo_log is not None:
+                    self._record_undo(lambda node=node, source=source: self._copy_loader.add_copy(node, source))
+
+            if self._content_index is not None and is_file(node):
+                self._content_index.discard(node)
+                if self._undo_log is not None:
+                    self._record_undo(lambda node=node: self._content_index.add(node))
+
+            if self._content_spill is not None and is_file(node):
+                self._content_spill.forget(node)
+            if self._content_compressor is not None and is_file(node):
+                self._content_compressor.forget(node)
+
+            if node.get_inode():
+                self._inodes.discard(node)
+                if self._undo_log is not None:
+                    self._record_undo(lambda node=node: self._inodes.restore(node))
+
+            blob = node.get_content_blob() if is_file(node) else None
+            if blob is not None:
+                node.release_content_blob()
+                if self._undo_log is not None:
+                    self._record_undo(lambda node=node, blob=blob: self._reacquire_content_blob(node, blob))
+
+    def _set_file_name_and_parent(self, file: AbstractFile, name: str, parent_dir: Directory) -> None:
+        if self._undo_log is not None:
+            self._record_undo(
+                lambda previous_name=file.get_name(), previous_parent=file.get_parent():
+                    self._set_file_name_and_parent(file, previous_name, previous_parent)
+            )
+
+        file.set_name_in_file_metadata_only(name)
+        file.set_parent(parent_dir)
+
+    def _index_file(self, file: AbstractFile) -> None:
+        with self._state_lock:
+            self._name_index.setdefault(file.get_name(), set()).add(file)
+
+        if self._undo_log is not None:
+            self._record_undo(lambda: self._unindex_file(file))
+
+    def _unindex_file(self, file: AbstractFile) -> None:
+        with self._state_lock:
+            files = self._name_index.get(file.get_name())
+            if files is None or file not in files:
+                return
+
+            files.discard(file)
+            if not files:
+                del self._name_index[file.get_name()]
+
+        if self._undo_log is not None:
+            self._record_undo(lambda: self._index_file(file))
+
+    # loads every node that is still in the snapshot, pending copies stay pending (find sees into them
+    # through their sources). Nodes indexed before are simply added again.
+    # Not undoable on purpose: the index only describes the tree, a rolled back batch keeps it valid
+    @_writing
+    def _complete_name_index(self) -> None:
+        if self._name_index_complete:
+            return
+
+        indexed = 0
+        for child in self._root.get_all_children():
+            for node in iterate_subtree(child, self._copy_loader.is_pending):
+                self._name_index.setdefault(node.get_name(), set()).add(node)
+                indexed += 1
+        self._name_index_complete = True
+        self._count('nodes_visited', indexed)
+
+    # like _complete_name_index, for the content index
+    @_writing
+    def _complete_content_index(self) -> None:
+        if self._content_index_complete:
+            return
+
+        for node in iterate_subtree(self._root, self._copy_loader.is_pending):
+            if is_file(node):
+                self._content_index.add(node)
+        self._content_index_complete = True
+
+    @_writing
+    def _refresh_content_index(self) -> None:
+        self._content_index.refresh()
+
+    def _record_undo(self, undo: Callable[[], None]) -> None:
+        self._undo_log.append(undo)
+
+    # undo of _remove_file
+    def _relink_file(self, parent_dir: Directory, file: AbstractFile) -> None:
+        parent_dir.add_file(file)
+        self._path_cache.invalidate()
+
+    # undo of _attach_file
+    def _unlink_attached_file(self, parent_dir: Directory, file: AbstractFile, replaced_file: Optional[AbstractFile]) -> None:
+        parent_dir.remove_file(file)
+        if replaced_file is not None:
+            parent_dir.add_file(replaced_file)
+        self._path_cache.invalidate()
+
+    # undo of giving back a blob reference in _forget_subtree or when the content was changed
+    def _reacquire_content_blob(self, file: File, blob) -> None:
+        blob.acquire()
+        file.set_content_blob(blob)
+
+    def _rollback(self) -> None:
+        undo_log = self._undo_log
+        self._undo_log = None
+        self._held_events = []
+
+        for undo in reversed(undo_log):
+            undo()
+
+    def _index_subtree(self, file: AbstractFile) -> None:
+        for node in iterate_subtree(file, is_not_loaded):
+            self._index_file(node)
+
+            if self._content_index is not None and is_file(node):
+                self._content_index.add(node)
+                if self._undo_log is not None:
+                    self._record_undo(lambda node=node: self._content_index.discard(node))
+
+            if self._content_compressor is not None and is_file(node):
+                self._content_compressor.touch(node)
+
+    """
+        Paths of file below directory joined to prefix, the path of directory ('./a/b' for prefix
+        '.'): its own if it is strictly below directory, and the ones it has in the copies of its
+        ancestors that are still pending (the nodes there are only made when needed, see
+        lazy_copy.py). Called while keeping the pending copies
+    """
+    def _get_paths_relative_to_dir(self, file: AbstractFile, directory: Directory, prefix: str = '.') -> List[str]:
+        if not self._copy_loader.has_copies():
+            file_path = self._get_path_relative_to_dir(file, directory, prefix)
+            return [] if file_path is None else [file_path]
+
+        return [glob_join(prefix, '/'.join(names)) for names in self._get_names_relative_to_dir(file, directory) if names]
+
+    # the paths of _get_paths_relative_to_dir as lists of names, [] standing for directory itself
+    def _get_names_relative_to_dir(self, file: AbstractFile, directory: Directory) -> List[List[str]]:
+        result = []
+        # names from file up to node, in reverse
+        names = []
+        node = file
+        while True:
+            if node is directory:
+                result.append(names[::-1])
+            # a copy of file itself is a node of its own
+            for copy in self._copy_loader.get_copies(node) if names else ():
+                for copy_names in self._get_names_relative_to_dir(copy, directory):
+                    result.append(copy_names + names[::-1])
+
+            if node.get_parent() is node:
+                return result
+            names.append(node.get_name())
+            node = node.get_parent()
+
+    # files whose paths (see _get_paths_relative_to_dir) may be below directory: the ones below it
+    # and, for the pending copies below it, the ones below their sources
+    def _get_files_below(self, directory: Directory) -> Set[File]:
+        files = set()
+        tops = [directory]
+        walked = {directory}
+        while tops:
+            for node in iterate_subtree(tops.pop(), self._copy_loader.is_pending):
+                if is_file(node):
+                    files.add(node)
+                    continue
+
+                source = self._copy_loader.get_source(node)
+                if source is not None and source not in walked:
+                    walked.add(source)
+                    tops.append(source)
+
+        return files
+
+    """
+        Path of file below directory joined to prefix, the path of directory ('./a/b' for
+        prefix '.'). None if file is not strictly below directory
+    """
+    def _get_path_relative_to_dir(self, file: AbstractFile, directory: Directory, prefix: str = '.') -> Optional[str]:
+        if file is directory:
+            return None
+
+        path_list = [file.get_name()]
+        cur_file = file.get_parent()
+        while cur_file is not directory:
+            if cur_file.is_root():
+                return None
+
+            path_list.append(cur_file.get_name())
+            cur_file = cur_file.get_parent()
+
+        path_list.reverse()
+
+        return glob_join(prefix, '/'.join(path_list))
     
     """
       decide path/file_name for move or copy
       /a/b if b exists as a directory, then path is /a/b/, file_name is same as source
       /a/b if b does not exist, then path is /a/, file_name is b
     """
-    def _get_target_path_and_file_name_for_move(self, source_file: AbstractFile, to_path: str) -> str:
+    def _get_target_path_and_file_name_for_move(self, source_name: str, to_path: str) -> str:
         to_pure_path, to_file_name = parse_path(to_path)
             
-        to_file_name = source_file.get_name() if to_file_name is None else to_file_name
+        to_file_name = source_name if to_file_name is None else to_file_name
 
         # if to_path is 'path/dir' and dir exists and is a directory then we keep the original name  
         # but if to_path is 'path/file' and file does not exist and is not a directory, then we treat 'file' as the new file name
         try: 
             maybe_target_dir_file = self._get_file_object_from_path(to_path)
             if is_directory(maybe_target_dir_file):
-                to_file_name = source_file.get_name()
+                to_file_name = source_name
                 
                 return (to_path, to_file_name)
 
@@ -0,0 +1,59 @@
+import threading
+from contextlib import nullcontext
+from typing import Dict
+
+from file_system.error import PathComponentNotFoundException
+from file_system.file import AbstractFile
+
+
+"""
+    Inode number -> node, for calls that name a node by its number instead of a path.
+    A node gets its number the first time it is looked up, so only nodes that were ever looked up
+    are in the table, and keeps it for as long as it is in the tree, wherever it is moved or renamed
+    to. Numbers are never reused; the number of a node that left the tree is stale from then on.
+    Numbers are handed out under readers too, so a thread safe table guards itself
+"""
+class InodeTable:
+    def __init__(self, thread_safe=False) -> None:
+        self._nodes: Dict[int, AbstractFile] = {}
+        self._next_inode: int = 1
+        self._lock = threading.Lock() if thread_safe else nullcontext()
+
+    def get_inode(self, node: AbstractFile) -> int:
+        inode = node.get_inode()
+        if inode:
+            return inode
+
+        with self._lock:
+            inode = node.get_inode()
+            if not inode:
+                inode = self._next_inode
+                self._next_inode += 1
+                node.set_inode(inode)
+                self._nodes[inode] = node
+
+        return inode
+
+    def get_node(self, inode: int) -> AbstractFile:
+        node = self._nodes.get(inode)
+        if node is None:
+            raise PathComponentNotFoundException('No node with inode ' + str(inode))
+
+        return node
+
+    # for nodes leaving the tree
+    def discard(self, node: AbstractFile) -> None:
+        inode = node.get_inode()
+        if inode:
+            with self._lock:
+                self._nodes.pop(inode, None)
+
+    # undo of discard, the node is back under its old number
+    def restore(self, node: AbstractFile) -> None:
+        inode = node.get_inode()
+        if inode:
+            with self._lock:
+                self._nodes[inode] = node
+
+    def __len__(self) -> int:
+        return len(self._nodes)
@@ -0,0 +1,228 @@
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Iterator, List, Optional, Tuple
+
+import file_system.codec as codec
+from file_system.error import InvalidOperationException
+from file_system.file_system import FileSystem
+
+
+# fsync after every record, no group commit
+FSYNC_ALWAYS = 'always'
+# fsync once per group of records flushed together
+FSYNC_GROUP = 'group'
+# hand records to the OS only, a crash of the machine (not the process) can lose the tail
+FSYNC_NEVER = 'never'
+
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_GROUP, FSYNC_NEVER)
+
+DEFAULT_FLUSH_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 0.01
+
+# every record is (payload length, crc32 of payload) followed by the codec encoded payload
+RECORD_HEADER = struct.Struct('<II')
+
+SEGMENT_FILE_PATTERN = re.compile(r'^segment_(\d{8})\.log$')
+CHECKPOINT_FILE_PATTERN = re.compile(r'^checkpoint_(\d{8})\.snapshot$')
+
+
+"""
+    Write ahead journal of mutating FileSystem calls.
+
+    Records are buffered and written as a group once flush_bytes are pending or flush_interval
+    seconds passed since the last flush (a background thread takes care of an idle tail),
+    with fsync_policy deciding when the OS is asked to put them on disk.
+
+    The journal directory holds numbered segments and checkpoints. checkpoint_<n> is a snapshot of the
+    tree as of the start of segment_<n>, so recovery loads the newest checkpoint and replays the
+    segments from that number on. Writing a checkpoint starts a new segment and drops everything older.
+
+      journal = Journal('/var/lib/fs')
+      fs = journal.recover()    # attaches the journal, later calls are recorded
+      ...
+      fs.checkpoint()
+      journal.close()
+"""
+class Journal:
+    def __init__(
+        self,
+        directory: str,
+        fsync_policy: str = FSYNC_GROUP,
+        flush_bytes: int = DEFAULT_FLUSH_BYTES,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ) -> None:
+        if fsync_policy not in FSYNC_POLICIES:
+            raise InvalidOperationException('Unknown fsync policy ' + str(fsync_policy))
+
+        self._directory: str = directory
+        self._fsync_policy: str = fsync_policy
+        self._flush_bytes: int = flush_bytes
+        self._flush_interval: float = flush_interval
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._last_flush: float = time.monotonic()
+        self._segment_number: int = 0
+        self._segment_file = None
+
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+
+    """
+        Rebuilds the tree from the newest checkpoint and the segments after it, then attaches
+        the journal to the returned file system. kwargs are passed to the FileSystem constructor
+    """
+    def recover(self, **kwargs) -> FileSystem:
+        checkpoints = self._list_files(CHECKPOINT_FILE_PATTERN)
+        segments = self._list_files(SEGMENT_FILE_PATTERN)
+
+        start = 0
+        if checkpoints:
+            start = checkpoints[-1][0]
+            fs = FileSystem.load(checkpoints[-1][1], **kwargs)
+        else:
+            fs = FileSystem(**kwargs)
+
+        last_segment = start
+        for number, segment_path in segments:
+            if number < start:
+                continue
+
+            for method_name, args, kwargs_of_call in read_segment(segment_path):
+                try:
+                    getattr(fs, method_name)(*args, **kwargs_of_call)
+                except Exception:
+                    # the call failed the same way when it was first made
+                    pass
+            last_segment = number
+
+        self._start_segment(last_segment + 1, fs)
+        fs.attach_journal(self)
+
+        if self._flush_interval > 0 and self._fsync_policy != FSYNC_ALWAYS:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+        return fs
+
+    def append(self, method_name: str, args: tuple, kwargs: dict) -> None:
+        payload = codec.encode([method_name, list(args), kwargs])
+
+        with self._lock:
+            self._buffer += RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            self._buffer += payload
+
+            if (
+                self._fsync_policy == FSYNC_ALWAYS
+                or len(self._buffer) >= self._flush_bytes
+                or time.monotonic() - self._last_flush >= self._flush_interval
+            ):
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    """
+        Called by FileSystem.checkpoint with the tree locked for writing
+    """
+    def checkpoint(self, fs: FileSystem) -> None:
+        with self._lock:
+            self._flush_locked()
+
+        number = self._segment_number + 1
+        # the new segment exists before its checkpoint: a crash in between replays the old segments
+        self._start_segment(number, fs)
+        fs.save(self._get_path('checkpoint_{:08d}.snapshot'.format(number)), self._fsync_policy != FSYNC_NEVER)
+
+        for pattern in (SEGMENT_FILE_PATTERN, CHECKPOINT_FILE_PATTERN):
+            for old_number, old_path in self._list_files(pattern):
+                if old_number < number:
+                    try:
+                        os.remove(old_path)
+                    except OSError:
+                        pass
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+
+        with self._lock:
+            self._flush_locked()
+            if self._segment_file is not None:
+                self._segment_file.close()
+                self._segment_file = None
+
+    def _start_segment(self, number: int, fs: FileSystem) -> None:
+        with self._lock:
+            self._flush_locked()
+            if self._segment_file is not None:
+                self._segment_file.close()
+
+            self._segment_number = number
+            self._segment_file = open(self._get_path('segment_{:08d}.log'.format(number)), 'ab')
+
+        # snapshots do not keep the current directory, every segment starts by restoring it
+        self.append('change_dir', (fs.get_current_path(),), {})
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer or self._segment_file is None:
+            return
+
+        self._segment_file.write(self._buffer)
+        self._buffer.clear()
+        self._segment_file.flush()
+
+        if self._fsync_policy != FSYNC_NEVER:
+            os.fsync(self._segment_file.fileno())
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self._flush_interval):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._last_flush >= self._flush_interval:
+                    self._flush_locked()
+
+    def _list_files(self, pattern) -> List[Tuple[int, str]]:
+        files = []
+        for file_name in os.listdir(self._directory):
+            match = pattern.match(file_name)
+            if match:
+                files.append((int(match.group(1)), self._get_path(file_name)))
+
+        files.sort()
+        return files
+
+    def _get_path(self, file_name: str) -> str:
+        return os.path.join(self._directory, file_name)
+
+
+"""
+    Yields (method name, args, kwargs) for every intact record of a segment.
+    Reading stops at the first short or corrupt record, which is where a crash cut the segment off
+"""
+def read_segment(segment_path: str) -> Iterator[Tuple[str, List[Any], dict]]:
+    with open(segment_path, 'rb') as segment_file:
+        data = segment_file.read()
+
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            return
+
+        try:
+            method_name, args, kwargs = codec.decode(payload)
+        except InvalidOperationException:
+            return
+
+        yield method_name, args, kwargs
+        offset += RECORD_HEADER.size + length
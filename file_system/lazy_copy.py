@@ -0,0 +1,129 @@
+import threading
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from file_system.file import AbstractFile, ChildLoader, Directory, File
+from file_system.utils import is_directory
+
+
+"""
+    Directories copied lazily (copy on write of nodes). A copy starts out as a single directory
+    node carrying the aggregates of its source and this loader; its children are made the first
+    time they are needed, one level at a time, with subdirectories again pending copies. So copy is
+    O(1) and memory follows the part of the copy that is used.
+
+    A pending copy reads its source, so the source must look like it did when it was copied until
+    the copy is loaded. The file system calls materialize before anything is changed, renamed or
+    removed below a directory: the pending copies of every directory on the way get their children
+    first (a level per directory), which costs O(depth) when nothing is pending.
+    A copy of a copy that is still pending reads the same source.
+
+    copy_made(source node, new node) is the file system's hook for a node made here, which shares
+    the content and indexes the node
+"""
+class CopyLoader(ChildLoader):
+    def __init__(self, copy_made: Callable[[AbstractFile, AbstractFile], None], thread_safe=False) -> None:
+        self._copy_made: Callable[[AbstractFile, AbstractFile], None] = copy_made
+
+        # pending copy -> its source, source -> its pending copies
+        self._sources: Dict[Directory, Directory] = {}
+        self._copies: Dict[Directory, List[Directory]] = {}
+
+        # copies are loaded by their readers, while writers of the source materialize them
+        self._lock = threading.RLock() if thread_safe else nullcontext()
+
+    # an unlinked copy of source whose parent is parent
+    def make_copy(self, source: Directory, name: str, parent: Directory) -> Directory:
+        with self._lock:
+            source = self._sources.get(source, source)
+
+            copy = Directory(name, parent)
+            copy.set_aggregates(*source.get_aggregates())
+            self.add_copy(copy, source)
+
+        return copy
+
+    def load_children(self, directory: Directory) -> None:
+        with self._lock:
+            if directory.is_loaded():
+                return
+
+            # a level can be wide, so the pending copies are registered here rather than by make_copy
+            sources, copies, copy_made = self._sources, self._copies, self._copy_made
+            children = directory.children
+            for source_child in sources[directory].get_all_children():
+                name = source_child.get_name()
+                if is_directory(source_child):
+                    source = sources.get(source_child, source_child)
+                    child = Directory(name, directory)
+                    child.set_aggregates(*source.get_aggregates())
+                    child.set_child_loader(self)
+                    sources[child] = source
+                    copies.setdefault(source, []).append(child)
+                else:
+                    child = File(name, directory)
+                copy_made(source_child, child)
+                children[name] = child
+
+            self.remove_copy(directory)
+
+    # loads the pending copies of file's ancestors, top down, and of file itself if it is a directory
+    def materialize(self, file: AbstractFile) -> None:
+        if not self._copies:
+            return
+
+        path = [file]
+        while path[-1].get_parent() is not path[-1]:
+            path.append(path[-1].get_parent())
+
+        with self._lock:
+            for node in reversed(path):
+                self.materialize_copies_of(node)
+
+    def materialize_copies_of(self, directory: AbstractFile) -> None:
+        with self._lock:
+            for copy in list(self._copies.get(directory, ())):
+                self.load_children(copy)
+
+    def get_copies(self, directory: AbstractFile) -> List[Directory]:
+        with self._lock:
+            return list(self._copies.get(directory, ()))
+
+    def is_pending(self, directory: Directory) -> bool:
+        with self._lock:
+            return directory in self._sources
+
+    def get_source(self, directory: Directory) -> Optional[Directory]:
+        with self._lock:
+            return self._sources.get(directory)
+
+    def has_copies(self) -> bool:
+        return bool(self._copies)
+
+    # while held no pending copy is loaded, so the sources of the pending copies stay as they were copied
+    def keeping_pending(self) -> ContextManager[None]:
+        return self._lock
+
+    def add_copy(self, copy: Directory, source: Directory) -> None:
+        with self._lock:
+            self._sources[copy] = source
+            self._copies.setdefault(source, []).append(copy)
+            copy.set_child_loader(self)
+
+    """
+        copy reads its source no more: it is loaded, or it left the tree (then it stays empty).
+        Returns the source, None if copy was not pending
+    """
+    def remove_copy(self, copy: Directory) -> Optional[Directory]:
+        with self._lock:
+            source = self._sources.pop(copy, None)
+            if source is None:
+                return None
+
+            copies = self._copies[source]
+            copies.remove(copy)
+            if not copies:
+                del self._copies[source]
+            copy.set_child_loader(None)
+
+        return source
@@ -0,0 +1,183 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from file_system.error import InvalidOperationException
+
+
+# lock modes: something below the node is read / changed, the node and everything below it is read / changed
+INTENTION_SHARED = 0
+INTENTION_EXCLUSIVE = 1
+SHARED = 2
+EXCLUSIVE = 3
+
+# modes that can not be granted on a node while it is held (or asked for, earlier) in the given mode
+CONFLICTING_MODES = (
+    (EXCLUSIVE,),
+    (SHARED, EXCLUSIVE),
+    (INTENTION_EXCLUSIVE, EXCLUSIVE),
+    (INTENTION_SHARED, INTENTION_EXCLUSIVE, SHARED, EXCLUSIVE),
+)
+
+# absolute path as its components, () for the root
+LockPath = Tuple[str, ...]
+
+
+# COMBINED_MODES[mode][other_mode]: the weakest mode granting both. A node both read as a whole
+# and changed below is locked exclusively
+COMBINED_MODES = (
+    (INTENTION_SHARED, INTENTION_EXCLUSIVE, SHARED, EXCLUSIVE),
+    (INTENTION_EXCLUSIVE, INTENTION_EXCLUSIVE, EXCLUSIVE, EXCLUSIVE),
+    (SHARED, EXCLUSIVE, SHARED, EXCLUSIVE),
+    (EXCLUSIVE, EXCLUSIVE, EXCLUSIVE, EXCLUSIVE),
+)
+
+
+# whether a node held in held_mode grants mode on itself, or with below on a node below it
+def grants(held_mode: Optional[int], mode: int, below: bool) -> bool:
+    if held_mode is None or below and held_mode not in (SHARED, EXCLUSIVE):
+        return False
+
+    return COMBINED_MODES[mode][held_mode] == held_mode
+
+
+# adds a lock on path to targets, with the intention locks on its ancestors
+def add_lock_target(targets: Dict[LockPath, int], path: LockPath, mode: int) -> None:
+    targets[path] = COMBINED_MODES[targets.get(path, mode)][mode]
+
+    intention = INTENTION_SHARED if mode in (INTENTION_SHARED, SHARED) else INTENTION_EXCLUSIVE
+    for depth in range(len(path)):
+        ancestor = path[:depth]
+        targets[ancestor] = COMBINED_MODES[targets.get(ancestor, intention)][intention]
+
+
+# per locked node a list: the number of holders for each mode (indexed by mode), then at WAITING the
+# (ticket, mode) of the requests waiting for it, oldest first. Most calls make and drop one per node
+WAITING = 4
+
+
+def _can_grant(entry: list, ticket: int, mode: int) -> bool:
+    conflicting = CONFLICTING_MODES[mode]
+    for held_mode in conflicting:
+        if entry[held_mode]:
+            return False
+
+    for waiting_ticket, waiting_mode in entry[WAITING]:
+        if waiting_ticket < ticket and waiting_mode in conflicting:
+            return False
+
+    return True
+
+
+"""
+    Hierarchical (multi granularity) lock over the tree, keyed by path. A call locks the nodes it
+    reads or changes SHARED or EXCLUSIVE, which covers everything below them, and every ancestor of
+    those with the matching intention mode. So readers of separate nodes never wait, writers of
+    separate subtrees do not wait for each other, and a reader of a directory waits for the writers
+    below it (e.g. du of a directory whose file is being written).
+
+    All locks of a call are taken at once, in one fixed order (by path, so ancestors come first),
+    and released together. That is what keeps move and copy, which lock two places, from
+    deadlocking against each other. Requests queue per node: a request is not granted past an
+    older waiting one it conflicts with, so a stream of readers can not starve a writer.
+
+    Calls made while the thread holds locks (public methods call each other, batch calls them all)
+    take nothing more; they must be covered by what is held, e.g. by an EXCLUSIVE lock on an ancestor
+"""
+class TreeLock:
+    def __init__(self) -> None:
+        # guards the entries, the condition waits on it
+        self._mutex = threading.Lock()
+        self._condition = threading.Condition(self._mutex)
+        self._entries: Dict[LockPath, list] = {}
+        self._next_ticket: int = 0
+        self._waiters: int = 0
+        # what the thread holds, path -> mode
+        self._local = threading.local()
+
+    """
+        Takes targets (path -> mode, ancestors included). Returns False and takes nothing if the locks
+        the thread holds cover them already
+    """
+    def acquire(self, targets: Dict[LockPath, int]) -> bool:
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            if not self.is_covered(targets):
+                raise InvalidOperationException('Can not take locks beyond the ones held, e.g. upgrade a read lock to a write lock')
+            return False
+
+        entries = self._entries
+        with self._mutex:
+            for path, mode in sorted(targets.items()):
+                entry = entries.get(path)
+                if entry is None:
+                    entry = entries[path] = [0, 0, 0, 0, []]
+                    entry[mode] = 1
+                    continue
+
+                waiting = entry[WAITING]
+                if not waiting and _can_grant(entry, self._next_ticket, mode):
+                    entry[mode] += 1
+                    continue
+
+                ticket = self._next_ticket
+                self._next_ticket += 1
+                waiting.append((ticket, mode))
+                self._waiters += 1
+                while not _can_grant(entry, ticket, mode):
+                    self._condition.wait()
+                waiting.remove((ticket, mode))
+                self._waiters -= 1
+                entry[mode] += 1
+                # requests queued behind this one may be compatible with it
+                self._condition.notify_all()
+
+        self._local.held = targets
+        return True
+
+    def release(self) -> None:
+        held = self._local.held
+        self._local.held = None
+
+        entries = self._entries
+        with self._mutex:
+            for path, mode in held.items():
+                entry = entries[path]
+                entry[mode] -= 1
+                if not (entry[0] or entry[1] or entry[2] or entry[3] or entry[WAITING]):
+                    del entries[path]
+
+            if self._waiters:
+                self._condition.notify_all()
+
+    # whether the locks the thread holds grant targets too
+    def is_covered(self, targets: Dict[LockPath, int]) -> bool:
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            return False
+
+        for path, mode in targets.items():
+            if not grants(held.get(path), mode, False) and \
+                    not any(grants(held.get(path[:depth]), mode, True) for depth in range(len(path))):
+                return False
+
+        return True
+
+    def is_held(self) -> bool:
+        return getattr(self._local, 'held', None) is not None
+
+    @contextmanager
+    def locked(self, targets: Dict[LockPath, int]) -> Iterator[None]:
+        acquired = self.acquire(targets)
+        try:
+            yield
+        finally:
+            if acquired:
+                self.release()
+
+    # the whole tree
+    def read_locked(self) -> Iterator[None]:
+        return self.locked({(): SHARED})
+
+    def write_locked(self) -> Iterator[None]:
+        return self.locked({(): EXCLUSIVE})
@@ -0,0 +1,170 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+# counted per call, see FileSystem._count
+COUNTERS = ('path_components', 'component_lookups', 'nodes_visited', 'bytes_read', 'bytes_written')
+
+# latency histogram bucket i holds calls that took less than 2^i microseconds (and at least 2^(i - 1))
+HISTOGRAM_BUCKETS = 40
+
+
+"""
+    One call of a public FileSystem method, as handed to hooks.
+    elapsed_ns, error and the counters are only final in Hook.after_call
+"""
+class CallRecord:
+    __slots__ = ('method', 'args', 'kwargs', 'start_ns', 'elapsed_ns', 'error', 'counters')
+
+    def __init__(self, method: str, args: tuple, kwargs: dict) -> None:
+        self.method: str = method
+        self.args: tuple = args
+        self.kwargs: dict = kwargs
+        self.start_ns: int = time.perf_counter_ns()
+        self.elapsed_ns: int = 0
+        self.error: Optional[BaseException] = None
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+
+
+"""
+    Base class of the callbacks run around every public FileSystem call, e.g. to forward
+    the records to a metrics system. Hooks run on the calling thread, inside any lock the call holds
+"""
+class Hook:
+    def before_call(self, record: CallRecord) -> None:
+        pass
+
+    def after_call(self, record: CallRecord) -> None:
+        pass
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'total_ns', 'max_ns', 'histogram', 'counters')
+
+    def __init__(self) -> None:
+        self.calls: int = 0
+        self.errors: int = 0
+        self.total_ns: int = 0
+        self.max_ns: int = 0
+        self.histogram: List[int] = [0] * HISTOGRAM_BUCKETS
+        self.counters: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+
+    def add(self, record: CallRecord) -> None:
+        self.calls += 1
+        if record.error is not None:
+            self.errors += 1
+
+        self.total_ns += record.elapsed_ns
+        self.max_ns = max(self.max_ns, record.elapsed_ns)
+        self.histogram[min((record.elapsed_ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+        for counter, value in record.counters.items():
+            self.counters[counter] += value
+
+    # upper bound of the histogram bucket the percentile falls into
+    def get_percentile_us(self, fraction: float) -> int:
+        rank = fraction * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return 1 << bucket
+
+        return 1 << (HISTOGRAM_BUCKETS - 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        stats = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_us': self.total_ns / 1e3,
+            'mean_us': self.total_ns / 1e3 / self.calls if self.calls else 0.0,
+            'max_us': self.max_ns / 1e3,
+            'p50_us': self.get_percentile_us(0.5),
+            'p90_us': self.get_percentile_us(0.9),
+            'p99_us': self.get_percentile_us(0.99),
+            'histogram_us': {1 << bucket: count for bucket, count in enumerate(self.histogram) if count},
+        }
+        stats.update(self.counters)
+
+        return stats
+
+
+"""
+    Per method call counts, latency histograms and counters of a FileSystem.
+    Calls made from inside another call (e.g. by batch or open) are measured too, and what they
+    count is also added to every call around them. totals counts everything once, including
+    what is counted outside a call (reads and writes through file handles)
+"""
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # stack of the calls running on this thread
+        self._local = threading.local()
+        self._methods: Dict[str, MethodStats] = {}
+        self._totals: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._hooks: List[Hook] = []
+
+    def add_hook(self, hook: Hook) -> None:
+        self._hooks = self._hooks + [hook]
+
+    def remove_hook(self, hook: Hook) -> None:
+        self._hooks = [other for other in self._hooks if other is not hook]
+
+    def begin(self, method: str, args: tuple, kwargs: dict) -> CallRecord:
+        record = CallRecord(method, args, kwargs)
+        for hook in self._hooks:
+            hook.before_call(record)
+
+        self._get_stack().append(record)
+        return record
+
+    def end(self, record: CallRecord, error: Optional[BaseException]) -> None:
+        record.elapsed_ns = time.perf_counter_ns() - record.start_ns
+        record.error = error
+
+        stack = self._get_stack()
+        stack.pop()
+
+        with self._lock:
+            stats = self._methods.get(record.method)
+            if stats is None:
+                stats = self._methods[record.method] = MethodStats()
+            stats.add(record)
+
+            # nested calls already added theirs to this record
+            if not stack:
+                for counter, value in record.counters.items():
+                    self._totals[counter] += value
+
+        for hook in self._hooks:
+            hook.after_call(record)
+
+    def add(self, counter: str, value: int) -> None:
+        stack = self._get_stack()
+        if not stack:
+            with self._lock:
+                self._totals[counter] += value
+            return
+
+        for record in stack:
+            record.counters[counter] += value
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'methods': {method: stats.to_dict() for method, stats in sorted(self._methods.items())},
+                'totals': dict(self._totals),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._methods = {}
+            self._totals = dict.fromkeys(COUNTERS, 0)
+
+    def _get_stack(self) -> List[CallRecord]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        return stack
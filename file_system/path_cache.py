@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Dict, Hashable, Optional
+
+from file_system.file import AbstractFile
+
+
+"""
+    Bounded LRU cache of resolved path -> node.
+    Entries are stamped with the generation they were resolved in. Anything that unlinks a node
+    bumps the generation, which makes every older entry stale without touching them;
+    stale entries are dropped lazily when they are looked up or fall off the LRU end.
+    Lookups reorder the LRU, so a thread safe cache guards itself even for concurrent readers
+"""
+class PathCache:
+    def __init__(self, capacity: int, thread_safe=False) -> None:
+        self._capacity: int = capacity
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._generation: int = 0
+        self._lock = threading.Lock() if thread_safe else nullcontext()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+
+    def get(self, key: Hashable) -> Optional[AbstractFile]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != self._generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, file: AbstractFile) -> None:
+        if self._capacity <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (file, self._generation)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    # changes whenever a node was unlinked, so anything derived from the tree's shape can be kept until then
+    def get_generation(self) -> int:
+        return self._generation
+
+    # under the lock too, two writers unlinking at once must both be seen by threads comparing generations
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'size': len(self._entries),
+            'capacity': self._capacity,
+        }
@@ -0,0 +1,77 @@
+import struct
+from typing import Any, List
+
+import file_system.codec as codec
+import file_system.error as error
+from file_system.batch import BatchResult, BATCH_OPERATIONS
+
+
+"""
+    Wire protocol between FileSystemServer and FileSystemClient.
+
+    Every message is a frame: payload length (uint32, little endian) followed by the codec encoded
+    payload. A request is [request id, current directory, method name, args, kwargs] and its reply
+    [request id, ok, value], where value is [exception class name, message] when ok is false.
+    Requests carry the caller's current directory, so the server keeps no per connection state and
+    any connection of a pool can serve any call.
+    Clients may send any number of requests without waiting (pipelining); replies carry the id
+    of their request
+"""
+
+FRAME_HEADER = struct.Struct('<I')
+
+# FileSystem methods a server answers
+SERVER_METHODS = BATCH_OPERATIONS | frozenset([
+    'batch', 'du', 'stat', 'grep', 'export_tree', 'import_tree',
+    'lookup', 'read_inode', 'write_inode', 'stat_inode', 'ls_inode',
+])
+
+
+def encode_frame(value: Any) -> bytes:
+    payload = codec.encode(value)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+# decodes and removes every complete frame at the start of buffer
+def pop_frames(buffer: bytearray) -> List[Any]:
+    values = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(buffer):
+        length = FRAME_HEADER.unpack_from(buffer, offset)[0]
+        end = offset + FRAME_HEADER.size + length
+        if end > len(buffer):
+            break
+
+        values.append(codec.decode(bytes(buffer[offset + FRAME_HEADER.size:end])))
+        offset = end
+
+    del buffer[:offset]
+    return values
+
+
+def encode_error(e: Exception) -> List[str]:
+    return [type(e).__name__, str(e)]
+
+
+# exceptions of error.py come back as themselves, anything else as RemoteException
+def decode_error(encoded: List[str]) -> Exception:
+    name, message = encoded
+    exception_class = getattr(error, name, None)
+    if isinstance(exception_class, type) and issubclass(exception_class, Exception):
+        return exception_class(message)
+
+    return error.RemoteException(name + ': ' + message)
+
+
+def encode_batch_results(results: List[BatchResult]) -> List[list]:
+    return [
+        [result.executed, result.value, None if result.error is None else encode_error(result.error)]
+        for result in results
+    ]
+
+
+def decode_batch_results(encoded: List[list]) -> List[BatchResult]:
+    return [
+        BatchResult(value, None if encoded_error is None else decode_error(encoded_error), executed)
+        for executed, value, encoded_error in encoded
+    ]
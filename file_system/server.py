@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import inspect
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from file_system.batch import BatchResult, BATCH_OPERATIONS
+from file_system.error import InvalidOperationException, InvalidPathComponentException
+from file_system.file_system import FileSystem
+from file_system.protocol import SERVER_METHODS, encode_batch_results, encode_error, encode_frame, pop_frames
+from file_system.utils import glob_join, normalize_path
+
+
+READ_SIZE = 256 * 1024
+
+
+"""
+    Serves a FileSystem over TCP or a Unix socket, see protocol.py for the wire format.
+
+    Calls run in an executor, so a large copy or find only holds up the connection that sent it while
+    the event loop keeps reading and answering the others. The default file system is thread safe and
+    the calls of separate connections overlap (readers in parallel, writers one at a time); a file
+    system that is not thread safe gets an executor with a single thread, so its calls still run one
+    at a time. Every frame that has arrived on a connection is answered in one executor hop and the
+    replies go out in one write, so pipelined requests cost one read, one hop and one write per batch
+    instead of per call.
+    Every request carries the client's current directory and its paths are resolved against it by the
+    server, lexically, so the tree's own current directory (and its journal and metrics) is never
+    touched by clients.
+
+      server = FileSystemServer(port=7777)
+      await server.start()
+      await server.serve_forever()
+"""
+class FileSystemServer:
+    def __init__(
+        self,
+        fs: Optional[FileSystem] = None,
+        host: Optional[str] = '127.0.0.1',
+        port: int = 0,
+        path: Optional[str] = None,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        self._fs: FileSystem = fs if fs is not None else FileSystem(thread_safe=True)
+        self._host: Optional[str] = host
+        self._port: int = port
+        self._path: Optional[str] = path
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # None runs calls in the event loop's default executor
+        self._executor: Optional[Executor] = executor
+        self._owns_executor: bool = False
+        if executor is None and not self._fs.is_thread_safe():
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._owns_executor = True
+
+    async def start(self) -> None:
+        if self._path is not None:
+            self._server = await asyncio.start_unix_server(self._serve_connection, self._path)
+        else:
+            self._server = await asyncio.start_server(self._serve_connection, self._host, self._port)
+
+    # (host, port) for TCP, the socket path for a Unix socket
+    def get_address(self) -> Any:
+        if self._path is not None:
+            return self._path
+
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self) -> None:
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+
+                buffer += data
+                requests = pop_frames(buffer)
+                if requests:
+                    writer.write(await loop.run_in_executor(self._executor, self._handle_requests, requests))
+                    await writer.drain()
+        except (ConnectionError, InvalidOperationException):
+            # a peer that went away or sent garbage only loses its own connection
+            pass
+        finally:
+            writer.close()
+
+    # the replies to requests, in order, as one buffer
+    def _handle_requests(self, requests: List[Any]) -> bytes:
+        return b''.join(self._handle_request(request) for request in requests)
+
+    def _handle_request(self, request: List[Any]) -> bytes:
+        # a malformed frame is answered like a failed call, under its id if it has one
+        request_id = request[0] if isinstance(request, list) and request else None
+        try:
+            try:
+                request_id, current_path, method_name, args, kwargs = request
+            except (TypeError, ValueError):
+                raise InvalidOperationException('Malformed request')
+            if not isinstance(current_path, str) or not isinstance(args, list) or not isinstance(kwargs, dict):
+                raise InvalidOperationException('Malformed request')
+
+            if method_name not in SERVER_METHODS:
+                raise InvalidOperationException('Unsupported method ' + str(method_name))
+
+            if method_name == 'batch':
+                result = encode_batch_results(self._run_batch(current_path, *args, **kwargs))
+            else:
+                result = self._call(current_path, method_name, args, kwargs)[0]
+
+            return encode_frame([request_id, True, result])
+        except Exception as e:
+            return encode_frame([request_id, False, encode_error(e)])
+
+    """
+        Runs one call for a client in current_path and returns its result and the client's current
+        directory after it. Paths are made absolute first, the calls that depend on the current
+        directory (change_dir, get_current_path) are answered here and the paths find and grep
+        return are written back relative to the path they were given
+    """
+    def _call(self, current_path: str, method_name: str, args: List[Any], kwargs: Dict[str, Any]) -> Tuple[Any, str]:
+        if method_name == 'get_current_path':
+            return current_path, current_path
+
+        arguments, given_path = resolve_arguments(current_path, method_name, args, kwargs)
+        if method_name == 'change_dir':
+            # fails unless path is a directory, see get_directory_check
+            self._fs.ls(arguments.arguments['path'], None, 0)
+            return None, arguments.arguments['path'].rstrip('/') or '/'
+
+        result = getattr(self._fs, method_name)(*arguments.args[1:], **arguments.kwargs)
+        if method_name in RELATIVE_RESULT_METHODS and given_path is not None:
+            result = [rebase_path(path, arguments.arguments['path'], given_path) for path in result]
+
+        return result, current_path
+
+    """
+        A batch that is not atomic runs call by call, like separate requests. An atomic one runs as one
+        FileSystem.batch, with its paths made absolute against the current directory each operation
+        sees: a change_dir becomes a check that its target is a directory and get_current_path a check
+        of the root, their results are filled in afterwards
+    """
+    def _run_batch(self, current_path: str, operations: List[list], atomic=False) -> List[BatchResult]:
+        if not atomic:
+            results = []
+            for operation in operations:
+                try:
+                    if not operation or operation[0] not in BATCH_OPERATIONS:
+                        raise InvalidOperationException('Unsupported batch operation: ' + str(operation))
+
+                    value, current_path = self._call(current_path, operation[0], list(operation[1:]), {})
+                    results.append(BatchResult(value))
+                except Exception as e:
+                    results.append(BatchResult(error=e))
+
+            return results
+
+        resolved_operations = []
+        # index of an operation -> the value it gives
+        fixed_values: Dict[int, Any] = {}
+        # index of a find -> (the path it ran below, the path it was given)
+        find_paths: Dict[int, Tuple[str, str]] = {}
+        for idx, operation in enumerate(operations):
+            if not operation or operation[0] not in BATCH_OPERATIONS:
+                # FileSystem.batch fails the batch on it
+                resolved_operations.append(operation)
+                continue
+
+            method_name = operation[0]
+            if method_name == 'get_current_path':
+                resolved_operations.append(get_directory_check('/'))
+                fixed_values[idx] = current_path
+                continue
+
+            arguments, given_path = resolve_arguments(current_path, method_name, list(operation[1:]), {})
+            if method_name == 'change_dir':
+                resolved_operations.append(get_directory_check(arguments.arguments['path']))
+                fixed_values[idx] = None
+                current_path = arguments.arguments['path'].rstrip('/') or '/'
+                continue
+
+            resolved_operations.append((method_name,) + tuple(arguments.args[1:]))
+            if method_name in RELATIVE_RESULT_METHODS and given_path is not None:
+                find_paths[idx] = (arguments.arguments['path'], given_path)
+
+        results = self._fs.batch(resolved_operations, True)
+
+        for idx, value in fixed_values.items():
+            if results[idx].is_ok():
+                results[idx].value = value
+        for idx, (path, given_path) in find_paths.items():
+            if results[idx].is_ok():
+                results[idx].value = [rebase_path(found, path, given_path) for found in results[idx].value]
+
+        return results
+
+
+# parameters of FileSystem methods that name a path, made absolute against the client's current directory
+PATH_PARAMETERS = frozenset(['path', 'from_path', 'to_path'])
+
+# calls returning paths written after their path argument ('./a' for '.'), see FileSystem.grep
+RELATIVE_RESULT_METHODS = frozenset(['find', 'grep'])
+
+_signatures: Dict[str, inspect.Signature] = {}
+
+
+"""
+    Binds the arguments of a FileSystem call, defaults included, with every path made absolute against
+    current_path. Paths are resolved lexically like ShardedFileSystem does, the tree's own current
+    directory is never used. Also returns the path argument as the client gave it (None if there is none)
+"""
+def resolve_arguments(current_path: str, method_name: str, args: List[Any], kwargs: Dict[str, Any]) -> Tuple[inspect.BoundArguments, Optional[str]]:
+    signature = _signatures.get(method_name)
+    if signature is None:
+        signature = _signatures[method_name] = inspect.signature(getattr(FileSystem, method_name))
+
+    arguments = signature.bind(None, *args, **kwargs)
+    arguments.apply_defaults()
+
+    given_path = None
+    for name in PATH_PARAMETERS & arguments.arguments.keys():
+        path = arguments.arguments[name]
+        if not isinstance(path, str):
+            continue
+        if not path:
+            raise InvalidPathComponentException('Invalid path')
+
+        if name == 'path':
+            given_path = path
+        arguments.arguments[name] = normalize_path(current_path, path)
+
+    return arguments, given_path
+
+
+# an ls that fails like change_dir unless path is a directory, and lists nothing
+def get_directory_check(path: str) -> tuple:
+    return ('ls', path, None, 0)
+
+
+# path below resolved_path, written below given_path instead
+def rebase_path(path: str, resolved_path: str, given_path: str) -> str:
+    resolved_path = resolved_path.rstrip('/') or '/'
+    rest = path[len(resolved_path):].lstrip('/')
+
+    return glob_join(given_path, rest) if rest else given_path
+
+
+async def serve(host: Optional[str], port: int, path: Optional[str]) -> None:
+    server = FileSystemServer(FileSystem(thread_safe=True), host, port, path)
+    await server.start()
+    print('serving on', server.get_address())
+    await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve an in memory file system')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.unix))
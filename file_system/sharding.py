@@ -0,0 +1,392 @@
+import heapq
+import multiprocessing
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import file_system.constant as constant
+from file_system.batch import BatchResult, BATCH_OPERATIONS
+from file_system.error import InvalidOperationException, InvalidPathComponentException, PathComponentNotFoundException
+from file_system.file_system import FileSystem
+from file_system.utils import normalize_path
+
+
+# batch operations taking two paths, every other one takes a single path first (or none at all)
+TWO_PATH_OPERATIONS = frozenset(['move', 'copy'])
+
+# operations that depend on the current directory, which only the router knows
+CURRENT_DIR_OPERATIONS = frozenset(['change_dir', 'ls', 'get_current_path', 'find'])
+
+
+"""
+    FileSystem split across worker processes by top level name: '/<name>' and everything below it
+    live on shard crc32(name) % shards, so each shard holds whole subtrees and runs its calls on its own
+    interpreter. The root itself exists on every shard.
+
+    The router has the FileSystem API and keeps the current directory, handing every call to the
+    owning shard with an absolute path (resolved lexically, see utils.normalize_path).
+    ls, du and stat of the root and find from the root ask all shards at once and merge the answers.
+    move and copy between shards export the subtree from one shard and import it into the other;
+    a move then removes the source, so it is not atomic across shards. The router picks the name a
+    move or copy gets in the root (renaming a copy on collision) so it lands on that name's shard.
+    A move or remove of the current directory or one of its ancestors is followed by the router:
+    the current directory moves along, or goes up to the parent of what was removed.
+    Atomic batches must stay on one shard. File handles, walk and iglob are not available.
+
+      with ShardedFileSystem(shards=4) as fs:
+          fs.make_new_file('/a/b')
+"""
+class ShardedFileSystem:
+    def __init__(self, shards: int = 4, start_method: Optional[str] = None, **kwargs) -> None:
+        if shards < 1:
+            raise InvalidOperationException('At least one shard is needed')
+
+        context = multiprocessing.get_context(start_method)
+        self._connections = []
+        self._processes = []
+        # one request at a time per shard, taken in shard order when several are needed
+        self._shard_locks = [threading.Lock() for _ in range(shards)]
+
+        for _ in range(shards):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=serve_shard, args=(worker_connection, kwargs), daemon=True)
+            process.start()
+            worker_connection.close()
+
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        self._current_path: str = '/'
+
+    def change_dir(self, path: str) -> None:
+        path = self._normalize(path)
+
+        if path != '/' and self._call_owner(path, 'stat', path)['type'] != 'directory':
+            raise InvalidPathComponentException('Path does not point to a directory')
+
+        self._current_path = path.rstrip('/') or '/'
+
+    def remove(self, path: str) -> None:
+        path = self._normalize(path)
+        self._call_owner(path, 'remove', path)
+        self._follow_remove(path)
+
+    def move(self, from_path: str, to_path: str) -> None:
+        self._transfer(from_path, to_path, True)
+
+    def copy(self, from_path: str, to_path: str) -> None:
+        self._transfer(from_path, to_path, False)
+
+    def make_new_dir(self, path: str) -> None:
+        path = self._normalize(path)
+        if path != '/':
+            self._call_owner(path, 'make_new_dir', path)
+
+    def make_new_file(self, path: str) -> None:
+        path = self._normalize(path)
+        self._call_owner(path, 'make_new_file', path)
+
+    def ls(
+        self,
+        path: str = '.',
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+        prefix: Optional[str] = None,
+    ) -> List[str]:
+        path = self._normalize(path)
+        if path != '/':
+            return self._call_owner(path, 'ls', path, start_after, limit, prefix)
+
+        pages = self._call_all('ls', '/', start_after, limit, prefix)
+        if start_after is None and limit is None and prefix is None:
+            return [name for names in pages for name in names]
+
+        # every shard answers a sorted page, the first limit names of their merge are the page
+        result = list(heapq.merge(*pages, key=lambda name: name.rstrip('/')))
+        return result if limit is None else result[:max(limit, 0)]
+
+    def get_current_path(self) -> str:
+        return self._current_path
+
+    def find(self, name: str, limit: Optional[int] = None) -> List[str]:
+        if self._current_path != '/':
+            return self._call_owner(self._current_path, 'find_in', self._current_path, name, limit)
+
+        # every shard answers sorted, the merge stays sorted
+        result = list(heapq.merge(*self._call_all('find', name, limit)))
+        return result if limit is None else result[:max(limit, 0)]
+
+    def du(self, path: str = '.') -> int:
+        path = self._normalize(path)
+        if path == '/':
+            return sum(self._call_all('du', '/'))
+
+        return self._call_owner(path, 'du', path)
+
+    def stat(self, path: str = '.') -> Dict[str, Union[str, int]]:
+        path = self._normalize(path)
+        if path != '/':
+            return self._call_owner(path, 'stat', path)
+
+        stats = self._call_all('stat', '/')
+        return {
+            'type': 'directory',
+            'size': sum(stat['size'] for stat in stats),
+            'files': sum(stat['files'] for stat in stats),
+            'directories': sum(stat['directories'] for stat in stats),
+        }
+
+    def write(self, path: str, content: Union[str, bytes], append=False) -> None:
+        path = self._normalize(path)
+        self._call_owner(path, 'write', path, content, append)
+
+    def cat(self, path: str) -> str:
+        path = self._normalize(path)
+        return self._call_owner(path, 'cat', path)
+
+    def pread(self, path: str, offset: int, length: int) -> bytes:
+        path = self._normalize(path)
+        return self._call_owner(path, 'pread', path, offset, length)
+
+    def pwrite(self, path: str, offset: int, data: Union[str, bytes]) -> None:
+        path = self._normalize(path)
+        self._call_owner(path, 'pwrite', path, offset, data)
+
+    def truncate(self, path: str, size: int) -> None:
+        path = self._normalize(path)
+        self._call_owner(path, 'truncate', path, size)
+
+    """
+        A batch that is not atomic runs operation by operation through the router.
+        An atomic one is handed to its shard as a whole, so all its paths must live on one shard
+        and it can not use the current directory
+    """
+    def batch(self, operations: List[tuple], atomic=False) -> List[BatchResult]:
+        if not atomic:
+            results = []
+            for operation in operations:
+                try:
+                    if not operation or operation[0] not in BATCH_OPERATIONS:
+                        raise InvalidOperationException('Unsupported batch operation: ' + str(operation))
+
+                    results.append(BatchResult(getattr(self, operation[0])(*operation[1:])))
+                except Exception as e:
+                    results.append(BatchResult(error=e))
+
+            return results
+
+        shards = set()
+        normalized_operations = []
+        for operation in operations:
+            if not operation or operation[0] not in BATCH_OPERATIONS or operation[0] in CURRENT_DIR_OPERATIONS:
+                raise InvalidOperationException('Unsupported atomic batch operation on shards: ' + str(operation))
+
+            path_count = 2 if operation[0] in TWO_PATH_OPERATIONS else 1
+            paths = [self._normalize(path) for path in operation[1:1 + path_count]]
+            shards.update(self._get_shard(path) for path in paths)
+            normalized_operations.append((operation[0],) + tuple(paths) + tuple(operation[1 + path_count:]))
+
+        if len(shards) > 1:
+            raise InvalidOperationException('Atomic batches can not span shards')
+
+        results = self._call(shards.pop() if shards else 0, 'batch', normalized_operations, True)
+
+        # where a move in the batch took the current directory is not known here, the root is
+        if self._current_path != '/' and any(operation[0] in ('move', 'remove') for operation in normalized_operations):
+            if not self._is_directory(self._current_path):
+                self._current_path = '/'
+
+        return results
+
+    def close(self) -> None:
+        for idx, connection in enumerate(self._connections):
+            with self._shard_locks[idx]:
+                try:
+                    connection.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+                connection.close()
+
+        for process in self._processes:
+            process.join()
+
+    def __enter__(self) -> 'ShardedFileSystem':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _transfer(self, from_path: str, to_path: str, is_move: bool) -> None:
+        from_path = self._normalize(from_path).rstrip('/') or '/'
+        to_path = self._normalize(to_path)
+        method_name = 'move' if is_move else 'copy'
+
+        source_name = from_path.rsplit('/', 1)[-1]
+        from_shard = self._get_shard(from_path)
+        follows_move = is_move and self._is_current_path_below(from_path)
+
+        # a target below a top level directory lands on that directory's shard whatever is there,
+        # so the shard resolves it and the router saves a stat round trip. The router only needs to
+        # know where the node ends up to follow a move of the current directory
+        if '/' in to_path.strip('/') and not follows_move:
+            to_shard = self._get_shard(to_path)
+        else:
+            to_parent, to_name = self._get_target(source_name, to_path)
+            if to_parent == '/':
+                # a name in the root lives on its own shard, so a copy's free name is picked here rather than
+                # by the shard. Passing the root itself keeps the source's name (and replaces a directory
+                # with that name on a move, where '/name' would move into it)
+                if not is_move:
+                    to_name = self._get_free_top_level_name(to_name)
+                to_path = '/' if to_name == source_name else '/' + to_name
+                to_shard = self._get_shard('/' + to_name)
+            else:
+                to_shard = self._get_shard(to_parent)
+
+        if from_shard == to_shard:
+            self._call(from_shard, method_name, from_path, to_path)
+        else:
+            tree = self._call(from_shard, 'export_tree', from_path)
+            # a move replaces whatever has the name already, a copy of a name below the root picks
+            # a free name like copy does
+            self._call(to_shard, 'import_tree', to_path, tree, not is_move)
+            if is_move:
+                self._call(from_shard, 'remove', from_path)
+
+        if follows_move:
+            self._follow_move(from_path, ('' if to_parent == '/' else to_parent) + '/' + to_name)
+
+    # (parent, name) a node called source_name gets when moved or copied to to_path, like FileSystem does
+    def _get_target(self, source_name: str, to_path: str) -> Tuple[str, str]:
+        if to_path.endswith('/') or self._is_directory(to_path):
+            return to_path.rstrip('/') or '/', source_name
+
+        parent_path, _, name = to_path.rpartition('/')
+        return parent_path or '/', name
+
+    def _get_free_top_level_name(self, name: str) -> str:
+        if not self._exists('/' + name):
+            return name
+
+        for count in range(1, constant.FILE_NAME_AUTO_INC_MAX):
+            new_name = name + '_' + str(count)
+            if not self._exists('/' + new_name):
+                return new_name
+
+        raise Exception('Naming collision handling exceeded our limit, rejecting')
+
+    def _exists(self, path: str) -> bool:
+        try:
+            self._call_owner(path, 'stat', path)
+        except PathComponentNotFoundException:
+            return False
+        return True
+
+    def _is_directory(self, path: str) -> bool:
+        try:
+            return self._call_owner(path, 'stat', path)['type'] == 'directory'
+        except (PathComponentNotFoundException, InvalidPathComponentException):
+            return False
+
+    def _is_current_path_below(self, path: str) -> bool:
+        current_path = self._current_path
+        return current_path == path or current_path.startswith(path + '/')
+
+    # the current directory moves along with the moved node
+    def _follow_move(self, from_path: str, to_path: str) -> None:
+        if self._is_current_path_below(from_path):
+            self._current_path = to_path + self._current_path[len(from_path):]
+
+    # the current directory is left for the parent of the removed node
+    def _follow_remove(self, path: str) -> None:
+        path = path.rstrip('/')
+        current_path = self._current_path
+        if path and (current_path == path or current_path.startswith(path + '/')):
+            self._current_path = path.rsplit('/', 1)[0] or '/'
+
+    def _normalize(self, path: str) -> str:
+        if not path:
+            raise InvalidPathComponentException('Invalid path')
+
+        return normalize_path(self._current_path, path)
+
+    # the root belongs to every shard, calls on it alone go to shard 0
+    def _get_shard(self, path: str) -> int:
+        top_level_name = path.strip('/').split('/', 1)[0]
+        if not top_level_name:
+            return 0
+
+        return zlib.crc32(top_level_name.encode('utf-8')) % len(self._connections)
+
+    def _call_owner(self, path: str, method_name: str, *args) -> Any:
+        return self._call(self._get_shard(path), method_name, *args)
+
+    def _call(self, shard: int, method_name: str, *args) -> Any:
+        with self._shard_locks[shard]:
+            self._connections[shard].send((method_name, args))
+            return unpack_reply(self._connections[shard].recv())
+
+    # sends to every shard before waiting for any, so the shards work in parallel
+    def _call_all(self, method_name: str, *args) -> List[Any]:
+        for lock in self._shard_locks:
+            lock.acquire()
+
+        try:
+            for connection in self._connections:
+                connection.send((method_name, args))
+
+            replies = [connection.recv() for connection in self._connections]
+        finally:
+            for lock in self._shard_locks:
+                lock.release()
+
+        return [unpack_reply(reply) for reply in replies]
+
+
+def unpack_reply(reply: tuple) -> Any:
+    is_ok, value = reply
+    if not is_ok:
+        raise value
+
+    return value
+
+
+"""
+    Calls that run from a directory other than the root. Shards otherwise always stay in the root,
+    the router passes absolute paths
+"""
+def run_in_dir(fs: FileSystem, path: str, method_name: str, *args) -> Any:
+    fs.change_dir(path)
+    try:
+        return getattr(fs, method_name)(*args)
+    finally:
+        fs.change_dir('/')
+
+
+SHARD_HELPERS = {
+    'find_in': lambda fs, path, name, limit: run_in_dir(fs, path, 'find', name, limit),
+}
+
+
+# worker process main loop, serves requests until the router sends None
+def serve_shard(connection, fs_kwargs: Dict[str, Any]) -> None:
+    fs = FileSystem(**fs_kwargs)
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+
+        if request is None:
+            break
+
+        method_name, args = request
+        try:
+            helper = SHARD_HELPERS.get(method_name)
+            result = helper(fs, *args) if helper is not None else getattr(fs, method_name)(*args)
+            connection.send((True, result))
+        except Exception as e:
+            connection.send((False, e))
+
+    connection.close()
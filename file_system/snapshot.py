@@ -0,0 +1,181 @@
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+from file_system.error import InvalidSnapshotException
+from file_system.file import AbstractFile, ChildLoader, Directory, File, LazyContent
+from file_system.utils import is_directory
+
+
+"""
+    Binary snapshot layout, all integers little endian:
+
+      header      magic, version, node count, name table size, content region size
+      node table  one fixed size record per node in breadth first order, so the children of
+                  a directory are consecutive records: (kind, name offset, name length, a, b)
+                  where (a, b) is (first child, child count) for a directory
+                  and (content offset, content length) for a file
+      aggregates  one (total size, file count, directory count) record per node, the aggregates of
+                  everything below a directory (zeros for a file), so du works before loading it
+      name table  utf-8 names, each distinct name stored once
+      content     file contents, content shared between files (e.g. by copy) stored once
+
+    Loading maps the file and only creates the root; directories create their children and files
+    read their content from the mapping the first time they are accessed
+"""
+
+MAGIC = b'IMFS'
+VERSION = 2
+
+HEADER = struct.Struct('<4sIQQQ')
+NODE = struct.Struct('<BIIQQ')
+AGGREGATES = struct.Struct('<QQQ')
+
+NODE_KIND_DIRECTORY = 0
+NODE_KIND_FILE = 1
+
+
+def save_snapshot(root: Directory, snapshot_path: str, fsync=False) -> None:
+    nodes: List[AbstractFile] = [root]
+    records: List[Tuple[int, int, int, int, int]] = []
+    aggregates: List[Tuple[int, int, int]] = []
+    names = bytearray()
+    name_offsets: Dict[str, int] = {}
+    contents = []
+    content_size = 0
+    content_offsets: Dict[int, int] = {}
+
+    # nodes grows while it is walked, which makes the walk breadth first
+    idx = 0
+    while idx < len(nodes):
+        node = nodes[idx]
+        idx += 1
+
+        name = node.get_name()
+        if name not in name_offsets:
+            name_offsets[name] = len(names)
+            names += name.encode('utf-8')
+        name_length = len(name.encode('utf-8'))
+
+        if is_directory(node):
+            children = node.get_all_children()
+            records.append((NODE_KIND_DIRECTORY, name_offsets[name], name_length, len(nodes), len(children)))
+            aggregates.append(node.get_aggregates())
+            nodes.extend(children)
+        else:
+            content = node.peek_content()
+
+            # immutable content objects are shared between copies, keep a single instance of those
+            content_key = id(content) if isinstance(content, bytes) else None
+            if content_key is None or content_key not in content_offsets:
+                offset = content_size
+                contents.append(content)
+                content_size += len(content)
+                if content_key is not None:
+                    content_offsets[content_key] = offset
+            else:
+                offset = content_offsets[content_key]
+
+            records.append((NODE_KIND_FILE, name_offsets[name], name_length, offset, len(content)))
+            aggregates.append((0, 0, 0))
+
+    # written next to the target and renamed over it, a snapshot that is currently mapped stays intact
+    temp_path = snapshot_path + '.tmp'
+    with open(temp_path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, VERSION, len(records), len(names), content_size))
+        for record in records:
+            snapshot_file.write(NODE.pack(*record))
+        for record in aggregates:
+            snapshot_file.write(AGGREGATES.pack(*record))
+        snapshot_file.write(names)
+        for content in contents:
+            snapshot_file.write(content)
+
+        if fsync:
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+    os.replace(temp_path, snapshot_path)
+
+
+class SnapshotReader(ChildLoader):
+    def __init__(self, snapshot_path: str) -> None:
+        with open(snapshot_path, 'rb') as snapshot_file:
+            try:
+                self._mapping = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidSnapshotException('Empty snapshot file')
+
+        if len(self._mapping) < HEADER.size:
+            raise InvalidSnapshotException('Snapshot file is truncated')
+
+        magic, version, node_count, names_size, content_size = HEADER.unpack_from(self._mapping, 0)
+        if magic != MAGIC:
+            raise InvalidSnapshotException('Not a file system snapshot')
+        if version != VERSION:
+            raise InvalidSnapshotException('Unsupported snapshot version ' + str(version))
+
+        self._node_count: int = node_count
+        self._aggregates_offset: int = HEADER.size + node_count * NODE.size
+        self._names_offset: int = self._aggregates_offset + node_count * AGGREGATES.size
+        self._content_offset: int = self._names_offset + names_size
+
+        if len(self._mapping) < self._content_offset + content_size:
+            raise InvalidSnapshotException('Snapshot file is truncated')
+
+        # directories can be loaded by concurrent readers
+        self._lock = threading.Lock()
+
+        # node index of every directory whose children are not created yet
+        self._directory_nodes: Dict[Directory, int] = {}
+
+    def make_root(self) -> Directory:
+        root = Directory('', None)
+        self._set_lazy(root, 0)
+        return root
+
+    def load_children(self, directory: Directory) -> None:
+        with self._lock:
+            if directory.is_loaded():
+                return
+
+            _, _, _, first_child, child_count = NODE.unpack_from(self._mapping, HEADER.size + self._directory_nodes.pop(directory) * NODE.size)
+
+            for node_index in range(first_child, first_child + child_count):
+                kind, name_offset, name_length, a, b = NODE.unpack_from(self._mapping, HEADER.size + node_index * NODE.size)
+                name = self._read_name(name_offset, name_length)
+
+                if kind == NODE_KIND_DIRECTORY:
+                    child = Directory(name, directory)
+                    self._set_lazy(child, node_index)
+                else:
+                    child = File(name, directory)
+                    child.set_lazy_content(SnapshotContent(self._mapping, self._content_offset + a, b))
+
+                directory.children[name] = child
+
+            directory.set_child_loader(None)
+
+    def _set_lazy(self, directory: Directory, node_index: int) -> None:
+        directory.set_aggregates(*AGGREGATES.unpack_from(self._mapping, self._aggregates_offset + node_index * AGGREGATES.size))
+        self._directory_nodes[directory] = node_index
+        directory.set_child_loader(self)
+
+    def _read_name(self, offset: int, length: int) -> str:
+        start = self._names_offset + offset
+        return self._mapping[start:start + length].decode('utf-8')
+
+
+class SnapshotContent(LazyContent):
+    def __init__(self, mapping: mmap.mmap, offset: int, length: int) -> None:
+        self._mapping: mmap.mmap = mapping
+        self._offset: int = offset
+        self._length: int = length
+
+    def load(self) -> bytes:
+        return self._mapping[self._offset:self._offset + self._length]
+
+    def get_size(self) -> int:
+        return self._length
@@ -0,0 +1,72 @@
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+
+# names per chunk. A chunk is split once it holds twice as many
+CHUNK_SIZE = 1024
+
+
+"""
+    Sorted list of names stored as a list of sorted chunks, with the last name of every chunk kept
+    in a separate list. A name is found by bisecting that list and then its chunk, so add, remove
+    and finding where to start iterating cost O(log n) plus moving at most 2 * CHUNK_SIZE
+    references, unlike one flat sorted list where an insert moves half of all names
+"""
+class SortedNameList:
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        names = sorted(names)
+        self._chunks: List[List[str]] = [names[idx:idx + CHUNK_SIZE] for idx in range(0, len(names), CHUNK_SIZE)]
+        self._maxes: List[str] = [chunk[-1] for chunk in self._chunks]
+        self._len: int = len(names)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, name: str) -> None:
+        self._len += 1
+
+        if not self._chunks:
+            self._chunks.append([name])
+            self._maxes.append(name)
+            return
+
+        idx = bisect_left(self._maxes, name)
+        if idx == len(self._chunks):
+            # past every name, goes at the end of the last chunk
+            idx -= 1
+            self._chunks[idx].append(name)
+            self._maxes[idx] = name
+        else:
+            insort(self._chunks[idx], name)
+
+        chunk = self._chunks[idx]
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[idx:idx + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._maxes[idx:idx + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+
+    # name must be in the list
+    def remove(self, name: str) -> None:
+        idx = bisect_left(self._maxes, name)
+        chunk = self._chunks[idx]
+        del chunk[bisect_left(chunk, name)]
+        self._len -= 1
+
+        if not chunk:
+            del self._chunks[idx]
+            del self._maxes[idx]
+        else:
+            self._maxes[idx] = chunk[-1]
+
+    # names from name on in order, or only the ones after it when inclusive is false
+    def iterate_from(self, name: str, inclusive: bool = True) -> Iterator[str]:
+        find = bisect_left if inclusive else bisect_right
+
+        idx = find(self._maxes, name)
+        if idx == len(self._chunks):
+            return
+
+        chunk = self._chunks[idx]
+        yield from islice(chunk, find(chunk, name), None)
+        for idx in range(idx + 1, len(self._chunks)):
+            yield from self._chunks[idx]
@@ -0,0 +1,240 @@
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set, Union
+
+from file_system.blob_store import Blob, BlobStore
+from file_system.file import File, LazyContent
+
+
+# the spill file is compacted once it holds more dead bytes than this and than live ones
+COMPACT_MIN_GARBAGE = 64 * 1024 * 1024
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+"""
+    Append only file on the host file system holding spilled contents, deleted when closed.
+    Space of contents that are no longer referenced is reclaimed by copying the live ones
+    to a new file once it makes up most of the file. A removed file's content stays live while
+    anything still holds the node (an open handle, a stale path cache entry)
+"""
+class SpillFile:
+    def __init__(self, spill_dir: Optional[str]) -> None:
+        self._spill_dir: Optional[str] = spill_dir
+        self._file = tempfile.TemporaryFile(dir=spill_dir)
+        self._size: int = 0
+        self._live_bytes: int = 0
+        self._live: 'weakref.WeakSet[SpilledContent]' = weakref.WeakSet()
+
+        self.compactions: int = 0
+
+    def write(self, data: Union[bytes, bytearray, memoryview]) -> int:
+        if self._size - self._live_bytes > max(COMPACT_MIN_GARBAGE, self._live_bytes):
+            self._compact()
+
+        offset = self._size
+        os.pwrite(self._file.fileno(), data, offset)
+        self._size += len(data)
+        self._live_bytes += len(data)
+        return offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self._file.fileno(), length, offset)
+
+    def add_live(self, content: 'SpilledContent') -> None:
+        self._live.add(content)
+
+    def free(self, length: int) -> None:
+        self._live_bytes -= length
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_live_bytes(self) -> int:
+        return self._live_bytes
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _compact(self) -> None:
+        new_file = tempfile.TemporaryFile(dir=self._spill_dir)
+        new_size = 0
+        for content in list(self._live):
+            for chunk_offset in range(0, content.get_size(), COPY_CHUNK_SIZE):
+                chunk = self.read(content.offset + chunk_offset, min(COPY_CHUNK_SIZE, content.get_size() - chunk_offset))
+                os.pwrite(new_file.fileno(), chunk, new_size + chunk_offset)
+            content.offset = new_size
+            new_size += content.get_size()
+
+        self._file.close()
+        self._file = new_file
+        self._size = new_size
+        self.compactions += 1
+
+
+"""
+    Content of a file that was spilled to disk, read back the first time it is needed.
+    Deduplicated content is interned again when it is paged back in, so the file shares it with
+    its duplicates again
+"""
+class SpilledContent(LazyContent):
+    def __init__(self, spill: 'ContentSpill', offset: int, length: int, deduplicated=False) -> None:
+        self.offset: int = offset
+        self._length: int = length
+        self._spill: 'ContentSpill' = spill
+        self.deduplicated: bool = deduplicated
+        # the reference taken for the file when it is paged in, readers doing so at the same time share it
+        self.blob: Optional[Blob] = None
+
+    def load(self) -> bytes:
+        return self._spill.read(self)
+
+    def get_size(self) -> int:
+        return self._length
+
+    def keep(self, data: bytes) -> Union[bytes, Blob]:
+        return self._spill.intern(self, data) if self.deduplicated else data
+
+    # the file dropped this content, by paging it back in or replacing it
+    def __del__(self) -> None:
+        self._spill.free(self)
+
+
+"""
+    Keeps the contents held in memory within a budget. File system calls report every file whose
+    content they touched, in least recently used order; when the contents held in memory add up to
+    more than the budget, the least recently used ones are written to a spill file and replaced by
+    a SpilledContent, which reads them back transparently the next time they are accessed.
+    Directories and contents below min_size always stay in memory.
+
+    Sizes are counted per file, so content shared between files (copies, deduplicated writes) is
+    counted once per file and only leaves memory when every file holding it was spilled.
+    Thread safe, reads under the file system's read lock may fault contents in and spill others
+"""
+class ContentSpill:
+    def __init__(self, budget: int, spill_dir: Optional[str] = None, min_size: int = 0, blob_store: Optional[BlobStore] = None) -> None:
+        self._budget: int = budget
+        self._min_size: int = min_size
+        # deduplicated contents give their blob reference back when spilled and take one again when paged in
+        self._blob_store: Optional[BlobStore] = blob_store
+        self._spill_file: SpillFile = SpillFile(spill_dir)
+        self._lock = threading.RLock()
+
+        # file -> content size, least recently used first
+        self._resident: 'OrderedDict[File, int]' = OrderedDict()
+        self._resident_bytes: int = 0
+        # files this spill wrote out, until they are accessed again
+        self._spilled: Set[File] = set()
+        # files being written (with the number of writers), never spilled meanwhile
+        self._pinned: Dict[File, int] = {}
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._spills: int = 0
+        self._spill_reads: int = 0
+
+    """
+        file's content was just accessed (and may have been paged in or resized by it).
+        Moves it to the most recently used end and spills others if the budget is exceeded
+    """
+    def touch(self, file: File) -> None:
+        with self._lock:
+            if file in self._spilled:
+                # spilled again since it was accessed, by files touched in between (e.g. the rest of a copy)
+                if not file.is_content_loaded():
+                    return
+
+                self._spilled.discard(file)
+                self._misses += 1
+            elif file in self._resident:
+                self._hits += 1
+
+            self._resident_bytes -= self._resident.pop(file, 0)
+            if file.is_content_loaded() and file.get_size() >= self._min_size:
+                self._resident[file] = file.get_size()
+                self._resident_bytes += file.get_size()
+
+            self._spill_over_budget(file)
+
+    """
+        Keeps file's content in memory while it is changed. Touches of other threads (writers of
+        separate subtrees run side by side) would otherwise spill it halfway through the change
+    """
+    @contextmanager
+    def pinned(self, file: File) -> Iterator[None]:
+        with self._lock:
+            self._pinned[file] = self._pinned.get(file, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._pinned[file] == 1:
+                    del self._pinned[file]
+                else:
+                    self._pinned[file] -= 1
+
+    # for files leaving the tree
+    def forget(self, file: File) -> None:
+        with self._lock:
+            self._resident_bytes -= self._resident.pop(file, 0)
+            self._spilled.discard(file)
+
+    def read(self, content: SpilledContent) -> bytes:
+        with self._lock:
+            self._spill_reads += 1
+            return self._spill_file.read(content.offset, content.get_size())
+
+    def intern(self, content: SpilledContent, data: bytes) -> Blob:
+        with self._lock:
+            if content.blob is None:
+                content.blob = self._blob_store.intern(data)
+            return content.blob
+
+    def free(self, content: SpilledContent) -> None:
+        with self._lock:
+            self._spill_file.free(content.get_size())
+
+    def close(self) -> None:
+        with self._lock:
+            self._spill_file.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'budget': self._budget,
+                'resident_files': len(self._resident),
+                'resident_bytes': self._resident_bytes,
+                'spilled_files': len(self._spilled),
+                'spill_file_bytes': self._spill_file.get_size(),
+                'spill_live_bytes': self._spill_file.get_live_bytes(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'spills': self._spills,
+                'spill_reads': self._spill_reads,
+                'compactions': self._spill_file.compactions,
+            }
+
+    # the file just touched and the pinned ones stay, even if they are larger than the budget on their own
+    def _spill_over_budget(self, touched_file: File) -> None:
+        kept = 0
+        while self._resident_bytes > self._budget and len(self._resident) > max(kept, 1):
+            file, size = next(iter(self._resident.items()))
+            if file is touched_file or file in self._pinned:
+                self._resident.move_to_end(file)
+                kept += 1
+                continue
+
+            del self._resident[file]
+            self._resident_bytes -= size
+
+            if file.is_content_loaded():
+                offset = self._spill_file.write(file.get_content_buffer())
+                content = SpilledContent(self, offset, file.get_size(), file.get_content_blob() is not None)
+                self._spill_file.add_live(content)
+                file.set_lazy_content(content)
+                self._spilled.add(file)
+                self._spills += 1
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Callable, Iterator, Optional, Tuple
 
 from file_system.file import AbstractFile, Directory, File
 
@@ -12,6 +12,42 @@ def is_file(file: AbstractFile) -> bool:
 
 def join_path(path1: str, path2: str) -> str:
     return path1 + '/' + path2
+
+# like join_path, but '' stands for the current directory and '/' for the root
+def glob_join(path: str, name: str) -> str:
+    if not path:
+        return name
+    return path + name if path.endswith('/') else join_path(path, name)
+
+def has_glob_magic(name: str) -> bool:
+    return '*' in name or '?' in name or '[' in name
+
+# whether file is strictly below directory, walking up file's parents
+def is_below(file: AbstractFile, directory: AbstractFile) -> bool:
+    cur_file = file
+    while cur_file.get_parent() is not cur_file:
+        cur_file = cur_file.get_parent()
+        if cur_file is directory:
+            return True
+    return False
+
+
+"""
+  yield file and every node below it, depth first. Directories skip returns true for are
+  yielded but not entered (e.g. ones whose children are not created yet)
+"""
+def iterate_subtree(file: AbstractFile, skip: Optional[Callable[[Directory], bool]] = None) -> Iterator[AbstractFile]:
+    stack = [file]
+    while stack:
+        this_file = stack.pop()
+        yield this_file
+
+        if is_directory(this_file) and (skip is None or not skip(this_file)):
+            stack.extend(this_file.get_all_children())
+
+# for iterate_subtree, skips what was not loaded yet
+def is_not_loaded(directory: Directory) -> bool:
+    return not directory.is_loaded()
     
 
 """
@@ -43,19 +79,53 @@ def parse_path(path: str) -> Tuple[str, str]:
     return (path_str, file_name)
 
 
+"""
+  make path absolute against current_path and resolve '.', '..' and repeated '/' lexically.
+  A path naming a directory ('a/b/', 'a/..') keeps a trailing '/', since parse_path
+  (and so move and copy) treats those differently from 'a/b'
+"""
+def normalize_path(current_path: str, path: str) -> str:
+    if not path.startswith('/'):
+        path = current_path + '/' + path
+
+    components = []
+    for comp in path.split('/'):
+        if comp == '..':
+            if components:
+                components.pop()
+        elif comp and comp != '.':
+            components.append(comp)
+
+    if not components:
+        return '/'
+
+    normalized = '/' + '/'.join(components)
+    last_component = path.rsplit('/', 1)[-1]
+    if last_component == '' or last_component in constant.RESERVED_FILE_NAMES:
+        normalized += '/'
+
+    return normalized
+
+
 """
   auto handle naming collision by adding a auto incremented count at the end
   'file_name_1', 'file_name_2' etc
+  the directory remembers where the last search for a base name stopped, so repeated collisions
+  do not probe all the taken suffixes again. Removing a 'name_<n>' entry moves the hint back,
+  so the lowest free suffix is still the one picked
 """
 def get_valid_name_before_adding_to_dir(name: str, target_dir: Directory) -> str:
     if not target_dir.has_child(name):
         return name
     
-    count = 1
-    format_str = name + '_{}'
+    count = target_dir.get_name_suffix_hint(name)
+    prefix = name + '_'
     while count < constant.FILE_NAME_AUTO_INC_MAX:
-        new_name = format_str.format(count)
+        new_name = prefix + str(count)
         if not target_dir.has_child(new_name):
+            # every suffix below count is taken. count itself is left to be probed again
+            # in case the caller ends up not using the name
+            target_dir.set_name_suffix_hint(name, count)
             return new_name
         
         count += 1
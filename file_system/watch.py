@@ -0,0 +1,120 @@
+import threading
+from typing import Iterator, List, Optional, Set
+
+from file_system.error import InvalidOperationException
+from file_system.file import AbstractFile
+
+CREATE = 'create'
+WRITE = 'write'
+MOVE = 'move'
+REMOVE = 'remove'
+# events were dropped because the queue was full, the watched tree has to be looked at again
+OVERFLOW = 'overflow'
+
+
+"""
+    One change seen by a watcher. path is the absolute path of the node after the change
+    (where it was, for a remove), old_path where a moved node came from
+"""
+class Event:
+    __slots__ = ('kind', 'path', 'old_path', 'is_dir')
+
+    def __init__(self, kind: str, path: Optional[str], old_path: Optional[str] = None, is_dir: bool = False) -> None:
+        self.kind: str = kind
+        self.path: Optional[str] = path
+        self.old_path: Optional[str] = old_path
+        self.is_dir: bool = is_dir
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Event) and (self.kind, self.path, self.old_path, self.is_dir) == \
+            (other.kind, other.path, other.old_path, other.is_dir)
+
+    def __repr__(self) -> str:
+        if self.old_path is not None:
+            return 'Event({}, {} -> {})'.format(self.kind, self.old_path, self.path)
+        return 'Event({}, {})'.format(self.kind, self.path)
+
+
+"""
+    Returned by FileSystem.watch. Events queue up as mutations happen and are taken as one batch by
+    get_events, which waits for the first one. Writes to a file coalesce with its write event that is
+    still queued unless a create, move or remove came in between, so a file written a thousand times
+    between two reads is one event. The queue holds at most max_events: when it is full it is dropped
+    and replaced by a single OVERFLOW event. Events are queued from the mutating thread, the watcher
+    can be read from any other thread
+"""
+class Watcher:
+    def __init__(self, fs, node: AbstractFile, recursive: bool, max_events: int) -> None:
+        self._fs = fs
+        self.node: AbstractFile = node
+        self.recursive: bool = recursive
+        self._max_events: int = max_events
+        self._condition = threading.Condition()
+
+        self._events: List[Event] = []
+        # paths with a write event in _events that nothing else came after
+        self._pending_writes: Set[str] = set()
+
+        self.overflows: int = 0
+        self.closed: bool = False
+
+    def add(self, event: Event) -> None:
+        with self._condition:
+            if event.kind == WRITE:
+                if event.path in self._pending_writes:
+                    return
+            else:
+                self._pending_writes.clear()
+
+            if len(self._events) >= self._max_events:
+                self._events = [Event(OVERFLOW, None)]
+                self._pending_writes.clear()
+                self.overflows += 1
+
+            self._events.append(event)
+            if event.kind == WRITE:
+                self._pending_writes.add(event.path)
+            self._condition.notify_all()
+
+    """
+        Takes every queued event, waiting up to timeout seconds (forever for None) for one to arrive.
+        Returns [] on timeout or once the watcher is closed
+    """
+    def get_events(self, timeout: Optional[float] = None) -> List[Event]:
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self.closed, timeout)
+
+            events = self._events
+            self._events = []
+            self._pending_writes.clear()
+            return events
+
+    # queued events without waiting
+    def poll(self) -> List[Event]:
+        return self.get_events(0)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self._fs._unwatch(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    # batches until the watcher is closed
+    def __iter__(self) -> Iterator[List[Event]]:
+        while True:
+            events = self.get_events()
+            if not events:
+                return
+
+            yield events
+
+    def __enter__(self) -> 'Watcher':
+        if self.closed:
+            raise InvalidOperationException('Watcher is closed')
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
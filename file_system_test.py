@@ -1,9 +1,26 @@
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
+from file_system.async_file_system import AsyncFileSystem
+from file_system.client import FileSystemClient
+from file_system.content_index import get_required_literals
 from file_system.file_system import FileSystem
+from file_system.journal import Journal, FSYNC_NEVER
+from file_system.metrics import Hook
+from file_system.protocol import encode_frame, pop_frames
+from file_system.server import FileSystemServer
+from file_system.sharding import ShardedFileSystem
 from file_system.file import Directory
-from file_system.utils import parse_path, is_directory, is_file
+from file_system.utils import parse_path, is_directory, is_file, iterate_subtree
+from file_system.watch import CREATE, MOVE, OVERFLOW, REMOVE, WRITE, Event
 import file_system.error as error
+import file_system.spill as spill
 
 class FileSystemTest(unittest.TestCase):
     
@@ -35,6 +52,14 @@ class FileSystemTest(unittest.TestCase):
         # ..
         fs.make_new_dir('1/../new_dir_2')
         self.assertEqual(len(root_dir.get_all_children()), 7)
+
+        # a path ending in a directory does not name a file, and nothing is created for it
+        for path in ('new_dir_3/', '/', '.', '1/..'):
+            with self.assertRaises(error.InvalidPathComponentException):
+                fs.make_new_file(path)
+        self.assertEqual(len(root_dir.get_all_children()), 7)
+        fs.make_new_dir('new_dir_3/')
+        self.assertEqual(len(root_dir.get_all_children()), 8)
     
     def test_change_dir(self) -> None:
         fs = self._create_test_data()
@@ -130,6 +155,132 @@ class FileSystemTest(unittest.TestCase):
         ): 
             fs._get_file_object_from_path('1.1/file1/..')
     
+    def test_offset_read_write(self) -> None:
+        fs = self._create_test_data()
+        fs.write('2', 'hello world')
+
+        self.assertEqual(fs.pread('2', 6, 5), b'world')
+        self.assertEqual(fs.pread('2', 6, 100), b'world')
+        self.assertEqual(fs.pread('2', 100, 5), b'')
+
+        fs.pwrite('2', 0, 'HELLO')
+        self.assertEqual(fs.cat('2'), 'HELLO world')
+
+        # writing past the end zero fills the gap
+        fs.pwrite('2', 13, b'!')
+        self.assertEqual(fs.pread('2', 11, 3), b'\x00\x00!')
+
+        fs.truncate('2', 5)
+        self.assertEqual(fs.cat('2'), 'HELLO')
+        fs.truncate('2', 7)
+        self.assertEqual(fs.pread('2', 0, 10), b'HELLO\x00\x00')
+
+        fs.write('2', 'ab')
+        fs.write('2', b'cd', True)
+        self.assertEqual(fs.cat('2'), 'abcd')
+
+        with self.assertRaises(error.InvalidOperationException):
+            fs.pread('2', -1, 1)
+        with self.assertRaises(error.InvalidOperationException):
+            fs.truncate('2', -1)
+        with self.assertRaises(error.InvalidPathComponentException):
+            fs.pwrite('1', 0, 'a')
+
+    def test_file_handle(self) -> None:
+        fs = self._create_test_data()
+        fs.write('2', 'line 1\nline 2\nline 3')
+
+        with fs.open('2') as handle:
+            chunk = handle.read(4)
+            self.assertIsInstance(chunk, memoryview)
+            self.assertEqual(chunk, b'line')
+            self.assertEqual(handle.tell(), 4)
+            self.assertEqual(bytes(handle.readline()), b' 1\n')
+            self.assertEqual([bytes(line) for line in handle], [b'line 2\n', b'line 3'])
+
+            handle.seek(-6, 2)
+            buffer = bytearray(10)
+            self.assertEqual(handle.readinto(buffer), 6)
+            self.assertEqual(buffer[:6], b'line 3')
+
+            with self.assertRaises(error.InvalidOperationException):
+                handle.write('x')
+        with self.assertRaises(error.InvalidOperationException):
+            handle.read()
+
+        # a view keeps showing the content it was read from
+        handle = fs.open('2', 'r+')
+        view = handle.read(4)
+        handle.seek(0)
+        handle.write('LINE')
+        self.assertEqual(view, b'line')
+        self.assertEqual(fs.cat('2'), 'LINE 1\nline 2\nline 3')
+
+        # the handle follows the file when it is moved
+        fs.move('2', '1/moved')
+        handle.seek(0, 2)
+        handle.write('!')
+        self.assertEqual(fs.cat('1/moved'), 'LINE 1\nline 2\nline 3!')
+
+        with fs.open('1/new/file', 'w') as handle:
+            handle.write(b'ab')
+            handle.write('cd')
+            with self.assertRaises(error.InvalidOperationException):
+                handle.read()
+        with fs.open('1/new/file', 'a+') as handle:
+            handle.write('ef')
+            handle.seek(0)
+            self.assertEqual(handle.read(), b'abcdef')
+        with fs.open('1/new/file', 'w+') as handle:
+            self.assertEqual(handle.read(), b'')
+
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.open('missing')
+        with self.assertRaises(error.InvalidOperationException):
+            fs.open('3', 'rw')
+
+        # reads after writes hand out the stored bytes, a write only copies them while a view is alive
+        file = fs._get_file_object_from_path('1/new/file')
+        with fs.open('1/new/file', 'a+') as handle:
+            handle.write('log')
+            stored = file.get_content_buffer()
+            handle.seek(0)
+            chunk = handle.read()
+            self.assertIs(chunk.obj, stored)
+            handle.write('more')
+            self.assertEqual(chunk, b'log')
+            self.assertIsNot(file.get_content_buffer(), stored)
+
+            del chunk
+            stored = file.get_content_buffer()
+            handle.seek(0)
+            self.assertEqual(bytes(handle.read()), b'logmore')
+            handle.write('!')
+            self.assertIs(file.get_content_buffer(), stored)
+
+        # read only opens take the read lock (a write lock can not be taken while holding it)
+        fs = FileSystem(thread_safe=True)
+        fs.make_new_file('/f')
+        with fs._lock.read_locked():
+            with fs.open('/f', 'r+') as handle:
+                self.assertEqual(bytes(handle.read()), b'')
+            with self.assertRaises(error.InvalidOperationException):
+                fs.open('/f', 'a')
+
+        # appends through separate handles pick their offset under the write lock, none overwrites another
+        handles = [fs.open('/f', 'a') for _ in range(4)]
+        threads = [threading.Thread(target=handle.write, args=(str(idx) * 10,)) for idx, handle in enumerate(handles)]
+        with fs._lock.write_locked():
+            for thread in threads:
+                thread.start()
+            # every writer is waiting for the lock by now
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(fs.cat('/f')), sorted('0123' * 10))
+        # each handle is left right after its own data
+        self.assertEqual(sorted(handle.tell() for handle in handles), [10, 20, 30, 40])
+
     def test_copy(self) -> None:
         fs = self._create_test_data()
         
@@ -163,6 +314,211 @@ class FileSystemTest(unittest.TestCase):
             self._are_files_equal_in_dir(fs._current_dir, dir_1.get_child('1.1').get_child('1.1.1')),
         )
     
+    def test_copy_shares_content_until_written(self) -> None:
+        fs = self._create_test_data()
+        fs.write('1/1.1/file1', 'abcde')
+
+        fs.copy('1', 'new_1')
+        source = fs._get_file_object_from_path('1/1.1/file1')
+        copy = fs._get_file_object_from_path('new_1/1.1/file1')
+        self.assertIs(source._data, copy._data)
+
+        fs.write('new_1/1.1/file1', 'xyz', True)
+        self.assertEqual(fs.cat('new_1/1.1/file1'), 'abcdexyz')
+        self.assertEqual(fs.cat('1/1.1/file1'), 'abcde')
+
+        # copying a directory into itself copies the tree as it was before the copy
+        fs.copy('1', '1/1.2')
+        self.assertEqual(fs.find('file3'), [
+            './1/1.1/1.1.1/file3',
+            './1/1.2/1/1.1/1.1.1/file3',
+            './new_1/1.1/1.1.1/file3',
+        ])
+        self.assertEqual(fs._get_file_object_from_path('1/1.2/1/1.2').get_all_children()[0].get_name(), 'file1')
+        self.assertEqual(len(fs._get_file_object_from_path('1/1.2/1/1.2').get_all_children()), 1)
+
+    def test_copy_makes_nodes_when_needed(self) -> None:
+        fs = FileSystem(content_index=True)
+        for i in range(100):
+            fs.make_new_file('/src/d{}/f{}'.format(i % 10, i))
+            fs.write('/src/d{}/f{}'.format(i % 10, i), 'content {}'.format(i))
+
+        # one node, the rest is made from the source when needed
+        fs.copy('/src', '/dst')
+        dst = fs._get_file_object_from_path('/dst')
+        self.assertFalse(dst.is_loaded())
+        self.assertEqual(fs.du('/dst'), fs.du('/src'))
+        self.assertEqual(fs.stat('/dst')['files'], 100)
+        self.assertEqual(fs.find('f42'), ['./dst/d2/f42', './src/d2/f42'])
+        self.assertEqual(fs.grep('content 42'), ['./dst/d2/f42', './src/d2/f42'])
+        self.assertFalse(dst.is_loaded())
+        # resolving a path makes the nodes on it
+        self.assertEqual(fs.grep('content 4\\d', '/dst/d3'), ['/dst/d3/f43'])
+        self.assertTrue(dst.is_loaded())
+        self.assertFalse(dst.get_child('d3').is_loaded())
+
+        # changing the source first makes the copy's nodes on the way, the siblings stay pending
+        fs.write('/src/d1/f1', 'changed')
+        self.assertTrue(dst.get_child('d1').is_loaded())
+        self.assertFalse(dst.get_child('d2').is_loaded())
+        self.assertEqual(fs.cat('/dst/d1/f1'), 'content 1')
+        fs.move('/src/d2', '/moved')
+        fs.remove('/src/d3/f3')
+        fs.make_new_file('/src/d4/new')
+        self.assertFalse(dst.get_child('d2').is_loaded())
+        self.assertEqual(fs.cat('/dst/d2/f2'), 'content 2')
+        self.assertEqual(fs.cat('/dst/d3/f3'), 'content 3')
+        self.assertEqual(sorted(fs.ls('/dst/d4')), ['f14', 'f24', 'f34', 'f4', 'f44', 'f54', 'f64', 'f74', 'f84', 'f94'])
+
+        # a copy of a pending copy reads the same source, a removed source is made into its copies first
+        fs.copy('/dst/d5', '/dst_d5')
+        fs.remove('/src')
+        self.assertEqual(fs.cat('/dst_d5/f95'), 'content 95')
+        self.assertEqual(fs.find('f95'), ['./dst/d5/f95', './dst_d5/f95'])
+        fs.write('/dst/d5/f95', 'x', True)
+        self.assertEqual(fs.cat('/dst/d5/f95'), 'content 95x')
+        self.assertEqual(fs.cat('/dst_d5/f95'), 'content 95')
+        self.assertEqual(fs.stat('/')['files'], 100 + 10 + 10)
+        self.assertEqual(fs._copy_loader._copies, {})
+
+        # a rolled back batch leaves no pending copy behind
+        fs.copy('/dst', '/again')
+        results = fs.batch([('copy', '/again', '/batch_copy'), ('cat', '/batch_copy/d6/f6'), ('cat', 'missing')], atomic=True)
+        self.assertEqual(results[1].value, 'content 6')
+        self.assertNotIn('batch_copy', fs.ls('/'))
+        self.assertEqual(fs.find('f6'), ['./again/d6/f6', './dst/d6/f6'])
+        self.assertEqual(list(fs._copy_loader._sources.values()), [fs._get_file_object_from_path('/dst')])
+
+    def test_copy_matches_copying_every_node(self) -> None:
+        rng = random.Random(7)
+        fs = FileSystem(content_index=True)
+        expected = FileSystem(dedup_content=False)
+        for name in ('a', 'b', 'c'):
+            for fs_ in (fs, expected):
+                fs_.make_new_file('/{}/x/file'.format(name))
+                fs_.write('/{}/x/file'.format(name), name)
+
+        for step in range(400):
+            nodes = [
+                (dir_path.rstrip('/') + '/' + name, name in dir_names)
+                for dir_path, dir_names, file_names in expected.walk('/')
+                for name in dir_names + file_names
+            ]
+            path, is_dir = rng.choice(nodes)
+            directories = ['/'] + [node_path for node_path, node_is_dir in nodes if node_is_dir]
+            target = rng.choice(directories).rstrip('/') + '/n{}'.format(step)
+            operation = rng.randrange(6)
+
+            if operation == 0 and is_dir and len(nodes) < 300:
+                fs.copy(path, target)
+                expected.import_tree(target, expected.export_tree(path))
+            elif operation == 1 and not is_dir:
+                append = rng.random() < 0.5
+                for fs_ in (fs, expected):
+                    fs_.write(path, str(step), append)
+            elif operation == 2 and not target.startswith(path + '/'):
+                for fs_ in (fs, expected):
+                    fs_.move(path, target)
+            elif operation == 3 and len(nodes) > 10:
+                for fs_ in (fs, expected):
+                    fs_.remove(path)
+            elif operation == 4:
+                for fs_ in (fs, expected):
+                    fs_.make_new_file(target + '/file')
+            else:
+                name = path.rpartition('/')[2]
+                self.assertEqual(fs.find(name), expected.find(name))
+                self.assertEqual(fs.grep(str(step - 1)), expected.grep(str(step - 1)))
+                self.assertEqual(fs.du(path), expected.du(path))
+                self.assertEqual(fs.stat('/'), expected.stat('/'))
+
+        self.assertEqual(fs.export_tree('/'), expected.export_tree('/'))
+
+    def test_copy_collision_names(self) -> None:
+        fs = FileSystem()
+        fs.make_new_file('/a')
+        for _ in range(5):
+            fs.copy('/a', '/a')
+        self.assertEqual(sorted(fs.ls()), ['a', 'a_1', 'a_2', 'a_3', 'a_4', 'a_5'])
+
+        # freed suffixes are reused lowest first, like the plain linear probe
+        fs.remove('/a_4')
+        fs.remove('/a_2')
+        fs.copy('/a', '/a')
+        fs.copy('/a', '/a')
+        fs.copy('/a', '/a')
+        self.assertEqual(sorted(fs.ls()), ['a', 'a_1', 'a_2', 'a_3', 'a_4', 'a_5', 'a_6'])
+
+        # names taken by hand are skipped
+        fs.make_new_file('/a_7')
+        fs.copy('/a', '/a')
+        self.assertEqual(sorted(fs.ls())[-2:], ['a_7', 'a_8'])
+
+        fs.move('/a_1', '/b')
+        fs.copy('/a', '/a')
+        self.assertTrue(fs._root.has_child('a_1'))
+
+        # suffixes that are digits to isdigit but not to int leave the tree consistent
+        fs.make_new_file('/a_\u00b2')
+        fs.remove('/a_\u00b2')
+        self.assertFalse(fs._root.has_child('a_\u00b2'))
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.cat('/a_\u00b2')
+        self.assertEqual(fs.find('a_\u00b2'), [])
+
+    def test_content_dedup(self) -> None:
+        fs = self._create_test_data()
+        fs.write('2', 'template')
+        fs.write('3', 'template')
+        fs.write('4', 'other')
+        self.assertIs(fs._get_file_object_from_path('2')._data, fs._get_file_object_from_path('3')._data)
+
+        stats = fs.get_blob_store_stats()
+        self.assertEqual((stats['blobs'], stats['references'], stats['stored_bytes']), (2, 3, 13))
+
+        # copies only take another reference, including files that were appended to.
+        # The four files under 1 hold 'log' and three empty contents
+        fs.write('1/1.1/file1', 'log', True)
+        fs.copy('1', 'copy_of_1')
+        fs.copy('2', 'copy_of_2')
+        # the nodes of a copied directory, and their references, are made when first needed
+        self.assertEqual(fs.get_blob_store_stats()['references'], 4)
+        list(fs.walk('copy_of_1'))
+        stats = fs.get_blob_store_stats()
+        self.assertEqual((stats['blobs'], stats['references']), (4, 12))
+        self.assertEqual(stats['referenced_bytes'], 8 * 3 + 5 + 3 * 2)
+
+        # changing a file gives its reference back
+        fs.write('copy_of_2', 'template', True)
+        fs.write('4', 'template')
+        stats = fs.get_blob_store_stats()
+        self.assertEqual((stats['blobs'], stats['references']), (3, 11))
+        self.assertEqual(fs.cat('2'), 'template')
+        self.assertEqual(fs.cat('copy_of_2'), 'templatetemplate')
+
+        # the last reference going away frees the blob
+        fs.remove('copy_of_1')
+        fs.remove('1')
+        stats = fs.get_blob_store_stats()
+        self.assertEqual((stats['blobs'], stats['references']), (1, 3))
+        self.assertAlmostEqual(stats['dedup_ratio'], 3.0)
+
+        fs.make_new_file('2')
+        fs.remove('3')
+        fs.remove('4')
+        self.assertEqual(fs.get_blob_store_stats()['blobs'], 0)
+
+        # a rolled back batch leaves the references as they were
+        fs.write('2', 'x')
+        fs.copy('2', '3')
+        before = fs.get_blob_store_stats()
+        fs.batch([('write', '2', 'y'), ('remove', '3'), ('copy', '2', '4'), ('cat', 'missing')], atomic=True)
+        self.assertEqual(fs.get_blob_store_stats()['references'], before['references'])
+        self.assertEqual(fs.get_blob_store_stats()['blobs'], before['blobs'])
+        self.assertEqual(fs.cat('3'), 'x')
+
+        self.assertEqual(FileSystem(dedup_content=False).get_blob_store_stats(), {})
+
     def test_move(self) -> None:
         fs = self._create_test_data()
  
@@ -182,13 +538,926 @@ class FileSystemTest(unittest.TestCase):
 
         fs.change_dir('1')
         self.assertEqual(len(fs._current_dir.get_all_children()), 2)
+
+        # a directory can not be moved into itself or below itself
+        fs.change_dir('/')
+        fs.make_new_dir('/5/1/1.1/deep')
+        stat = fs.stat('/')
+        for from_path, to_path in (('/5', '/5/1'), ('/5', '/5'), ('/5/1', '/5/1/1.1/deep/x'), ('.', '5')):
+            with self.assertRaises(error.InvalidOperationException):
+                fs.move(from_path, to_path)
+        fs.change_dir('/5/1/1.1')
+        with self.assertRaises(error.InvalidOperationException):
+            fs.move('/5', '.')
+        self.assertEqual(fs.get_current_path(), '/5/1/1.1')
+        self.assertEqual(fs.stat('/'), stat)
     
     def test_find(self) -> None:
         fs = self._create_test_data()
         result = fs.find('file1')
         
         self.assertEqual(len(result), 2)
+
+    def test_find_follows_tree_changes(self) -> None:
+        fs = self._create_test_data()
+        self.assertEqual(fs.find('file1'), ['./1/1.1/file1', './1/1.2/file1'])
+
+        # only the current subtree is searched
+        fs.change_dir('1/1.2')
+        self.assertEqual(fs.find('file1'), ['./file1'])
+        # or below a given directory, written after it like grep does
+        self.assertEqual(fs.find('file1', path='/1'), ['/1/1.1/file1', '/1/1.2/file1'])
+        self.assertEqual(fs.find('file1', path='..'), ['../1.1/file1', '../1.2/file1'])
+        fs.change_dir('/')
+
+        fs.copy('1/1.1', '5')
+        self.assertEqual(fs.find('file3'), ['./1/1.1/1.1.1/file3', './5/1.1/1.1.1/file3'])
+
+        fs.move('5/1.1', 'moved')
+        self.assertEqual(fs.find('1.1'), ['./1/1.1'])
+        self.assertEqual(fs.find('moved'), ['./moved'])
+        self.assertEqual(fs.find('file3'), ['./1/1.1/1.1.1/file3', './moved/1.1.1/file3'])
+
+        fs.remove('1')
+        self.assertEqual(fs.find('file1'), ['./moved/file1'])
+        self.assertEqual(sorted(fs.ifind('file3')), fs.find('file3'))
+
+        # nodes removed while ifind is running are skipped
+        matches = fs.ifind('file3')
+        fs.remove('moved')
+        self.assertEqual(list(matches), [])
+
+        # auto created directories are indexed as well
+        fs.make_new_file('x/y/z')
+        self.assertEqual(fs.find('y'), ['./x/y'])
     
+    def test_walk_and_iglob(self) -> None:
+        fs = self._create_test_data()
+
+        self.assertEqual(list(fs.walk('1')), [
+            ('1', ['1.1', '1.2'], []),
+            ('1/1.1', ['1.1.1'], ['file1', 'file2']),
+            ('1/1.1/1.1.1', [], ['file3']),
+            ('1/1.2', [], ['file1']),
+        ])
+        self.assertEqual([entry[0] for entry in fs.walk('/1', topdown=False)], ['/1/1.1/1.1.1', '/1/1.1', '/1/1.2', '/1'])
+
+        # pruning dirnames skips those directories
+        walked = []
+        for dir_path, dir_names, _ in fs.walk():
+            walked.append(dir_path)
+            if '1.1' in dir_names:
+                dir_names.remove('1.1')
+        self.assertEqual(walked, ['.', './1', './1/1.2', './5'])
+
+        with self.assertRaises(error.InvalidPathComponentException):
+            next(fs.walk('2'))
+
+        self.assertEqual(sorted(fs.iglob('*')), ['1', '2', '3', '4', '5'])
+        self.assertEqual(sorted(fs.iglob('1/*/file?')), ['1/1.1/file1', '1/1.1/file2', '1/1.2/file1'])
+        self.assertEqual(sorted(fs.iglob('/**/file1')), ['/1/1.1/file1', '/1/1.2/file1'])
+        self.assertEqual(sorted(fs.iglob('**/1.1/**/file[13]')), ['1/1.1/1.1.1/file3', '1/1.1/file1'])
+        self.assertEqual(sorted(fs.iglob('1/1.1/**')), ['1/1.1/1.1.1', '1/1.1/1.1.1/file3', '1/1.1/file1', '1/1.1/file2'])
+        self.assertEqual(list(fs.iglob('2/*')), [])
+        self.assertEqual(list(fs.iglob('missing/**')), [])
+
+        fs.change_dir('1/1.1')
+        self.assertEqual(list(fs.iglob('../1.2/*')), ['../1.2/file1'])
+
+        # results come one at a time, the rest of the tree is not visited
+        matches = fs.iglob('/**')
+        self.assertEqual(next(matches), '/2')
+
+        self.assertEqual(len(fs.find('file1', limit=1)), 1)
+        self.assertEqual(fs.find('file1', limit=5), ['./file1'])
+        self.assertEqual(fs.find('file1', limit=0), [])
+
+    def test_find_limit_is_deterministic(self) -> None:
+        fs = FileSystem()
+        for idx in range(50):
+            fs.make_new_file('/{}/file'.format(idx))
+        all_matches = fs.find('file')
+
+        # the capped result is the start of the sorted one, whatever order the index is in
+        files = list(fs._name_index['file'])
+        for candidates in (files, files[::-1]):
+            with mock.patch.dict(fs._name_index, {'file': candidates}):
+                self.assertEqual(fs.find('file', limit=10), all_matches[:10])
+                self.assertEqual(fs.find('file', limit=60), all_matches)
+
+    def test_du_and_stat(self) -> None:
+        fs = self._create_test_data()
+
+        def check() -> None:
+            for dir_path, _, _ in fs.walk('/'):
+                directory = fs._get_file_object_from_path(dir_path)
+                nodes = list(iterate_subtree(directory))[1:]
+                files = [node for node in nodes if is_file(node)]
+                self.assertEqual(fs.stat(dir_path), {
+                    'type': 'directory',
+                    'size': sum(file.get_size() for file in files),
+                    'files': len(files),
+                    'directories': len(nodes) - len(files),
+                })
+
+        self.assertEqual(fs.stat('/'), {'type': 'directory', 'size': 0, 'files': 7, 'directories': 5})
+
+        fs.write('1/1.1/file1', 'abc')
+        fs.write('1/1.1/file1', 'de', True)
+        fs.pwrite('1/1.1/1.1.1/file3', 10, 'x')
+        fs.write('2', 'hello')
+        self.assertEqual(fs.du('1'), 16)
+        self.assertEqual(fs.du('1/1.1/file1'), 5)
+        self.assertEqual(fs.stat('2'), {'type': 'file', 'size': 5, 'files': 0, 'directories': 0})
+        check()
+
+        fs.copy('1', '5')
+        fs.move('2', '1/1.2/file1')
+        fs.truncate('1/1.1/1.1.1/file3', 2)
+        with fs.open('1/1.2/new', 'w') as handle:
+            handle.write('1234')
+        fs.remove('1/1.1')
+        check()
+        self.assertEqual(fs.du('/'), 16 + 5 + 4)
+
+        fs.batch([('write', '3', 'abc'), ('remove', '5'), ('write', '4', 'x', True), ('remove', 'missing')], atomic=True)
+        check()
+        self.assertEqual(fs.du('/'), 25)
+
+        # directories loaded from a snapshot know their aggregates before their children are created
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_path = os.path.join(temp_dir, 'fs.snapshot')
+            fs.save(snapshot_path)
+            loaded = FileSystem.load(snapshot_path)
+
+            self.assertEqual(loaded.stat('/5'), fs.stat('/5'))
+            self.assertFalse(loaded._get_file_object_from_path('/5').is_loaded())
+            loaded.write('/5/1/1.2/file1', 'abcdef', True)
+            self.assertEqual(loaded.du('/'), 31)
+
+    def test_grep(self) -> None:
+        self.assertEqual(get_required_literals('hello (wor|ld)+ ab*c\\.d\\x41bc'), ['hello ', ' a', 'c.d', 'bc'])
+        self.assertEqual(get_required_literals('abc|def'), [])
+
+        # the indexed file system has to answer exactly like a plain scan
+        indexed = FileSystem(content_index=True)
+        scanned = FileSystem()
+        patterns = ['hello', 'HeLLo', 'wor(ld|d)', 'abc|xyz', '\\d+', 'lo w', 'o, w', '^copy', 'zzz']
+
+        def both(method_name: str, *args) -> None:
+            getattr(indexed, method_name)(*args)
+            getattr(scanned, method_name)(*args)
+
+        def check(path: str = '.') -> None:
+            for pattern in patterns:
+                for ignore_case in (False, True):
+                    self.assertEqual(
+                        indexed.grep(pattern, path, ignore_case), scanned.grep(pattern, path, ignore_case), pattern
+                    )
+
+        for fs in (indexed, scanned):
+            fs.make_new_dir('/a/b')
+            fs.make_new_file('/a/b/f1')
+            fs.make_new_file('/a/f2')
+            fs.make_new_file('/f3')
+            fs.write('/a/b/f1', 'hello world')
+            fs.write('/a/f2', 'Hello, word 42')
+            fs.write('/f3', 'abc')
+        check()
+        self.assertEqual(indexed.grep('hello'), ['./a/b/f1'])
+        self.assertEqual(indexed.grep('hello', '/a', True), ['/a/b/f1', '/a/f2'])
+        self.assertEqual(indexed.grep('abc', 'f3'), ['f3'])
+
+        both('write', '/f3', ' and hello xyz', True)
+        both('copy', '/a', '/c')
+        both('pwrite', '/c/f2', 0, 'copy')
+        both('move', '/a/b', '/c/b')
+        both('remove', '/a/f2')
+        check()
+        check('/c')
+        self.assertEqual(indexed.grep('hello', '/c'), ['/c/b/b/f1', '/c/b/f1'])
+
+        both('change_dir', '/c')
+        both('truncate', 'b/f1', 4)
+        for fs in (indexed, scanned):
+            with fs.open('/c/f2', 'a') as handle:
+                handle.write('hello')
+            fs.batch([('write', '/f3', 'zzz'), ('remove', '/c/b'), ('remove', '/missing')], atomic=True)
+        check()
+        check('/')
+
+        # the index only holds files of the tree, removed and rolled back ones are not in it
+        stats = indexed.get_content_index_stats()
+        self.assertEqual(stats['files'], indexed.stat('/')['files'])
+        self.assertEqual(stats['dirty'], 0)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_path = os.path.join(temp_dir, 'fs.snapshot')
+            indexed.save(snapshot_path)
+            loaded = FileSystem.load(snapshot_path, content_index=True)
+            loaded.write('/c/b/f1', 'hello again')
+
+            self.assertEqual(loaded.grep('hello', '/'), ['/c/b/b/f1', '/c/b/f1', '/c/f2', '/f3'])
+
+    def test_paginated_ls(self) -> None:
+        fs = FileSystem()
+        # enough names for the sorted index to split into several chunks
+        names = ['name_{}'.format((i * 7919) % 5000) for i in range(5000)]
+        for idx, name in enumerate(names):
+            if idx % 3:
+                fs.make_new_file('/big/' + name)
+            else:
+                fs.make_new_dir('/big/' + name)
+        fs.make_new_file('/big/other')
+
+        def expected(start_after=None, limit=None, prefix='') -> list:
+            listed = sorted(name.rstrip('/') for name in fs.ls('/big'))
+            listed = [name for name in listed if name.startswith(prefix) and (start_after is None or name > start_after)]
+            return [name + ('/' if is_directory(fs._get_file_object_from_path('/big/' + name)) else '') for name in listed[:limit]]
+
+        # plain ls keeps the creation order
+        fs.change_dir('/big')
+        self.assertEqual(fs.ls()[:3], ['name_0/', 'name_2919', 'name_838'])
+        self.assertEqual(fs.ls('.'), fs.ls())
+
+        pages = []
+        page = fs.ls('/big', limit=700)
+        while page:
+            pages.extend(page)
+            page = fs.ls('/big', start_after=page[-1], limit=700)
+        self.assertEqual(pages, expected())
+        self.assertEqual(fs.ls('/big', prefix='name_49'), expected(prefix='name_49'))
+        self.assertEqual(fs.ls('/big', start_after='name_4950', limit=20, prefix='name_49'), expected('name_4950', 20, 'name_49'))
+        self.assertEqual(fs.ls('/big', start_after='name_5', prefix='name_49'), [])
+        self.assertEqual(fs.ls('/big', start_after='zzz'), [])
+        self.assertEqual(fs.ls('/big', limit=0), [])
+
+        # the index follows every change once it exists
+        for i in range(0, 5000, 2):
+            fs.remove('/big/name_{}'.format(i))
+        fs.move('/big/name_1', '/big/moved')
+        fs.copy('/big/name_3', '/big/name_3')
+        fs.batch([('make_new_file', '/big/batch'), ('remove', '/big/name_5'), ('remove', '/big/missing')], atomic=True)
+        self.assertEqual(fs.ls('/big', limit=10000), expected())
+        self.assertEqual(fs.ls('/big', start_after='name_3/', limit=3), expected('name_3', 3))
+
+        with self.assertRaises(error.InvalidPathComponentException):
+            fs.ls('/big/name_3_1', limit=1)
+
+    def test_memory_budget(self) -> None:
+        contents = {'/logs/file_{}'.format(i): '{:04} '.format(i) * 400 for i in range(20)}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fs = FileSystem(memory_budget=10000, spill_dir=temp_dir, content_index=True)
+            for path, content in contents.items():
+                fs.make_new_file(path)
+                fs.write(path, content)
+                self.assertLessEqual(fs.get_spill_stats()['resident_bytes'], 10000)
+
+            stats = fs.get_spill_stats()
+            self.assertEqual(stats['resident_files'], 5)
+            self.assertEqual(stats['spilled_files'], 15)
+            self.assertEqual(stats['spill_live_bytes'], 15 * 2000)
+            # directory metadata stays in memory
+            self.assertEqual(fs.du('/logs'), 20 * 2000)
+
+            # spilled contents come back on access, the least recently used ones go out instead
+            for path, content in reversed(contents.items()):
+                self.assertEqual(fs.cat(path), content)
+            self.assertEqual(fs.get_spill_stats()['misses'], 15)
+            self.assertEqual(fs.get_spill_stats()['hits'], 5)
+
+            fs.write('/logs/file_0', 'end', True)
+            fs.pwrite('/logs/file_1', 0, 'start')
+            fs.truncate('/logs/file_2', 10)
+            fs.copy('/logs/file_3', '/logs/copy')
+            with fs.open('/logs/file_4') as handle:
+                self.assertEqual(bytes(handle.read(5)), b'0004 ')
+            self.assertEqual(fs.cat('/logs/file_0'), contents['/logs/file_0'] + 'end')
+            self.assertEqual(fs.pread('/logs/file_1', 0, 10), b'start0001 ')
+            self.assertEqual(fs.cat('/logs/file_2'), '0002 0002 ')
+            self.assertEqual(fs.cat('/logs/copy'), contents['/logs/file_3'])
+
+            # grep and save read spilled contents without paging them in
+            spilled_files = fs.get_spill_stats()['spilled_files']
+            self.assertEqual(fs.grep('0007 0007', '/logs'), ['/logs/file_7'])
+            snapshot_path = os.path.join(temp_dir, 'fs.snapshot')
+            fs.save(snapshot_path)
+            self.assertEqual(fs.get_spill_stats()['spilled_files'], spilled_files)
+            self.assertEqual(FileSystem.load(snapshot_path).cat('/logs/file_9'), contents['/logs/file_9'])
+
+            # space of replaced contents is reclaimed by compacting the spill file
+            with mock.patch.object(spill, 'COMPACT_MIN_GARBAGE', 0):
+                for i in range(40):
+                    fs.write('/logs/file_{}'.format(i % 20), str(i) * 1500)
+            stats = fs.get_spill_stats()
+            self.assertGreater(stats['compactions'], 0)
+            self.assertLessEqual(stats['spill_file_bytes'], 2 * stats['spill_live_bytes'] + 3000)
+            for i in range(20, 40):
+                self.assertEqual(fs.cat('/logs/file_{}'.format(i % 20)), str(i) * 1500)
+
+    def test_memory_budget_copy(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fs = FileSystem(memory_budget=4096, spill_dir=temp_dir)
+            for i in range(10):
+                fs.make_new_file('/d/file_{}'.format(i))
+                fs.write('/d/file_{}'.format(i), str(i) * 2048)
+            self.assertEqual(fs.get_spill_stats()['spilled_files'], 8)
+
+            # contents copy loads back in are accounted for, the budget still holds afterwards
+            fs.copy('/d', '/e')
+            resident_bytes = sum(
+                file.get_size() for file in iterate_subtree(fs._root) if is_file(file) and file.is_content_loaded()
+            )
+            stats = fs.get_spill_stats()
+            self.assertEqual(stats['resident_bytes'], resident_bytes)
+            self.assertLessEqual(stats['resident_bytes'], 4096)
+            self.assertEqual(stats['spilled_files'], 18)
+            for i in range(10):
+                self.assertEqual(fs.cat('/e/file_{}'.format(i)), str(i) * 2048)
+
+    def test_memory_budget_with_dedup(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            fs = FileSystem(memory_budget=4096, spill_dir=temp_dir)
+            for i in range(10):
+                fs.make_new_file('/d/file_{}'.format(i))
+                fs.write('/d/file_{}'.format(i), 'ab'[i % 2] * 2048)
+
+            # spilled files give their blob reference back
+            stats = fs.get_blob_store_stats()
+            self.assertEqual((stats['blobs'], stats['references']), (2, 2))
+
+            # and take it again when they are paged in, sharing the content with their duplicates
+            for i in range(10):
+                self.assertEqual(fs.cat('/d/file_{}'.format(i)), 'ab'[i % 2] * 2048)
+            files = [fs._get_file_object_from_path('/d/file_{}'.format(i)) for i in range(10)]
+            loaded = [file for file in files if file.is_content_loaded()]
+            stats = fs.get_blob_store_stats()
+            self.assertEqual(stats['references'], len(loaded))
+            self.assertTrue(all(file.get_content_blob() is not None for file in loaded))
+            self.assertIs(files[0]._get_data(), files[2]._get_data())
+            self.assertEqual(fs.get_blob_store_stats()['blobs'], 2)
+
+    def test_compression(self) -> None:
+        fs = FileSystem(compression='zlib', compress_after=0)
+        log = ''.join('{} GET /index.html 200\n'.format(i) for i in range(1000))
+        fs.make_new_file('/logs/access')
+        fs.write('/logs/access', log)
+        fs.copy('/logs/access', '/logs/copy')
+        fs.make_new_file('/logs/small')
+        fs.write('/logs/small', 'small file')
+        fs.make_new_file('/random')
+        fs.write('/random', os.urandom(10000))
+
+        # the copy shares the compressed form, small and incompressible files stay raw
+        self.assertEqual(fs.compress_cold(), 2)
+        stats = fs.get_compression_stats()
+        self.assertEqual(stats['compressed_contents'], 1)
+        self.assertEqual(stats['raw_bytes'], len(log))
+        self.assertGreater(stats['ratio'], 5)
+        self.assertEqual(fs.du('/logs'), 2 * len(log) + 10)
+        self.assertFalse(fs._get_file_object_from_path('/logs/access').is_content_loaded())
+
+        # grep and save look at the content without keeping it decompressed
+        self.assertEqual(fs.grep('999 GET', '/logs'), ['/logs/access', '/logs/copy'])
+        self.assertFalse(fs._get_file_object_from_path('/logs/access').is_content_loaded())
+
+        # any other access decompresses the file for good, until it is cold again
+        self.assertEqual(fs.cat('/logs/access'), log)
+        fs.write('/logs/copy', 'tail\n', True)
+        self.assertTrue(fs._get_file_object_from_path('/logs/access').is_content_loaded())
+        self.assertEqual(fs.cat('/logs/copy'), log + 'tail\n')
+        self.assertEqual(fs.get_compression_stats()['decompressions'], 4)
+        self.assertEqual(fs.compress_cold(), 2)
+
+        # only files nobody touched for compress_after seconds are compressed
+        fs = FileSystem(compression='lzma', compress_after=3600)
+        fs.make_new_file('/log')
+        fs.write('/log', log)
+        self.assertEqual(fs.compress_cold(), 0)
+
+        # in the background on a thread safe file system
+        fs = FileSystem(thread_safe=True, compression='zlib', compress_after=0, compress_interval=0.01)
+        fs.make_new_file('/log')
+        fs.write('/log', log)
+        for _ in range(500):
+            if fs.get_compression_stats()['compressions']:
+                break
+            time.sleep(0.01)
+        self.assertEqual(fs.get_compression_stats()['compressions'], 1)
+        self.assertEqual(fs.cat('/log'), log)
+
+        with self.assertRaises(error.InvalidOperationException):
+            FileSystem(compression='zlib', compress_interval=1)
+        with self.assertRaises(error.InvalidOperationException):
+            FileSystem().compress_cold()
+
+    def test_inodes(self) -> None:
+        fs = FileSystem()
+        fs.make_new_file('/a/b/log')
+        fs.make_new_file('/a/b/other')
+        log = fs.lookup('/a/b/log')
+        directory = fs.lookup('/a/b')
+        self.assertEqual(fs.lookup('/a/b/log'), log)
+        self.assertEqual(len({log, directory, fs.lookup('/'), fs.lookup('/a/b/other')}), 4)
+
+        fs.write_inode(log, 'abc')
+        fs.write_inode(log, b'def', append=True)
+        self.assertEqual(fs.cat('/a/b/log'), 'abcdef')
+        self.assertEqual(fs.read_inode(log), b'abcdef')
+        self.assertEqual(fs.read_inode(log, 2, 3), b'cde')
+        self.assertEqual(fs.stat_inode(log), fs.stat('/a/b/log'))
+        self.assertEqual(fs.stat_inode(directory), fs.stat('/a/b'))
+        self.assertEqual(fs.ls_inode(directory), ['log', 'other'])
+        self.assertEqual(fs.ls_inode(directory, start_after='log'), ['other'])
+
+        # numbers follow the node across moves, also of its ancestors
+        fs.change_dir('/a/b')
+        self.assertEqual(fs.get_current_path(), '/a/b')
+        fs.move('/a', '/x')
+        self.assertEqual(fs.get_current_path(), '/x/b')
+        fs.move('/x/b/log', '/x/renamed')
+        self.assertEqual(fs.read_inode(log), b'abcdef')
+        fs.write_inode(log, 'ghi', append=True)
+        self.assertEqual(fs.cat('/x/renamed'), 'abcdefghi')
+        self.assertEqual(fs.ls_inode(directory), ['other'])
+        self.assertEqual(fs.lookup('/x/renamed'), log)
+
+        # a copy is a new node, a removed node's number is stale
+        fs.copy('/x/renamed', '/copy')
+        self.assertNotEqual(fs.lookup('/copy'), log)
+        fs.remove('/x/renamed')
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.read_inode(log)
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.stat_inode(123456)
+        with self.assertRaises(error.InvalidPathComponentException):
+            fs.read_inode(directory)
+        with self.assertRaises(error.InvalidPathComponentException):
+            fs.ls_inode(fs.lookup('/copy'))
+
+        # a rolled back batch brings the number back with the node
+        copy = fs.lookup('/copy')
+        fs.batch([('remove', '/copy'), ('remove', '/missing')], atomic=True)
+        self.assertEqual(fs.read_inode(copy), b'abcdefghi')
+
+    def test_watch(self) -> None:
+        fs = FileSystem()
+        fs.make_new_dir('/a/b')
+        watcher = fs.watch('/a')
+        direct = fs.watch('/a', recursive=False, max_events=3)
+        self.assertEqual(watcher.poll(), [])
+
+        fs.make_new_file('/a/b/log')
+        for i in range(100):
+            fs.write('/a/b/log', str(i), append=True)
+        fs.pwrite('/a/b/log', 0, 'x')
+        fs.make_new_file('/a/b/c/other')
+        fs.write('/a/b/log', 'again')
+        fs.make_new_file('/elsewhere')
+        self.assertEqual(watcher.get_events(), [
+            Event(CREATE, '/a/b/log'),
+            # appends and the pwrite are one event
+            Event(WRITE, '/a/b/log'),
+            Event(CREATE, '/a/b/c', is_dir=True),
+            Event(CREATE, '/a/b/c/other'),
+            Event(WRITE, '/a/b/log'),
+        ])
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(direct.poll(), [])
+
+        # moves are seen from both ends, the watch follows the watched node
+        fs.move('/a/b/log', '/a/log')
+        fs.move('/a/log', '/moved')
+        fs.move('/a', '/x')
+        moves = [Event(MOVE, '/a/log', '/a/b/log'), Event(MOVE, '/moved', '/a/log'), Event(MOVE, '/x', '/a', True)]
+        self.assertEqual(watcher.poll(), moves)
+        self.assertEqual(direct.poll(), moves)
+
+        # a full queue is dropped for one overflow event
+        for i in range(5):
+            fs.make_new_file('/x/f{}'.format(i))
+        self.assertEqual(direct.poll(), [Event(OVERFLOW, None), Event(CREATE, '/x/f3'), Event(CREATE, '/x/f4')])
+        self.assertEqual(direct.overflows, 1)
+        direct.close()
+        fs.make_new_file('/x/f5')
+        self.assertEqual(direct.poll(), [])
+
+        # only the events of a batch that succeeded are delivered
+        watcher.poll()
+        fs.batch([('make_new_file', '/x/g'), ('remove', '/missing')], atomic=True)
+        fs.batch([('make_new_file', '/x/h'), ('write', '/x/h', 'h')], atomic=True)
+        self.assertEqual(watcher.poll(), [Event(CREATE, '/x/h'), Event(WRITE, '/x/h')])
+
+        # removing a directory reaches watchers of everything below it
+        inner = fs.watch('/x/b/c/other')
+        with fs.open('/x/b/c/other', 'a') as handle:
+            handle.write('abc')
+        fs.remove('/x/b')
+        removal = [Event(WRITE, '/x/b/c/other'), Event(REMOVE, '/x/b', is_dir=True)]
+        self.assertEqual(inner.poll(), removal)
+        self.assertEqual(watcher.poll(), removal)
+        inner.close()
+
+        # a reader on another thread is woken by the next event
+        received = []
+        reader = threading.Thread(target=lambda: received.extend(batch for batch in watcher))
+        reader.start()
+        fs.write('/x/h', 'hh')
+        for _ in range(500):
+            if received:
+                break
+            time.sleep(0.01)
+        watcher.close()
+        reader.join()
+        self.assertEqual(received, [[Event(WRITE, '/x/h')]])
+        self.assertEqual(fs._watches, {})
+
+    def test_metrics_and_hooks(self) -> None:
+        fs = self._create_test_data()
+        self.assertIsNone(fs.get_metrics())
+
+        class RecordingHook(Hook):
+            def __init__(self) -> None:
+                self.calls = []
+
+            def before_call(self, record) -> None:
+                self.calls.append(('before', record.method))
+
+            def after_call(self, record) -> None:
+                self.calls.append(('after', record.method, record.error is None, dict(record.counters)))
+
+        hook = RecordingHook()
+        fs.add_hook(hook)
+
+        fs.write('1/1.1/file1', 'abcde')
+        self.assertEqual(fs.cat('/1/1.1/file1'), 'abcde')
+        fs.copy('1', '5')
+        fs.find('file1')
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.cat('missing')
+        with fs.open('new', 'w') as handle:
+            handle.write('xy')
+
+        self.assertEqual(hook.calls[0], ('before', 'write'))
+        self.assertEqual(hook.calls[1][:3], ('after', 'write', True))
+        self.assertEqual(hook.calls[1][3]['bytes_written'], 5)
+        self.assertEqual(hook.calls[1][3]['path_components'], 3)
+        self.assertEqual(hook.calls[-1][:3], ('after', 'open', True))
+        self.assertIn(('before', 'make_new_file'), hook.calls)
+
+        metrics = fs.get_metrics()
+        methods = metrics['methods']
+        self.assertEqual(methods['cat']['calls'], 2)
+        self.assertEqual(methods['cat']['errors'], 1)
+        self.assertEqual(methods['cat']['bytes_read'], 5)
+        self.assertEqual(methods['copy']['nodes_visited'], 1)
+        # the copy's nodes are not made yet, find reaches them through their sources
+        self.assertEqual(methods['find']['nodes_visited'], 2)
+        self.assertGreater(methods['write']['component_lookups'], 0)
+        self.assertGreaterEqual(methods['write']['p99_us'], methods['write']['p50_us'])
+        self.assertEqual(sum(methods['cat']['histogram_us'].values()), 2)
+
+        # the nested make_new_file and truncate are counted in open too, but only once in totals
+        self.assertEqual(methods['open']['calls'], 1)
+        self.assertEqual(methods['make_new_file']['calls'], 1)
+        self.assertEqual(metrics['totals']['bytes_written'], 7)
+        self.assertEqual(metrics['totals']['bytes_read'], 5)
+
+        fs.remove_hook(hook)
+        fs.reset_metrics()
+        calls = len(hook.calls)
+        fs.ls()
+        self.assertEqual(len(hook.calls), calls)
+        self.assertEqual(list(fs.get_metrics()['methods']), ['ls'])
+
+    def test_path_cache(self) -> None:
+        fs = self._create_test_data()
+
+        file_1 = fs._get_file_object_from_path('/1/1.1/file1')
+        hits = fs.get_path_cache_stats()['hits']
+        self.assertIs(fs._get_file_object_from_path('/1/1.1/file1'), file_1)
+        self.assertEqual(fs.get_path_cache_stats()['hits'], hits + 1)
+
+        # relative paths are cached per starting directory
+        fs.change_dir('1')
+        self.assertIs(fs._get_file_object_from_path('1.1/file1'), file_1)
+        fs.change_dir('1.2')
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs._get_file_object_from_path('1.1/file1')
+        fs.change_dir('/')
+
+        # cached entries must not survive the node being unlinked
+        fs.move('1/1.1', '5')
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.cat('/1/1.1/file1')
+        self.assertIs(fs._get_file_object_from_path('/5/1.1/file1'), file_1)
+
+        fs.make_new_file('/1/1.1/file1')
+        self.assertIsNot(fs._get_file_object_from_path('/1/1.1/file1'), file_1)
+
+        fs.remove('5')
+        with self.assertRaises(error.PathComponentNotFoundException):
+            fs.cat('/5/1.1/file1')
+
+        # replacing a node through make_new_file also invalidates
+        fs.write('/2', 'old')
+        fs.make_new_file('/2')
+        self.assertEqual(fs.cat('/2'), '')
+
+        # disabled cache
+        fs = FileSystem(path_cache_size=0)
+        fs.make_new_file('/a')
+        fs.cat('/a')
+        self.assertEqual(fs.get_path_cache_stats()['size'], 0)
+
+    def test_batch(self) -> None:
+        fs = self._create_test_data()
+
+        results = fs.batch([
+            ('make_new_file', '/batch/a'),
+            ('write', '/batch/a', 'abc'),
+            ('cat', '/batch/a'),
+            ('cat', '/batch/missing'),
+            ('no_such_operation', '/batch/a'),
+            ('find', 'a'),
+        ])
+        self.assertEqual([result.is_ok() for result in results], [True, True, True, False, False, True])
+        self.assertEqual(results[2].value, 'abc')
+        self.assertIsInstance(results[3].error, error.PathComponentNotFoundException)
+        self.assertIsInstance(results[4].error, error.InvalidOperationException)
+        self.assertEqual(results[5].value, ['./batch/a'])
+
+    def test_atomic_batch_rolls_back(self) -> None:
+        fs = self._create_test_data()
+        fs.write('2', 'original')
+        file_1 = fs._get_file_object_from_path('1/1.1/file1')
+
+        results = fs.batch([
+            ('write', '2', 'changed'),
+            ('write', '2', ' more', True),
+            ('make_new_file', 'new/dir/file'),
+            ('move', '1/1.1', '5'),
+            ('copy', '1/1.2', '5'),
+            ('remove', '3'),
+            ('make_new_file', '4'),
+            ('change_dir', '5'),
+            ('cat', 'does_not_exist'),
+            ('remove', '4'),
+        ], atomic=True)
+
+        self.assertEqual([result.is_ok() for result in results[:8]], [True] * 8)
+        self.assertIsInstance(results[8].error, error.PathComponentNotFoundException)
+        self.assertFalse(results[9].executed)
+
+        self.assertEqual(fs.get_current_path(), '/')
+        self.assertEqual(fs.cat('2'), 'original')
+        self.assertEqual(sorted(fs.ls()), ['1/', '2', '3', '4', '5/'])
+        self.assertEqual(fs._get_file_object_from_path('5').get_all_children(), [])
+        self.assertIs(fs._get_file_object_from_path('1/1.1/file1'), file_1)
+        self.assertIs(file_1.get_parent(), fs._get_file_object_from_path('1/1.1'))
+        self.assertEqual(fs.find('file1'), ['./1/1.1/file1', './1/1.2/file1'])
+        self.assertEqual(fs.find('file'), [])
+        self.assertEqual(fs.find('3'), ['./3'])
+
+    def test_thread_safe_stress(self) -> None:
+        fs = FileSystem(thread_safe=True)
+        errors = []
+
+        def writer(thread_id: int) -> None:
+            try:
+                for i in range(200):
+                    path = '/t{}/d{}/f'.format(thread_id, i % 10)
+                    fs.make_new_file(path) if i < 10 else fs.write(path, 'x', True)
+                    if i % 20 == 0:
+                        fs.copy('/t{}/d0'.format(thread_id), '/t{}/copies'.format(thread_id))
+                fs.move('/t{}/copies'.format(thread_id), '/moved/t{}'.format(thread_id))
+            except Exception as e:
+                errors.append(e)
+
+        def reader() -> None:
+            try:
+                for _ in range(200):
+                    fs.find('f')
+                    fs.ls()
+                    try:
+                        fs.cat('/t0/d0/f')
+                    except error.PathComponentNotFoundException:
+                        pass
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        threads += [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for thread_id in range(4):
+            for d in range(10):
+                self.assertEqual(fs.cat('/t{}/d{}/f'.format(thread_id, d)), 'x' * 19)
+            self.assertEqual(len(fs.find('t{}'.format(thread_id))), 2)
+        self.assertEqual(len(fs.find('f')), 4 * 10 + 4 * 10)
+
+    def test_thread_safe_subtree_locks(self) -> None:
+        fs = FileSystem(thread_safe=True)
+        fs.make_new_file('/a/f')
+        fs.make_new_file('/b/f')
+
+        def start(method, *args) -> threading.Thread:
+            thread = threading.Thread(target=method, args=args)
+            thread.start()
+            return thread
+
+        # a writer holding /a, e.g. a long copy into it
+        with fs._lock.locked(fs._get_lock_plan([('write', '/a')])):
+            # writers and readers of another subtree do not wait for it
+            for thread in (start(fs.write, '/b/f', 'b'), start(fs.cat, '/b/f'), start(fs.make_new_file, '/b/g')):
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+            # readers of /a, of a directory above it and writers creating next to it do
+            blocked = [start(fs.cat, '/a/f'), start(fs.du, '/'), start(fs.make_new_file, '/a_sibling')]
+            time.sleep(0.1)
+            self.assertTrue(all(thread.is_alive() for thread in blocked))
+
+        for thread in blocked:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(fs.cat('/b/f'), 'b')
+        self.assertEqual(sorted(fs.ls('/')), ['a/', 'a_sibling', 'b/'])
+
+        # a waiting writer is not overtaken by readers it conflicts with
+        with fs._lock.locked(fs._get_lock_plan([('read', '/a')])):
+            writer = start(fs.write, '/a/f', 'a')
+            time.sleep(0.1)
+            reader = start(fs.du, '/a')
+            time.sleep(0.1)
+            self.assertTrue(writer.is_alive() and reader.is_alive())
+            # readers of the file itself do not conflict with the writer's intention lock on /a
+            self.assertEqual(fs.cat('/a/f'), '')
+        writer.join(5)
+        reader.join(5)
+        self.assertEqual(fs.cat('/a/f'), 'a')
+
+        # locks taken inside a call have to be covered by the ones held
+        with fs._lock.read_locked():
+            self.assertEqual(fs.cat('/a/f'), 'a')
+            with self.assertRaises(error.InvalidOperationException):
+                fs.write('/a/f', 'x')
+
+    def test_thread_safe_move_and_copy_lock_order(self) -> None:
+        fs = FileSystem(thread_safe=True, content_index=True)
+        for path in ('/a/s1', '/b/s2', '/a/c1', '/b/c2'):
+            for idx in range(5):
+                fs.make_new_file('{}/f{}'.format(path, idx))
+                fs.write('{}/f{}'.format(path, idx), path[1] * (idx + 1))
+        errors = []
+
+        # the threads of each pair lock /a and /b in opposite argument order
+        def mover(path: str, target: str) -> None:
+            try:
+                for _ in range(100):
+                    fs.move(path, target)
+                    fs.move(target, path)
+            except Exception as e:
+                errors.append(e)
+
+        def copier(path: str, target: str) -> None:
+            try:
+                for _ in range(100):
+                    fs.copy(path, target)
+                    fs.remove(target)
+                    fs.grep('a', target.rsplit('/', 1)[0])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=mover, args=('/a/s1', '/b/s1_moved')),
+            threading.Thread(target=mover, args=('/b/s2', '/a/s2_moved')),
+            threading.Thread(target=copier, args=('/a/c1', '/b/c1_copy')),
+            threading.Thread(target=copier, args=('/b/c2', '/a/c2_copy')),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(fs.ls('/a')), ['c1/', 's1/'])
+        self.assertEqual(sorted(fs.ls('/b')), ['c2/', 's2/'])
+        # the aggregates, the name index and the content index saw every change
+        self.assertEqual(fs.stat('/'), {'type': 'directory', 'size': 4 * 15, 'files': 20, 'directories': 6})
+        self.assertEqual(fs.find('f0', path='/'), ['/a/c1/f0', '/a/s1/f0', '/b/c2/f0', '/b/s2/f0'])
+        self.assertEqual(fs.grep('bbbb', '/'), ['/b/c2/f3', '/b/c2/f4', '/b/s2/f3', '/b/s2/f4'])
+
+    def test_snapshot_save_and_load(self) -> None:
+        fs = self._create_test_data()
+        fs.write('1/1.1/file1', 'abcde')
+        fs.write('2', b'\x00\x01binary')
+        fs.copy('1', 'copy_of_1')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_path = os.path.join(temp_dir, 'fs.snapshot')
+            fs.save(snapshot_path)
+
+            loaded = FileSystem.load(snapshot_path)
+
+            # nothing below the root exists until it is accessed
+            self.assertFalse(loaded._root.is_loaded())
+            dir_1 = loaded._get_file_object_from_path('/1')
+            self.assertTrue(loaded._root.is_loaded())
+            self.assertFalse(dir_1.is_loaded())
+
+            self.assertEqual(sorted(loaded.ls()), sorted(fs.ls()))
+            self.assertEqual(loaded.cat('/1/1.1/file1'), 'abcde')
+            self.assertEqual(loaded.cat('/copy_of_1/1.1/file1'), 'abcde')
+            self.assertEqual(loaded.pread('2', 0, 8), b'\x00\x01binary')
+            self.assertEqual(loaded.find('file3'), fs.find('file3'))
+
+            # loaded files behave like any other file
+            loaded.write('/copy_of_1/1.1/file1', 'x', True)
+            self.assertEqual(loaded.cat('/copy_of_1/1.1/file1'), 'abcdex')
+            self.assertEqual(loaded.cat('/1/1.1/file1'), 'abcde')
+            loaded.move('/copy_of_1', '/5')
+            self.assertEqual(loaded.find('file2'), ['./1/1.1/file2', './5/copy_of_1/1.1/file2'])
+
+            # saving over the snapshot that is currently mapped
+            loaded.save(snapshot_path)
+            reloaded = FileSystem.load(snapshot_path)
+            self.assertEqual(reloaded.cat('/5/copy_of_1/1.1/file1'), 'abcdex')
+            self.assertEqual(loaded.cat('/1/1.2/file1'), '')
+
+            with open(snapshot_path, 'wb') as snapshot_file:
+                snapshot_file.write(b'not a snapshot at all')
+            with self.assertRaises(error.InvalidSnapshotException):
+                FileSystem.load(snapshot_path)
+
+    def test_journal_replay(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            journal = Journal(temp_dir)
+            fs = journal.recover()
+            fs.make_new_file('/a/b/file')
+            fs.write('/a/b/file', 'abc')
+            fs.write('/a/b/file', b'def', append=True)
+            fs.change_dir('/a')
+            fs.copy('b', 'c')
+            fs.move('c/file', '/moved')
+            fs.batch([('make_new_dir', 'd'), ('remove', 'missing'), ('pwrite', '/moved', 1, 'X')])
+            fs.truncate('/moved', 4)
+            fs.write_inode(fs.lookup('/moved'), 'Z', append=True)
+            with self.assertRaises(error.PathComponentNotFoundException):
+                fs.remove('/missing')
+            journal.close()
+
+            recovered_journal = Journal(temp_dir)
+            recovered = recovered_journal.recover()
+            self.assertEqual(recovered.get_current_path(), '/a')
+            self.assertEqual(sorted(recovered.ls()), ['b/', 'c/', 'd/'])
+            self.assertEqual(recovered.cat('/a/b/file'), 'abcdef')
+            self.assertEqual(recovered.cat('/moved'), 'aXcdZ')
+
+            # a record cut off by a crash is ignored
+            recovered.make_new_file('lost')
+            recovered_journal.close()
+            segment = sorted(name for name in os.listdir(temp_dir) if name.startswith('segment'))[-1]
+            with open(os.path.join(temp_dir, segment), 'r+b') as segment_file:
+                segment_file.truncate(os.path.getsize(segment_file.name) - 1)
+
+            recovered_journal = Journal(temp_dir)
+            recovered = recovered_journal.recover()
+            self.assertEqual(sorted(recovered.ls()), ['b/', 'c/', 'd/'])
+            recovered_journal.close()
+
+    def test_journal_checkpoint(self) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            journal = Journal(temp_dir, fsync_policy=FSYNC_NEVER, flush_interval=0)
+            fs = journal.recover()
+            for i in range(10):
+                fs.make_new_file('/dir/file{}'.format(i))
+            fs.change_dir('/dir')
+
+            fs.checkpoint()
+            self.assertEqual(len(os.listdir(temp_dir)), 2)
+
+            # relative paths after the checkpoint still resolve against the right directory
+            fs.write('file1', 'after checkpoint')
+            fs.remove('/dir/file2')
+            journal.close()
+
+            recovered_journal = Journal(temp_dir)
+            recovered = recovered_journal.recover()
+            recovered_journal.close()
+            self.assertEqual(recovered.get_current_path(), '/dir')
+            self.assertEqual(recovered.cat('file1'), 'after checkpoint')
+            self.assertEqual(len(recovered.ls()), 9)
+
+            with self.assertRaises(error.InvalidOperationException):
+                FileSystem().checkpoint()
+
     def _are_files_equal_in_dir(self, dir1: Directory, dir2: Directory) -> bool: 
         dir1_children = dir1.get_all_children()
         dir2_children = dir2.get_all_children()
@@ -224,6 +1493,331 @@ class FileSystemTest(unittest.TestCase):
         return fs
         
 
+class ShardedFileSystemTest(unittest.TestCase):
+
+    def test_sharded_matches_single_file_system(self) -> None:
+        fs = FileSystem()
+        with ShardedFileSystem(shards=3) as sharded:
+            def both(method_name: str, *args):
+                expected = getattr(fs, method_name)(*args)
+                self.assertEqual(getattr(sharded, method_name)(*args), expected)
+                return expected
+
+            for name in ('a', 'b', 'c', 'd', 'e'):
+                both('make_new_file', '/{}/x/file'.format(name))
+                both('write', '/{}/x/file'.format(name), 'content of ' + name)
+            both('make_new_file', '/top_file')
+
+            # the five top level directories are spread over more than one shard
+            self.assertGreater(len(set(sharded._get_shard('/' + name) for name in 'abcde')), 1)
+
+            self.assertEqual(sorted(sharded.ls()), sorted(fs.ls()))
+            both('find', 'file')
+            self.assertEqual(sharded.find('file', 2), fs.find('file')[:2])
+            both('stat', '/')
+            both('du', '/c')
+
+            # moves and copies within a shard and across shards
+            both('copy', '/a/x', '/b')
+            both('copy', '/a/x', '/b')
+            both('copy', '/c/x/file', '/d/x/file_copy')
+            both('move', '/e/x', '/d/moved')
+            both('move', '/a', '/renamed_a')
+            both('copy', '/b/x/file', '/')
+            both('move', '/top_file', '/c/x/file')
+
+            both('change_dir', '/d')
+            both('find', 'file')
+            both('ls')
+            both('make_new_file', 'moved/new')
+            both('write', '../c/x/file', 'abc', True)
+            both('change_dir', '..')
+            both('get_current_path')
+
+            self.assertEqual(sorted(sharded.ls()), sorted(fs.ls()))
+            both('ls', '/', None, 3)
+            both('ls', '/', 'c/', 2)
+            both('ls', '.', None, None, 'r')
+            both('ls', 'd', None, 5)
+            for path in fs.find('file') + fs.find('file_1') + fs.find('file_copy'):
+                both('cat', path)
+            both('stat', '/')
+            both('find', 'x')
+
+            for method_name, args, exception in (
+                ('cat', ('/missing',), error.PathComponentNotFoundException),
+                ('change_dir', ('/c/x/file',), error.InvalidPathComponentException),
+                ('remove', ('/',), error.InvalidOperationException),
+            ):
+                with self.assertRaises(exception):
+                    getattr(sharded, method_name)(*args)
+
+            # names picked in the root on collision land on their own shard and stay reachable
+            both('copy', '/b', '/')
+            both('copy', '/b/x', '/')
+            both('copy', '/b/x/file', '/b')
+            self.assertEqual(sorted(sharded.ls()), sorted(fs.ls()))
+            both('cat', '/b_1/x/file')
+            both('cat', '/x/file')
+            both('make_new_file', '/b_1/x/again')
+            both('copy', '/renamed_a/x', '/b_1')
+            self.assertEqual(sorted(sharded.ls('/b_1')), sorted(fs.ls('/b_1')))
+            self.assertEqual(sorted(sharded.ls()), sorted(fs.ls()))
+
+            # the current directory follows moves of itself and its ancestors
+            both('change_dir', '/d/moved')
+            both('move', '/d', '/dd')
+            both('get_current_path')
+            both('move', '/dd/moved', '/')
+            both('get_current_path')
+            both('ls')
+            both('remove', '/moved')
+            self.assertEqual(sharded.get_current_path(), '/')
+            both('change_dir', '/dd/x')
+            both('remove', '/dd')
+            self.assertEqual(sharded.get_current_path(), '/')
+            fs.change_dir('/')
+            both('make_new_dir', '/d/moved')
+            both('make_new_file', '/d/moved/new')
+
+            results = sharded.batch([('write', '/d/moved/new', 'x'), ('cat', '/d/missing')], atomic=True)
+            self.assertEqual([result.executed for result in results], [True, True])
+            self.assertFalse(results[1].is_ok())
+            self.assertEqual(sharded.cat('/d/moved/new'), '')
+            with self.assertRaises(error.InvalidOperationException):
+                sharded.batch([('write', '/b/x/file', 'x'), ('write', '/d/moved/new', 'x')], atomic=True)
+
+
+class AsyncFileSystemTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_async_operations(self) -> None:
+        afs = AsyncFileSystem()
+        await afs.make_new_file('/a/b/file1')
+        await afs.make_new_file('/a/c/file1')
+        await afs.write('/a/b/file1', 'abc')
+        await afs.write('/a/b/file1', 'def', True)
+        self.assertEqual(await afs.cat('/a/b/file1'), 'abcdef')
+
+        await afs.copy('/a/b', '/a/d')
+        await afs.move('/a/c', '/e')
+        await afs.change_dir('/a')
+        self.assertEqual(sorted(await afs.ls()), ['b/', 'd/'])
+        self.assertEqual(sorted([path async for path in afs.find('file1')]), ['./b/file1', './d/file1'])
+        self.assertEqual([path async for path in afs.find('file1', 1)], ['./b/file1'])
+
+        with self.assertRaises(error.PathComponentNotFoundException):
+            await afs.cat('/missing')
+
+    async def test_async_generators_and_handles(self) -> None:
+        afs = AsyncFileSystem()
+        for idx in range(600):
+            await afs.make_new_file('/many/{}/file'.format(idx))
+        await afs.make_new_file('/a/b/file')
+
+        self.assertEqual(len([path async for path in afs.find('file')]), 601)
+        self.assertEqual(sorted([path async for path in afs.iglob('/a/**')]), ['/a/b', '/a/b/file'])
+
+        walked = []
+        async for dir_path, dir_names, _ in afs.walk('/'):
+            walked.append(dir_path)
+            if 'many' in dir_names:
+                dir_names.remove('many')
+        self.assertEqual(walked, ['/', '/a', '/a/b'])
+
+        watcher = await afs.watch('/a')
+        handle = await afs.open('/a/b/file', 'w')
+        handle.write(b'abc')
+        handle.close()
+        self.assertEqual(await afs.get_events(watcher, 1), [Event(WRITE, '/a/b/file')])
+        watcher.close()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            snapshot_path = os.path.join(tmp_dir, 'snapshot')
+            await afs.save(snapshot_path)
+            self.assertEqual(FileSystem.load(snapshot_path).cat('/a/b/file'), 'abc')
+
+        await afs.import_tree('/copy', await afs.export_tree('/a'))
+        self.assertEqual(await afs.cat('/copy/b/file'), 'abc')
+
+    async def test_streaming_read(self) -> None:
+        afs = AsyncFileSystem()
+        await afs.make_new_file('/big')
+        await afs.write('/big', b'0123456789' * 10)
+
+        chunks = [chunk async for chunk in afs.read_chunks('/big', 30)]
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 30, 30, 10])
+        self.assertEqual(b''.join(chunks), b'0123456789' * 10)
+
+    async def test_server_and_client(self) -> None:
+        server = FileSystemServer(port=0)
+        await server.start()
+        host, port = server.get_address()
+
+        try:
+            async with FileSystemClient(host, port, pool_size=2) as client, FileSystemClient(host, port, pool_size=1) as other:
+                await client.make_new_file('/a/b/file1')
+                await client.write('/a/b/file1', 'abc')
+                await client.write('/a/b/file1', b'def', True)
+                self.assertEqual(await other.cat('/a/b/file1'), 'abcdef')
+                self.assertEqual(await other.pread('/a/b/file1', 1, 2), b'bc')
+                self.assertEqual((await other.stat('/a'))['files'], 1)
+                inode = await client.lookup('/a/b/file1')
+                await other.write_inode(inode, 'ghi', True)
+                self.assertEqual(await client.read_inode(inode, 3), b'defghi')
+                self.assertEqual(await other.ls_inode(await other.lookup('/a/b')), ['file1'])
+
+                # each client has its own current directory
+                await client.change_dir('/a/b')
+                await other.change_dir('/a')
+                self.assertEqual(client.get_current_path(), '/a/b')
+                self.assertEqual(await client.ls(), ['file1'])
+                self.assertEqual(await other.ls(), ['b/'])
+                await client.change_dir('..')
+                self.assertEqual(await client.find('file1'), ['./b/file1'])
+
+                with self.assertRaises(error.PathComponentNotFoundException):
+                    await other.cat('missing')
+                with self.assertRaises(error.InvalidPathComponentException):
+                    await client.change_dir('b/file1')
+                self.assertEqual(client.get_current_path(), '/a')
+
+                # pipelined calls from several coroutines and in one write
+                await asyncio.gather(*[client.make_new_file('c/f{}'.format(i)) for i in range(50)])
+                results = await other.call_many([('cat', 'c/f{}'.format(i)) for i in range(50)] + [('cat', 'c')])
+                self.assertEqual([result.value for result in results[:50]], [''] * 50)
+                self.assertIsInstance(results[50].error, error.InvalidPathComponentException)
+
+                results = await client.batch([('write', 'b/file1', 'x'), ('change_dir', 'c'), ('cat', 'missing')], atomic=True)
+                self.assertFalse(results[2].is_ok())
+                self.assertEqual(client.get_current_path(), '/a')
+                self.assertEqual(await client.cat('b/file1'), 'abcdefghi')
+
+                with self.assertRaises(error.InvalidOperationException):
+                    await client.call('save', '/tmp/x')
+        finally:
+            await server.close()
+
+    async def test_server_malformed_request(self) -> None:
+        server = FileSystemServer(port=0)
+        await server.start()
+        host, port = server.get_address()
+
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            # malformed frames get an error reply and the connection keeps serving
+            writer.write(encode_frame([1, '/']) + encode_frame('garbage') + encode_frame([2, '/', 'ls', None, {}]))
+            writer.write(encode_frame([3, '/', 'ls', [], {}]))
+            await writer.drain()
+
+            buffer = bytearray()
+            replies = []
+            while len(replies) < 4:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                buffer += data
+                replies.extend(pop_frames(buffer))
+
+            self.assertEqual([reply[:2] for reply in replies], [[1, False], [None, False], [2, False], [3, True]])
+            self.assertEqual(replies[0][2][0], 'InvalidOperationException')
+            writer.close()
+        finally:
+            await server.close()
+
+    async def test_server_runs_calls_off_the_event_loop(self) -> None:
+        fs = FileSystem(thread_safe=True)
+        fs.make_new_file('/f')
+        server = FileSystemServer(fs, port=0)
+        await server.start()
+        host, port = server.get_address()
+
+        try:
+            async with FileSystemClient(host, port, pool_size=1) as slow, FileSystemClient(host, port, pool_size=1) as fast:
+                with mock.patch.object(fs, 'du', side_effect=lambda path: time.sleep(0.5) or 0):
+                    slow_call = asyncio.ensure_future(slow.du('/'))
+                    await asyncio.sleep(0.05)
+                    # answered while the slow call is still running
+                    self.assertEqual(await asyncio.wait_for(fast.cat('/f'), 0.3), '')
+                    self.assertFalse(slow_call.done())
+                    self.assertEqual(await slow_call, 0)
+        finally:
+            await server.close()
+
+    async def test_server_current_dir_moved(self) -> None:
+        server = FileSystemServer(port=0)
+        await server.start()
+        host, port = server.get_address()
+
+        try:
+            async with FileSystemClient(host, port) as client, FileSystemClient(host, port) as other:
+                await client.make_new_dir('/a')
+                await client.change_dir('/a')
+                await client.make_new_file('f')
+
+                # the client's directory moved away: relative calls fail instead of landing in /b
+                await other.move('/a', '/b')
+                with self.assertRaises(error.PathComponentNotFoundException):
+                    await client.write('f', 'lost')
+                self.assertEqual(await other.cat('/b/f'), '')
+
+                # a new /a is where relative calls go again, also after the tree's directory was removed
+                await other.make_new_dir('/a')
+                await client.make_new_file('g')
+                await other.change_dir('/b')
+                await other.remove('/b')
+                await client.write('g', 'kept')
+                self.assertEqual(await client.cat('/a/g'), 'kept')
+                # absolute paths do not depend on the removed directory, relative ones fail
+                self.assertEqual(await other.cat('/a/g'), 'kept')
+                with self.assertRaises(error.PathComponentNotFoundException):
+                    await other.cat('f')
+                await other.change_dir('/a')
+                self.assertEqual(await other.cat('g'), 'kept')
+        finally:
+            await server.close()
+
+    async def test_server_keeps_tree_current_dir(self) -> None:
+        fs = FileSystem(metrics=True)
+        fs.make_new_file('/a/b/file1')
+        fs.make_new_file('/c/file1')
+        fs.change_dir('/c')
+        fs.reset_metrics()
+        server = FileSystemServer(fs, port=0)
+        await server.start()
+        host, port = server.get_address()
+
+        try:
+            async with FileSystemClient(host, port) as client:
+                await client.change_dir('/a')
+                self.assertEqual(await client.find('file1'), ['./b/file1'])
+                self.assertEqual(await client.find('file1', None, 'b'), ['b/file1'])
+                self.assertEqual(await client.ls(), ['b/'])
+                self.assertEqual(await client.du(), 0)
+
+                results = await client.batch([('change_dir', 'b'), ('find', 'file1'), ('write', 'file1', 'x')], atomic=True)
+                self.assertEqual([result.value for result in results], [None, ['./file1'], None])
+                self.assertEqual(client.get_current_path(), '/a/b')
+                results = await client.batch([('change_dir', 'file1'), ('change_dir', '..'), ('ls',)])
+                self.assertIsInstance(results[0].error, error.InvalidPathComponentException)
+                self.assertEqual(results[2].value, ['b/'])
+                self.assertEqual(client.get_current_path(), '/a')
+
+            # the tree's own current directory was not changed, and no change_dir ran on it
+            self.assertEqual(fs.get_current_path(), '/c')
+            self.assertEqual(fs.find('file1'), ['./file1'])
+            self.assertNotIn('change_dir', fs.get_metrics()['methods'])
+        finally:
+            await server.close()
+
+    async def test_concurrent_clients(self) -> None:
+        afs = AsyncFileSystem()
+        await asyncio.gather(*[afs.make_new_file('/d{}/f'.format(i)) for i in range(20)])
+        await asyncio.gather(*[afs.write('/d{}/f'.format(i), str(i)) for i in range(20)])
+
+        contents = await asyncio.gather(*[afs.cat('/d{}/f'.format(i)) for i in range(20)])
+        self.assertEqual(contents, [str(i) for i in range(20)])
+
+
 if __name__ == '__main__':
     unittest.main()
 